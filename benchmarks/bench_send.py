@@ -0,0 +1,352 @@
+# benchmarks/bench_send.py
+"""
+Benchmark del servizio universal_notifier.send / send_many.
+
+Esegue async_setup contro un HomeAssistant finto in-process: i servizi dei
+provider (telegram_bot, notify, tts, media_player, ...) sono stub con latenza
+e tasso di errore configurabili. Per ogni scenario riporta p50/p99 della
+chiamata al servizio, chiamate/secondo e memoria allocata (tracemalloc).
+
+Uso (dalla root del repository, con homeassistant installato):
+
+    python benchmarks/bench_send.py
+    python benchmarks/bench_send.py --iterations 500 --latency 20 --failure-rate 0.05
+    python benchmarks/bench_send.py --scenario broadcast_50 --service-latency tts.speak=150
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from homeassistant.core import CoreState  # noqa: E402
+
+import custom_components.universal_notifier as un  # noqa: E402
+from custom_components.universal_notifier.const import DOMAIN  # noqa: E402
+
+# ==============================================================================
+# HOME ASSISTANT FINTO
+# ==============================================================================
+
+class FakeServices:
+    """Registro servizi in-process con latenza/errori per servizio provider."""
+
+    def __init__(self, latency: float, failure_rate: float, overrides: dict) -> None:
+        self._latency = latency
+        self._failure_rate = failure_rate
+        self._overrides = overrides
+        self.handlers = {}
+        self.calls = 0
+        self.states = FakeStates()
+
+    def async_register(self, domain, service, handler, schema=None, supports_response=None):
+        self.handlers[(domain, service)] = (handler, schema)
+
+    def has_service(self, domain, service) -> bool:
+        return True
+
+    async def async_call(self, domain, service, data=None, blocking=False, **kwargs):
+        self.calls += 1
+        latency, failure_rate = self._overrides.get(
+            f"{domain}.{service}", (self._latency, self._failure_rate)
+        )
+        if latency:
+            await asyncio.sleep(latency)
+        if failure_rate and random.random() < failure_rate:
+            raise RuntimeError(f"{domain}.{service}: errore simulato")
+        if (domain, service) == ("media_player", "volume_set"):
+            self.states.set_volume(data["entity_id"], data["volume_level"])
+
+
+class FakeBus:
+    def async_listen_once(self, event_type, listener):
+        return lambda: None
+
+    def async_listen(self, event_type, listener, *args, **kwargs):
+        return lambda: None
+
+    def async_fire(self, *args, **kwargs):
+        pass
+
+
+class FakeStates:
+    """Stati dei media player: volume_level aggiornato dai volume_set."""
+
+    def __init__(self) -> None:
+        self._states = {}
+
+    def get(self, entity_id):
+        return self._states.get(entity_id)
+
+    def set_volume(self, entity_id, level) -> None:
+        self._states[entity_id] = FakeState({"volume_level": level})
+
+
+class FakeState:
+    __slots__ = ("attributes",)
+
+    def __init__(self, attributes: dict) -> None:
+        self.attributes = attributes
+
+
+class FakeConfig:
+    def __init__(self, config_dir: str) -> None:
+        self.config_dir = config_dir
+
+    def path(self, *parts) -> str:
+        return os.path.join(self.config_dir, *parts)
+
+
+class FakeHass:
+    def __init__(self, services: FakeServices, config_dir: str) -> None:
+        self.services = services
+        self.states = services.states
+        self.bus = FakeBus()
+        self.config = FakeConfig(config_dir)
+        self.data = {}
+        self.state = CoreState.running
+        self.is_running = True
+        self.loop = asyncio.get_running_loop()
+
+    def async_create_task(self, coro, *args, **kwargs):
+        # La piattaforma sensor non viene caricata: niente entità nel benchmark
+        if getattr(coro, "__name__", "") == "async_load_platform":
+            coro.close()
+            return None
+        return self.loop.create_task(coro)
+
+    def async_run_hass_job(self, job, *args):
+        # Timer di async_call_later (fine burst dei player, coalescing)
+        result = job.target(*args)
+        if asyncio.iscoroutine(result):
+            return self.loop.create_task(result)
+        return result
+
+    def async_create_background_task(self, coro, name, *args, **kwargs):
+        return self.loop.create_task(coro, name=name)
+
+    async def async_add_executor_job(self, func, *args):
+        return await self.loop.run_in_executor(None, func, *args)
+
+
+class FakeCall:
+    __slots__ = ("data", "return_response")
+
+    def __init__(self, data: dict) -> None:
+        self.data = data
+        self.return_response = True
+
+# ==============================================================================
+# CONFIGURAZIONE E SCENARI
+# ==============================================================================
+
+def build_config(voice_channels: int, text_channels: int) -> dict:
+    channels = {}
+    for i in range(voice_channels):
+        channels[f"echo_{i}"] = {
+            "service": f"notify.alexa_media_echo_{i}",
+            "is_voice": True,
+            "service_data": {"entity_id": f"media_player.echo_{i}"},
+        }
+    for i in range(text_channels):
+        channels[f"telegram_{i}"] = {
+            "service": "telegram_bot.send_message",
+            "target": str(100000 + i),
+            "alt_services": {
+                "photo": {"service": "telegram_bot.send_photo"},
+                "video": {"service": "telegram_bot.send_video"},
+            },
+        }
+    channels["phone"] = {"service": "notify.mobile_app_phone"}
+    # DND disabilitato: il benchmark deve misurare anche i canali voice
+    return {DOMAIN: {"channels": channels, "dnd": {"start": "00:00", "end": "00:00"}}}
+
+
+def _targets(prefix: str, count: int) -> list:
+    return [f"{prefix}_{i}" for i in range(count)]
+
+
+SCENARIOS = {
+    "single_telegram": lambda: {
+        "message": "Lavatrice terminata",
+        "targets": ["telegram_0"],
+    },
+    "single_voice": lambda: {
+        "message": "La lavatrice ha finito il ciclo",
+        "targets": ["echo_0"],
+    },
+    "broadcast_50": lambda: {
+        "message": "Allarme: porta d'ingresso aperta",
+        "title": "Sicurezza",
+        "targets": _targets("telegram", 40) + _targets("echo", 9) + ["phone"],
+    },
+    "telegram_media_10": lambda: {
+        "message": "Movimento rilevato",
+        "targets": _targets("telegram", 10),
+        "data": {"type": "photo"},
+        "target_data": {
+            alias: {"photo": "http://camera.local/snapshot.jpg"}
+            for alias in _targets("telegram", 10)
+        },
+    },
+    "voice_8": lambda: {
+        "message": "Il bucato è pronto, ricordati di stenderlo",
+        "priority": True,
+        "targets": _targets("echo", 8),
+    },
+    "heavy_overrides_20": lambda: {
+        "message": "Report <b>serale</b> con *markup* e http://link.example",
+        "title": "Report",
+        "targets": _targets("telegram", 15) + _targets("echo", 5),
+        "override_greetings": {
+            "morning": ["Ciao"], "afternoon": ["Salve"],
+            "evening": ["Buonasera a tutti"], "night": "Notte",
+        },
+        "data": {"parse_mode": "html", "disable_notification": True},
+        "target_data": {
+            alias: {
+                "message": f"Messaggio dedicato a {alias}",
+                "inject_title_inline": True,
+                "parse_mode": "markdown" if i % 2 else "html",
+            }
+            for i, alias in enumerate(_targets("telegram", 15))
+        },
+    },
+}
+
+# Scenari per send_many: stesso formato, ma il payload è la lista di notifiche
+BATCH_SCENARIOS = {
+    # Il report notturno: 30 notifiche che prima erano 30 chiamate a send
+    "send_many_30": lambda: {
+        "notifications": [
+            {
+                "message": f"Report {i}: tutto regolare",
+                "targets": [f"telegram_{i % 5}"] + (["echo_0"] if i % 10 == 0 else []),
+            }
+            for i in range(30)
+        ],
+    },
+}
+
+# ==============================================================================
+# ESECUZIONE
+# ==============================================================================
+
+def _percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+async def run_scenario(name: str, args, overrides: dict, config_dir: str) -> dict:
+    services = FakeServices(args.latency / 1000, args.failure_rate, overrides)
+    hass = FakeHass(services, config_dir)
+
+    config = un.CONFIG_SCHEMA(build_config(voice_channels=10, text_channels=40))
+    config[DOMAIN]["concurrent"] = args.concurrent
+    config[DOMAIN]["max_concurrency"] = args.max_concurrency
+    await un.async_setup(hass, config)
+
+    if name in BATCH_SCENARIOS:
+        handler, schema = services.handlers[(DOMAIN, "send_many")]
+        payload = schema(BATCH_SCENARIOS[name]())
+    else:
+        handler, schema = services.handlers[(DOMAIN, "send")]
+        payload = schema(SCENARIOS[name]())
+
+    # Warm-up (cache di rendering, schedule, formatter)
+    for _ in range(min(10, args.iterations)):
+        await handler(FakeCall(payload))
+
+    samples = []
+    calls_before = services.calls
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        t0 = time.perf_counter()
+        await handler(FakeCall(payload))
+        samples.append(time.perf_counter() - t0)
+        # Come in HA, il loop gira tra una chiamata e l'altra (pulizia dei timer cancellati)
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    provider_calls = services.calls - calls_before
+
+    # Passata separata per la memoria: tracemalloc rallenta le misure di tempo
+    tracemalloc.start()
+    base_current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for _ in range(min(args.iterations, 100)):
+        await handler(FakeCall(payload))
+        await asyncio.sleep(0)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "scenario": name,
+        "p50_ms": statistics.median(samples) * 1000,
+        "p99_ms": _percentile(samples, 0.99) * 1000,
+        "calls_s": args.iterations / elapsed if elapsed else float("inf"),
+        "provider_calls": provider_calls // max(1, args.iterations),
+        "peak_kib": (peak - base_current) / 1024,
+        "retained_kib": (current - base_current) / 1024,
+    }
+
+
+def _parse_overrides(values: list) -> dict:
+    """--service-latency telegram_bot.send_message=120[:0.1] (ms[:failure_rate])"""
+    overrides = {}
+    for value in values or []:
+        service, _, spec = value.partition("=")
+        latency, _, failure = spec.partition(":")
+        overrides[service] = (float(latency) / 1000, float(failure or 0))
+    return overrides
+
+
+async def main(args) -> None:
+    overrides = _parse_overrides(args.service_latency)
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".config")
+    names = args.scenario or [*SCENARIOS, *BATCH_SCENARIOS]
+
+    print(
+        f"iterations={args.iterations} latency={args.latency}ms "
+        f"failure_rate={args.failure_rate} concurrent={args.concurrent}"
+    )
+    header = f"{'scenario':<22}{'p50 ms':>10}{'p99 ms':>10}{'calls/s':>12}{'prov/call':>11}{'peak KiB':>11}{'kept KiB':>11}"
+    print(header)
+    print("-" * len(header))
+    for name in names:
+        row = await run_scenario(name, args, overrides, config_dir)
+        print(
+            f"{row['scenario']:<22}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}"
+            f"{row['calls_s']:>12.1f}{row['provider_calls']:>11}"
+            f"{row['peak_kib']:>11.1f}{row['retained_kib']:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="latenza provider di default (ms)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="tasso di errore di default (0-1)")
+    parser.add_argument("--service-latency", action="append", metavar="SERVICE=MS[:FAIL]",
+                        help="latenza/errori per un servizio specifico, ripetibile")
+    parser.add_argument("--concurrent", action="store_true", help="dispatch concorrente")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--scenario", action="append", choices=sorted([*SCENARIOS, *BATCH_SCENARIOS]))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="mostra i log del componente")
+    args = parser.parse_args()
+
+    # Gli errori simulati non devono sporcare la tabella dei risultati
+    logging.getLogger("custom_components.universal_notifier").setLevel(
+        logging.DEBUG if args.verbose else logging.CRITICAL
+    )
+
+    random.seed(args.seed)
+    asyncio.run(main(args))
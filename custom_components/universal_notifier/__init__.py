@@ -1,11 +1,18 @@
 # /config/custom_components/universal_notifier/__init__.py
 
 import logging
+import os
 import random
-import re
+import time
+import uuid
 import voluptuous as vol
 import homeassistant.helpers.config_validation as cv
-from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP, Platform
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
+from homeassistant.helpers import discovery
+from homeassistant.helpers.reload import async_integration_yaml_config
+from homeassistant.helpers.service import async_register_admin_service
+from homeassistant.helpers.start import async_at_started
 from homeassistant.util import dt as dt_util
 
 # Importiamo TUTTE le costanti necessarie
@@ -14,17 +21,62 @@ from .const import (
     # Config keys
     CONF_CHANNELS, CONF_ASSISTANT_NAME, CONF_DATE_FORMAT,
     CONF_GREETINGS, CONF_TIME_SLOTS, CONF_DND, CONF_BOLD_PREFIX,
+    CONF_CONCURRENT, CONF_MAX_CONCURRENCY, CONF_TARGET_TIMEOUT,
+    CONF_RETRY, CONF_MAX_ATTEMPTS, CONF_BASE_DELAY, CONF_MAX_DELAY, CONF_MAX_SIZE,
+    CONF_RATE_LIMIT, CONF_RATE, CONF_BURST, CONF_POLICY, CONF_MAX_WAIT,
+    CONF_DEDUPE, CONF_WINDOW, CONF_MAX_ENTRIES, CONF_COALESCE, CONF_NOTIFICATIONS,
+    CONF_BACKGROUND, CONF_ATTACHMENTS, CONF_DIRECTORY, CONF_MAX_SIZE_MB, CONF_TTL,
+    CONF_RESTORE_VOLUME, CONF_RESTORE_DELAY, CONF_GROUPS,
+    CONF_PRIORITY_CONCURRENCY, CONF_PRIORITY_TIMEOUT, CONF_DEFER, CONF_MAX_DEFERRED,
+    CONF_CIRCUIT_BREAKER, CONF_FAILURE_THRESHOLD, CONF_RESET_TIMEOUT, CONF_HISTORY, CONF_PERSIST,
     # Service keys (Inputs)
     CONF_MESSAGE, CONF_TITLE, CONF_TARGETS, CONF_DATA, CONF_TARGET_DATA,
     CONF_PRIORITY, CONF_SKIP_GREETING, CONF_INCLUDE_TIME, CONF_OVERRIDE_GREETINGS,
+    CONF_ONLY_OCCUPIED, CONF_PRESENCE_FALLBACK,
     # Inner Channel keys
     CONF_SERVICE, CONF_SERVICE_DATA, CONF_TARGET, CONF_ENTITY_ID,
-    CONF_IS_VOICE, CONF_ALT_SERVICES, CONF_TYPE,
+    CONF_IS_VOICE, CONF_ALT_SERVICES, CONF_TYPE, CONF_MESSAGE_TEMPLATE, CONF_TITLE_TEMPLATE,
+    CONF_PRESENCE,
+    PARSE_MODE_ROOT, PARSE_MODE_DATA,
     # Defaults
     DEFAULT_NAME, DEFAULT_DATE_FORMAT, DEFAULT_INCLUDE_TIME,
     DEFAULT_GREETINGS, DEFAULT_TIME_SLOTS, DEFAULT_DND, 
-    DEFAULT_BOLD_PREFIX, PRIORITY_VOLUME, COMPANION_COMMANDS
+    DEFAULT_BOLD_PREFIX, PRIORITY_VOLUME, COMPANION_COMMANDS, FALLBACK_VOLUME,
+    DEFAULT_CONCURRENT, DEFAULT_MAX_CONCURRENCY, DEFAULT_TARGET_TIMEOUT,
+    DEFAULT_PRIORITY_CONCURRENCY, DEFAULT_PRIORITY_TIMEOUT, DEFAULT_MAX_DEFERRED,
+    DEFAULT_ATTACHMENT_SIZE_MB, DEFAULT_ATTACHMENT_TTL, ATTACHMENT_DIR,
+    DEFAULT_FAILURE_THRESHOLD, DEFAULT_RESET_TIMEOUT, FALLBACK_SERVICE,
+    DEFAULT_HISTORY_SIZE, DEFAULT_HISTORY_LIMIT, TEMPLATE_CACHE_SIZE,
+    DEFAULT_MAX_ATTEMPTS, DEFAULT_BASE_DELAY, DEFAULT_MAX_DELAY, DEFAULT_QUEUE_SIZE,
+    DEFAULT_DEDUPE_WINDOW, DEFAULT_DEDUPE_ENTRIES, DEFAULT_RESTORE_VOLUME, DEFAULT_RESTORE_DELAY,
+    QUEUE_FILE, RATE_POLICY_QUEUE, RATE_POLICY_DROP, DEFAULT_RATE_POLICY, DEFAULT_MAX_WAIT,
+    # hass.data e servizi
+    DATA_RETRY_QUEUE, DATA_RATE_LIMITER, DATA_METRICS, DATA_SEQUENCER, DATA_LANES, DATA_DIGEST,
+    DATA_ATTACHMENTS, DATA_BREAKERS, DATA_JOURNAL, DATA_OCCUPANCY,
+    SERVICE_SEND, SERVICE_SEND_MANY, SERVICE_STATS, SERVICE_QUEUE_STATUS, SERVICE_QUEUE_FLUSH,
+    SERVICE_QUEUE_CANCEL, SERVICE_RELOAD, SERVICE_HISTORY, ATTR_IDS, ATTR_DELIVERY_ID, ATTR_PENDING,
+    ATTR_OUTCOMES, ATTR_START, ATTR_END, ATTR_LIMIT,
+    EVENT_DELIVERED, EVENT_FAILED,
+    # Esiti
+    RESULT_SENT, RESULT_SKIPPED, RESULT_FAILED, RESULT_RATE_LIMITED, RESULT_DEDUPLICATED,
+    RESULT_COALESCED, RESULT_DEFERRED, RESULT_CIRCUIT_OPEN, RESULT_TIMED_OUT, RESULT_QUEUED,
+    RESULT_PREEMPTED,
 )
+from .attachments import AttachmentCache
+from .breaker import CircuitBreakers
+from .dedupe import Coalescer, TTLCache, dedupe_key
+from .digest import DndDigest, combine_messages
+from .dispatcher import Delivery, DispatchLanes, async_dispatch, new_results
+from .journal import DeliveryJournal
+from .metrics import NotifierMetrics
+from .occupancy import OccupancyTracker
+from .payload import EMPTY_LAYER, LayeredPayload
+from .routing import expand_groups, resolve_targets
+from .render import MessageRenderer
+from .retry_queue import RetryQueue
+from .state import NotifierState, compile_state, presence_map
+from .sequencer import PlayerSequencer, volume_target
+from .templates import TemplateCache
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -32,95 +84,160 @@ _LOGGER = logging.getLogger(__name__)
 # HELPER FUNCTIONS
 # ==============================================================================
 
-def is_time_in_range(start_str: str, end_str: str, now_time) -> bool:
-    """Controlla se l'orario attuale è in un range (gestisce accavallamento notte)."""
-    start = dt_util.parse_time(start_str)
-    end = dt_util.parse_time(end_str)
-    if start <= end:
-        return start <= now_time <= end
-    else:
-        return start <= now_time or now_time <= end
-
-def get_current_slot_info(slots_conf: dict, now_time) -> tuple:
-    """Restituisce (nome_slot, volume) basandosi sull'ora attuale."""
-    # Ordiniamo gli slot per orario di inizio
-    sorted_slots = []
-    for name, data in slots_conf.items():
-        t_obj = dt_util.parse_time(data["start"])
-        sorted_slots.append((name, t_obj, data.get("volume", 0.5)))
-    
-    sorted_slots.sort(key=lambda x: x[1]) # Ordina per orario
-    
-    current_slot = "day" # Fallback
-    current_vol = 0.5
-    
-    # Logica semplice: trova l'ultimo slot passato
-    for name, start_time, vol_val in sorted_slots:
-        if now_time >= start_time:
-            current_slot = name
-            current_vol = vol_val
-    
-    # Se siamo prima del primo slot (es. 01:00 e il primo slot è 07:00),
-    # allora siamo tecnicamente nell'ultimo slot della lista (notte)
-    if now_time < sorted_slots[0][1]:
-        current_slot = sorted_slots[-1][0]
-        current_vol = sorted_slots[-1][2]
-        
-    return current_slot, current_vol
-
-def clean_text_for_tts(text: str) -> str:
-    """Rimuove caratteri speciali per la sintesi vocale."""
-    if not text: return ""
-    # Rimuove markdown base e parentesi
-    text = re.sub(r'[*_`\[\]]', '', text)
-    # Rimuove URL
-    text = re.sub(r'http\S+', '', text)
-    return text.strip()
-
-def sanitize_text_visual(text: str, parse_mode: str = None) -> str:
-    if not text:
-        return ""
-    if parse_mode and "html" in parse_mode.lower():
-        text = text.replace("<", "&lt;").replace(">", "&gt;")
-    return text
-
-def apply_formatting(text: str, parse_mode: str, style: str = "bold") -> str:
-    if not text:
-        return ""
-    mode = parse_mode.lower() if parse_mode else ""
-    
-    if "html" in mode:
-        if style == "bold":
-            return f"<b>{text}</b>"
-    
-    elif "markdown" in mode:
-        return f"*{text}*"
-        
-    return text
+def _is_command(message) -> bool:
+    """Comandi Companion App: inviati RAW, senza prefissi né saluti."""
+    return message in COMPANION_COMMANDS or str(message).startswith("command_")
+
+def _validate_groups(conf: dict) -> dict:
+    """Gruppi verificati al caricamento della configurazione, non ad ogni invio."""
+    try:
+        expand_groups(conf.get(CONF_GROUPS, {}), conf[CONF_CHANNELS])
+    except ValueError as e:
+        raise vol.Invalid(str(e), path=[CONF_GROUPS]) from e
+    return conf
 
 # ==============================================================================
 # SCHEMAS
 # ==============================================================================
 
+ALT_SERVICE_SCHEMA = vol.Schema({
+    vol.Required(CONF_SERVICE): cv.string,
+    vol.Optional(CONF_SERVICE_DATA): dict,
+}, extra=vol.ALLOW_EXTRA)
+
+def _default_burst(value: dict) -> dict:
+    """Se non indicato, il burst è pari a un secondo di rate (minimo 1)."""
+    if value.get(CONF_BURST) is None:
+        value[CONF_BURST] = max(1, int(value[CONF_RATE]))
+    return value
+
+RATE_LIMIT_SCHEMA = vol.All(vol.Schema({
+    vol.Required(CONF_RATE): vol.All(vol.Coerce(float), vol.Range(min=0.001)), # messaggi/secondo
+    vol.Optional(CONF_BURST): cv.positive_int,
+    vol.Optional(CONF_POLICY, default=DEFAULT_RATE_POLICY): vol.In(
+        [RATE_POLICY_QUEUE, RATE_POLICY_DROP]
+    ),
+    vol.Optional(CONF_MAX_WAIT, default=DEFAULT_MAX_WAIT): vol.All(
+        vol.Coerce(float), vol.Range(min=0)
+    ),
+}), _default_burst)
+
 CHANNEL_SCHEMA = vol.Schema({
     vol.Required(CONF_SERVICE): cv.string,
     vol.Optional(CONF_TARGET): cv.string, # Entity ID del provider (es. tts.google)
     vol.Optional(CONF_IS_VOICE, default=False): cv.boolean,
     vol.Optional(CONF_SERVICE_DATA): dict, # Dati statici (es. media_player target)
-    vol.Optional(CONF_ALT_SERVICES): dict
+    vol.Optional(CONF_ALT_SERVICES): vol.Schema({cv.string: ALT_SERVICE_SCHEMA}),
+    vol.Optional(CONF_RATE_LIMIT): RATE_LIMIT_SCHEMA,
+    # Secondi in cui più messaggi testuali allo stesso canale diventano uno solo
+    vol.Optional(CONF_COALESCE): vol.All(vol.Coerce(float), vol.Range(min=0.1)),
+    # Jinja al posto del formato standard ([nome - ora] + titolo), compilato al setup
+    vol.Optional(CONF_MESSAGE_TEMPLATE): cv.string,
+    vol.Optional(CONF_TITLE_TEMPLATE): cv.string,
+    # Sensori di presenza della stanza (occupancy, motion, person, zone)
+    vol.Optional(CONF_PRESENCE): cv.entity_ids,
+})
+
+TIME_SLOT_SCHEMA = vol.Schema({
+    vol.Required("start"): cv.time,
+    vol.Optional("volume", default=FALLBACK_VOLUME): vol.All(
+        vol.Coerce(float), vol.Range(min=0.0, max=1.0)
+    ),
+})
+
+DND_SCHEMA = vol.Schema({
+    vol.Required("start"): cv.time,
+    vol.Required("end"): cv.time,
+    # Notifiche vocali rimandate a fine DND (riepilogo) invece che scartate
+    vol.Optional(CONF_DEFER, default=False): cv.boolean,
+    vol.Optional(CONF_MAX_DEFERRED, default=DEFAULT_MAX_DEFERRED): cv.positive_int,
+})
+
+RETRY_SCHEMA = vol.Schema({
+    vol.Optional(CONF_MAX_ATTEMPTS, default=DEFAULT_MAX_ATTEMPTS): vol.All(
+        vol.Coerce(int), vol.Range(min=2)
+    ),
+    vol.Optional(CONF_BASE_DELAY, default=DEFAULT_BASE_DELAY): vol.All(
+        vol.Coerce(float), vol.Range(min=0.1)
+    ),
+    vol.Optional(CONF_MAX_DELAY, default=DEFAULT_MAX_DELAY): vol.All(
+        vol.Coerce(float), vol.Range(min=1)
+    ),
+    vol.Optional(CONF_MAX_SIZE, default=DEFAULT_QUEUE_SIZE): cv.positive_int,
+})
+
+DEDUPE_SCHEMA = vol.Schema({
+    vol.Optional(CONF_WINDOW, default=DEFAULT_DEDUPE_WINDOW): vol.All(
+        vol.Coerce(float), vol.Range(min=0.1)
+    ),
+    vol.Optional(CONF_MAX_ENTRIES, default=DEFAULT_DEDUPE_ENTRIES): cv.positive_int,
+})
+
+ATTACHMENTS_SCHEMA = vol.Schema({
+    vol.Optional(CONF_DIRECTORY): cv.string,
+    vol.Optional(CONF_MAX_SIZE_MB, default=DEFAULT_ATTACHMENT_SIZE_MB): vol.All(
+        vol.Coerce(float), vol.Range(min=1)
+    ),
+    vol.Optional(CONF_TTL, default=DEFAULT_ATTACHMENT_TTL): vol.All(
+        vol.Coerce(float), vol.Range(min=0)
+    ),
+})
+
+CIRCUIT_BREAKER_SCHEMA = vol.Schema({
+    vol.Optional(CONF_FAILURE_THRESHOLD, default=DEFAULT_FAILURE_THRESHOLD): cv.positive_int,
+    vol.Optional(CONF_RESET_TIMEOUT, default=DEFAULT_RESET_TIMEOUT): vol.All(
+        vol.Coerce(float), vol.Range(min=1)
+    ),
+})
+
+HISTORY_SCHEMA = vol.Schema({
+    vol.Optional(CONF_MAX_ENTRIES, default=DEFAULT_HISTORY_SIZE): cv.positive_int,
+    # Giornale salvato in .storage e ricaricato al riavvio
+    vol.Optional(CONF_PERSIST, default=False): cv.boolean,
 })
 
 CONFIG_SCHEMA = vol.Schema({
-    DOMAIN: vol.Schema({
+    DOMAIN: vol.All(vol.Schema({
         vol.Required(CONF_CHANNELS): vol.Schema({cv.string: CHANNEL_SCHEMA}),
+        # Gruppi di canali (anche annidati), utilizzabili in 'targets'
+        vol.Optional(CONF_GROUPS, default={}): vol.Schema({
+            cv.string: vol.All(cv.ensure_list, [cv.string]),
+        }),
+        # Canali o gruppi usati con 'only_occupied' quando nessuna stanza è occupata
+        vol.Optional(CONF_PRESENCE_FALLBACK): vol.All(cv.ensure_list, [cv.string]),
         vol.Optional(CONF_ASSISTANT_NAME, default=DEFAULT_NAME): cv.string,
         vol.Optional(CONF_DATE_FORMAT, default=DEFAULT_DATE_FORMAT): cv.string,
         vol.Optional(CONF_INCLUDE_TIME, default=DEFAULT_INCLUDE_TIME): cv.boolean,
         vol.Optional(CONF_BOLD_PREFIX, default=DEFAULT_BOLD_PREFIX): cv.boolean, # <--- Config Globale
-        vol.Optional(CONF_TIME_SLOTS, default=DEFAULT_TIME_SLOTS): dict,
-        vol.Optional(CONF_DND, default=DEFAULT_DND): dict,
+        vol.Optional(CONF_TIME_SLOTS, default=DEFAULT_TIME_SLOTS): vol.Schema({cv.string: TIME_SLOT_SCHEMA}),
+        vol.Optional(CONF_DND, default=DEFAULT_DND): DND_SCHEMA,
         vol.Optional(CONF_GREETINGS, default=DEFAULT_GREETINGS): dict,
-    }),
+        vol.Optional(CONF_CONCURRENT, default=DEFAULT_CONCURRENT): cv.boolean,
+        vol.Optional(CONF_MAX_CONCURRENCY, default=DEFAULT_MAX_CONCURRENCY): cv.positive_int,
+        vol.Optional(CONF_TARGET_TIMEOUT, default=DEFAULT_TARGET_TIMEOUT): vol.All(
+            vol.Coerce(float), vol.Range(min=0.1)
+        ),
+        vol.Optional(CONF_PRIORITY_CONCURRENCY, default=DEFAULT_PRIORITY_CONCURRENCY): cv.positive_int,
+        vol.Optional(CONF_PRIORITY_TIMEOUT, default=DEFAULT_PRIORITY_TIMEOUT): vol.All(
+            vol.Coerce(float), vol.Range(min=0.1)
+        ),
+        vol.Optional(CONF_RESTORE_VOLUME, default=DEFAULT_RESTORE_VOLUME): cv.boolean,
+        vol.Optional(CONF_RESTORE_DELAY, default=DEFAULT_RESTORE_DELAY): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        # Sezione presente (anche vuota: 'retry: {}') = coda di retry abilitata
+        vol.Optional(CONF_RETRY): vol.Any(None, RETRY_SCHEMA),
+        # Tetto globale su tutti i canali
+        vol.Optional(CONF_RATE_LIMIT): RATE_LIMIT_SCHEMA,
+        # Sezione presente (anche vuota) = soppressione dei duplicati abilitata
+        vol.Optional(CONF_DEDUPE): vol.Any(None, DEDUPE_SCHEMA),
+        # Sezione presente (anche vuota) = media Telegram scaricati una volta sola
+        vol.Optional(CONF_ATTACHMENTS): vol.Any(None, ATTACHMENTS_SCHEMA),
+        # Sezione presente (anche vuota) = circuito per canale sui provider che non rispondono
+        vol.Optional(CONF_CIRCUIT_BREAKER): vol.Any(None, CIRCUIT_BREAKER_SCHEMA),
+        # Giornale delle consegne (sempre attivo, in memoria)
+        vol.Optional(CONF_HISTORY, default={}): HISTORY_SCHEMA,
+    }), _validate_groups),
 }, extra=vol.ALLOW_EXTRA)
 
 # Schema specifico per il servizio 'send' usando le COSTANTI
@@ -136,8 +253,42 @@ SEND_SERVICE_SCHEMA = vol.Schema({
     vol.Optional(CONF_ASSISTANT_NAME): cv.string,
     vol.Optional(CONF_BOLD_PREFIX): cv.boolean,
     vol.Optional(CONF_OVERRIDE_GREETINGS): dict,
+    vol.Optional(CONF_CONCURRENT): cv.boolean,
+    # Risponde subito con un delivery_id; gli esiti arrivano come eventi
+    vol.Optional(CONF_BACKGROUND): cv.boolean,
+    # Solo i canali con presenza occupata (gli altri canali non cambiano)
+    vol.Optional(CONF_ONLY_OCCUPIED): cv.boolean,
+    vol.Optional(CONF_PRESENCE_FALLBACK): vol.All(cv.ensure_list, [cv.string]),
 }, extra=vol.ALLOW_EXTRA)
 
+# Batch di notifiche: validate tutte insieme in un'unica chiamata
+SEND_MANY_SERVICE_SCHEMA = vol.Schema({
+    vol.Required(CONF_NOTIFICATIONS): vol.All(
+        cv.ensure_list, vol.Length(min=1), [SEND_SERVICE_SCHEMA]
+    ),
+    vol.Optional(CONF_CONCURRENT): cv.boolean,
+    vol.Optional(CONF_BACKGROUND): cv.boolean,
+})
+
+# Filtri del giornale delle consegne
+HISTORY_SERVICE_SCHEMA = vol.Schema({
+    vol.Optional(CONF_TARGETS): vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional(ATTR_OUTCOMES): vol.All(cv.ensure_list, [vol.In([
+        RESULT_SENT, RESULT_FAILED, RESULT_TIMED_OUT, RESULT_SKIPPED, RESULT_QUEUED,
+        RESULT_RATE_LIMITED, RESULT_DEDUPLICATED, RESULT_COALESCED, RESULT_PREEMPTED,
+        RESULT_DEFERRED, RESULT_CIRCUIT_OPEN,
+    ])]),
+    vol.Optional(ATTR_START): cv.datetime,
+    vol.Optional(ATTR_END): cv.datetime,
+    vol.Optional(ATTR_LIMIT, default=DEFAULT_HISTORY_LIMIT): cv.positive_int,
+})
+
+# Filtri comuni ai servizi di gestione della coda
+QUEUE_FILTER_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_IDS): vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional(CONF_TARGETS): vol.All(cv.ensure_list, [cv.string]),
+})
+
 # ==============================================================================
 # MAIN LOGIC
 # ==============================================================================
@@ -150,49 +301,218 @@ async def async_setup(hass: HomeAssistant, config: dict):
     
     conf = config[DOMAIN]
     
-    # Caricamento configurazioni globali
-    channels_config = conf[CONF_CHANNELS]
-    global_name = conf[CONF_ASSISTANT_NAME]
-    global_date_fmt = conf[CONF_DATE_FORMAT]
-    global_include_time = conf[CONF_INCLUDE_TIME]
-    
-    time_slots_conf = conf.get(CONF_TIME_SLOTS, DEFAULT_TIME_SLOTS)
-    dnd_conf = conf.get(CONF_DND, DEFAULT_DND)
-    base_greetings = conf.get(CONF_GREETINGS, DEFAULT_GREETINGS)
-
-    async def async_send_notification(call: ServiceCall):
+    # Template di canale compilati una volta sola (riusati anche dal reload)
+    template_cache = TemplateCache(hass, TEMPLATE_CACHE_SIZE)
+
+    # Canali, gruppi, slot, DND, saluti e rate limit: compilati in uno stato
+    # immutabile, sostituito in blocco dal servizio 'reload'
+    state = compile_state(conf, template_cache)
+
+    hass.data[DOMAIN] = {}
+
+    # Corsie di dispatch condivise tra tutte le chiamate: la priorità ha
+    # un budget di concorrenza proprio e un timeout più stretto
+    lanes = DispatchLanes(
+        max_concurrency=conf.get(CONF_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY),
+        timeout=conf.get(CONF_TARGET_TIMEOUT, DEFAULT_TARGET_TIMEOUT),
+        priority_max_concurrency=conf.get(CONF_PRIORITY_CONCURRENCY, DEFAULT_PRIORITY_CONCURRENCY),
+        priority_timeout=conf.get(CONF_PRIORITY_TIMEOUT, DEFAULT_PRIORITY_TIMEOUT),
+    )
+    hass.data[DOMAIN][DATA_LANES] = lanes
+
+    # Metriche: contatori e istogrammi per canale, allocati una volta sola
+    metrics = NotifierMetrics(state.routes.keys())
+    hass.data[DOMAIN][DATA_METRICS] = metrics
+    hass.data[DOMAIN][DATA_RATE_LIMITER] = state.rate_limiter
+
+    # Annunci serializzati per media player, con volume_set solo se serve
+    # e ripristino del volume originale a fine burst
+    sequencer = PlayerSequencer(
+        hass,
+        restore=conf.get(CONF_RESTORE_VOLUME, DEFAULT_RESTORE_VOLUME),
+        restore_delay=conf.get(CONF_RESTORE_DELAY, DEFAULT_RESTORE_DELAY),
+    )
+    hass.data[DOMAIN][DATA_SEQUENCER] = sequencer
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, sequencer.async_stop)
+
+    # Deduplica (opzionale): hash delle ultime notifiche con scadenza
+    dedupe_cache = None
+    if CONF_DEDUPE in conf:
+        dedupe_conf = DEDUPE_SCHEMA(conf[CONF_DEDUPE] or {})
+        dedupe_cache = TTLCache(dedupe_conf[CONF_WINDOW], dedupe_conf[CONF_MAX_ENTRIES])
+
+    # Occupazione delle stanze: mappa in memoria aggiornata dagli eventi di stato
+    occupancy = OccupancyTracker(hass)
+    occupancy.update(presence_map(state))
+    hass.data[DOMAIN][DATA_OCCUPANCY] = occupancy
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, occupancy.async_stop)
+
+    # Giornale delle consegne: ring buffer degli ultimi esiti per target
+    history_conf = conf.get(CONF_HISTORY) or HISTORY_SCHEMA({})
+    journal = DeliveryJournal(hass, history_conf[CONF_MAX_ENTRIES], history_conf[CONF_PERSIST])
+    await journal.async_load()
+    hass.data[DOMAIN][DATA_JOURNAL] = journal
+
+    # Circuit breaker per canale (opzionale): i provider giù non fanno aspettare nessuno
+    breakers = None
+    if CONF_CIRCUIT_BREAKER in conf:
+        breaker_conf = CIRCUIT_BREAKER_SCHEMA(conf[CONF_CIRCUIT_BREAKER] or {})
+        breakers = CircuitBreakers(
+            breaker_conf[CONF_FAILURE_THRESHOLD], breaker_conf[CONF_RESET_TIMEOUT]
+        )
+        hass.data[DOMAIN][DATA_BREAKERS] = breakers
+
+    # Coda persistente dei retry (opzionale)
+    retry_queue = None
+    if CONF_RETRY in conf:
+        retry_conf = RETRY_SCHEMA(conf[CONF_RETRY] or {})
+        retry_queue = RetryQueue(
+            hass,
+            hass.config.path(".storage", QUEUE_FILE),
+            max_attempts=retry_conf[CONF_MAX_ATTEMPTS],
+            base_delay=retry_conf[CONF_BASE_DELAY],
+            max_delay=retry_conf[CONF_MAX_DELAY],
+            max_size=retry_conf[CONF_MAX_SIZE],
+            lanes=lanes,
+            metrics=metrics,
+            sequencer=sequencer,
+            breakers=breakers,
+            journal=journal,
+            schedule=state.schedule,
+        )
+        await retry_queue.async_load()
+        hass.data[DOMAIN][DATA_RETRY_QUEUE] = retry_queue
+
+        # Il worker parte a HA avviato, quando i servizi dei provider sono registrati
+        async_at_started(hass, lambda _: retry_queue.start())
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, retry_queue.async_stop)
+
+    # Cache degli allegati (opzionale): un download per URL, file locali per Telegram
+    attachments = None
+    if CONF_ATTACHMENTS in conf:
+        attachments_conf = ATTACHMENTS_SCHEMA(conf[CONF_ATTACHMENTS] or {})
+        directory = attachments_conf.get(CONF_DIRECTORY) or os.path.join(
+            hass.config.media_dirs.get("local", hass.config.path("media")), ATTACHMENT_DIR
+        )
+        attachments = AttachmentCache(
+            hass,
+            directory,
+            max_bytes=int(attachments_conf[CONF_MAX_SIZE_MB] * 1024 * 1024),
+            ttl=attachments_conf[CONF_TTL],
+            timeout=lanes.normal.timeout,
+        )
+        await attachments.async_setup()
+        hass.data[DOMAIN][DATA_ATTACHMENTS] = attachments
+
+    async def async_dispatch_background(deliveries: list) -> None:
+        """Invio fuori dalla chiamata al servizio (es. messaggi combinati)."""
+        await async_dispatch(
+            hass, deliveries, new_results(),
+            concurrent=state.concurrent,
+            lanes=lanes,
+            on_failure=retry_queue.enqueue if retry_queue else None,
+            metrics=metrics,
+            sequencer=sequencer,
+            breakers=breakers,
+            journal=journal,
+        )
+
+    coalescer = Coalescer(hass, async_dispatch_background)
+    # Allo stop i messaggi in attesa partono subito invece di andare persi
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, coalescer.async_flush_all)
+
+    async def async_flush_digest(batch: list) -> None:
         """
-        Handler principale del servizio 'send'.
+        Fine DND: un annuncio di riepilogo per ogni canale vocale (e contesto),
+        ricostruito con 'data' e target_data delle chiamate originali.
+        """
+        cfg = state
+        now = dt_util.now()
+        schedule_state = cfg.schedule.state(now)
+        results = new_results()
+        deliveries = []
+        for alias, context, messages in batch:
+            notification = {CONF_MESSAGE: combine_messages(messages), CONF_TARGETS: [alias]}
+            if CONF_DATA in context:
+                notification[CONF_DATA] = context[CONF_DATA]
+            if CONF_TARGET_DATA in context:
+                notification[CONF_TARGET_DATA] = {alias: context[CONF_TARGET_DATA]}
+            deliveries.extend(build_deliveries(cfg, notification, now, schedule_state, results))
+        await async_dispatch_background(deliveries)
+
+    # Riepilogo DND (opzionale): notifiche vocali rimandate e persistite
+    digest = None
+
+    async def async_setup_digest(cfg: NotifierState) -> None:
+        """Crea il riepilogo al primo uso (setup o reload), altrimenti lo aggiorna."""
+        nonlocal digest
+        if digest is not None:
+            digest.update(cfg.schedule, cfg.max_deferred)
+            return
+        new_digest = DndDigest(hass, cfg.schedule, cfg.max_deferred, flush=async_flush_digest)
+        await new_digest.async_load()
+        digest = new_digest
+        hass.data[DOMAIN][DATA_DIGEST] = digest
+        async_at_started(hass, lambda _: new_digest.start())
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, new_digest.async_stop)
+
+    if state.defer_dnd:
+        await async_setup_digest(state)
+
+    def build_deliveries(cfg: NotifierState, data: dict, now, schedule_state, results: dict) -> list:
+        """
+        Costruisce le consegne di una singola notifica, senza inviarle.
+        Configurazione (`cfg`) e contesto orario (now, slot, DND) sono letti
+        dal chiamante, una volta per chiamata al servizio.
         """
+        routes = cfg.routes
+        rate_limiter = cfg.rate_limiter
+
         # 1. Parsing Input Runtime
-        global_raw_message = call.data.get(CONF_MESSAGE, "")
-        title = call.data.get(CONF_TITLE)
-        runtime_data = call.data.get(CONF_DATA, {})
-        target_specific_data = call.data.get(CONF_TARGET_DATA, {})
-        targets = call.data.get(CONF_TARGETS, [])
+        global_raw_message = data.get(CONF_MESSAGE, "")
+        title = data.get(CONF_TITLE)
+        runtime_data = data.get(CONF_DATA, {})
+        target_specific_data = data.get(CONF_TARGET_DATA, {})
+        # Gruppi sostituiti dai loro canali, senza duplicati
+        targets = resolve_targets(data.get(CONF_TARGETS, []), cfg.groups)
+
+        # Solo stanze occupate: i canali con presenza e stanza vuota sono saltati;
+        # se nessuna stanza è occupata si usa il fallback
+        if data.get(CONF_ONLY_OCCUPIED):
+            targets, vacant = occupancy.split(targets)
+            for target_alias in vacant:
+                _LOGGER.debug(f"UniNotifier: nessuno presente, skip {target_alias}")
+                results[RESULT_SKIPPED].append(target_alias)
+                metrics.channels[target_alias].unoccupied += 1
+                journal.add(target_alias, routes[target_alias].full_service_name,
+                            RESULT_SKIPPED, "unoccupied")
+            if vacant and not any(occupancy.tracks(alias) for alias in targets):
+                fallback = data.get(CONF_PRESENCE_FALLBACK) or cfg.presence_fallback
+                extra = [
+                    alias for alias in resolve_targets(list(fallback), cfg.groups)
+                    if alias not in targets and alias not in vacant
+                ] if fallback else []
+                if extra:
+                    _LOGGER.info(f"UniNotifier: nessuna stanza occupata, uso {', '.join(extra)}")
+                    targets.extend(extra)
         
         # Override parametri opzionali
-        override_name = call.data.get(CONF_ASSISTANT_NAME, global_name)
-        skip_greeting = call.data.get(CONF_SKIP_GREETING, False)
-        include_time = call.data.get(CONF_INCLUDE_TIME, global_include_time)
-        is_priority = call.data.get(CONF_PRIORITY, False)
+        override_name = data.get(CONF_ASSISTANT_NAME, cfg.assistant_name)
+        skip_greeting = data.get(CONF_SKIP_GREETING, False)
+        include_time = data.get(CONF_INCLUDE_TIME, cfg.include_time)
+        is_priority = data.get(CONF_PRIORITY, False)
         
         # Gestione Bold
-        global_bold_setting = conf.get(CONF_BOLD_PREFIX, DEFAULT_BOLD_PREFIX)
-        use_bold_prefix = call.data.get(CONF_BOLD_PREFIX, global_bold_setting)
+        use_bold_prefix = data.get(CONF_BOLD_PREFIX, cfg.bold_prefix)
 
-        # 2. Analisi Contesto (Ora, Slot, DND)
-        now = dt_util.now()
-        now_time = now.time()
-        
-        slot_key, slot_volume = get_current_slot_info(time_slots_conf, now_time)
-        is_dnd_active = is_time_in_range(dnd_conf["start"], dnd_conf["end"], now_time)
+        # 2. Contesto (Ora, Slot, DND)
+        slot_key, slot_volume, is_dnd_active = schedule_state
         
         # 3. Gestione Saluti
-        override_greetings_data = call.data.get(CONF_OVERRIDE_GREETINGS)
-        effective_greetings = base_greetings
+        override_greetings_data = data.get(CONF_OVERRIDE_GREETINGS)
+        effective_greetings = cfg.greetings
         if override_greetings_data:
-            effective_greetings = base_greetings.copy() 
+            effective_greetings = dict(cfg.greetings)
             for key, value in override_greetings_data.items():
                 if key in effective_greetings:
                     if not isinstance(value, list): value = [value]
@@ -201,224 +521,177 @@ async def async_setup(hass: HomeAssistant, config: dict):
         options = effective_greetings.get(slot_key, [])
         current_greeting = random.choice(options) if options and not skip_greeting else ""
         
-        # Dati base per prefissi
-        raw_name = override_name
-        raw_time_str = now.strftime(global_date_fmt) if include_time else ""
+        # Renderer della chiamata: prefisso e saluto resi una volta per parse_mode
+        raw_time_str = now.strftime(cfg.date_format) if include_time else ""
+        renderer = MessageRenderer(
+            override_name, raw_time_str, current_greeting, title, use_bold_prefix,
+            slot=slot_key, priority=is_priority,
+        )
 
-        if isinstance(targets, str):
-            targets = [targets]
+        deliveries = []
 
         # ======================================================================
-        # 4. CICLO SUI CANALI (TARGETS)
+        # 4. CICLO SUI CANALI (TARGETS): costruzione delle consegne
         # ======================================================================
         for target_alias in targets:
-            if target_alias not in channels_config:
+            channel_route = routes.get(target_alias)
+            if channel_route is None:
                 _LOGGER.warning(f"UniNotifier: Target '{target_alias}' sconosciuto.")
+                results[RESULT_SKIPPED].append(target_alias)
+                metrics.unknown_target += 1
+                journal.add(target_alias, None, RESULT_SKIPPED, "unknown_target")
                 continue
+            stats = metrics.channels[target_alias]
+
+            # A. Preparazione Dati Specifici (solo letti: il payload li sovrappone)
+            specific_data = target_specific_data.get(target_alias) or EMPTY_LAYER
 
-            channel_conf = channels_config[target_alias]
-            
-            # A. Preparazione Dati Specifici
-            specific_data = {}
-            if target_alias in target_specific_data:
-                specific_data = target_specific_data[target_alias].copy()
-            
             # Recupero messaggio specifico o globale
-            target_raw_message = specific_data.pop(CONF_MESSAGE, global_raw_message)
+            target_raw_message = specific_data.get(CONF_MESSAGE, global_raw_message)
 
             # B. Selezione Servizio (Fallback o Principale)
-            service_type = specific_data.pop(CONF_TYPE, runtime_data.get(CONF_TYPE, None))
-            alt_services_conf = channel_conf.get(CONF_ALT_SERVICES, {})
-            
-            if service_type and service_type in alt_services_conf:
-                target_service_conf = alt_services_conf[service_type]
-                full_service_name = target_service_conf[CONF_SERVICE]
-                base_service_payload = target_service_conf.get(CONF_SERVICE_DATA, {}) or {}
-                # I servizi alternativi di solito non sono considerati "Voice" per logica volume/saluti
-                is_voice_channel = False 
-            else:
-                full_service_name = channel_conf[CONF_SERVICE]
-                base_service_payload = channel_conf.get(CONF_SERVICE_DATA, {}) or {}
-                is_voice_channel = channel_conf[CONF_IS_VOICE]
-
-            # FIX TELEGRAM PHOTO / VIDEO / DOCUMENT
-            if "telegram_bot.send_photo" in full_service_name:
-                # Telegram photo usa "photo" o "url" e "caption"
-                photo_url = specific_data.pop("photo", None)
-                if photo_url:
-                    base_service_payload["url"] = photo_url
-
-                caption = specific_data.pop("caption", target_raw_message)
-                base_service_payload["caption"] = caption
-
-                # Rimuovi "message" perché send_photo non lo accetta
-                target_raw_message = None
-
-            # FIX TELEGRAM VIDEO
-            if "telegram_bot.send_video" in full_service_name:
-                video_url = specific_data.pop("video", None)
-                if video_url:
-                    base_service_payload["url"] = video_url
-
-                caption = specific_data.pop("caption", target_raw_message)
-                if caption:
-                    base_service_payload["caption"] = caption
-
-                target_raw_message = None  # send_video non accetta "message"
-
-            # FIX TELEGRAM DOCUMENT
-            if "telegram_bot.send_document" in full_service_name:
-                document_url = specific_data.pop("document", None)
-                if document_url:
-                    base_service_payload["url"] = document_url
-
-                caption = specific_data.pop("caption", target_raw_message)
-                if caption:
-                    base_service_payload["caption"] = caption
-
-                target_raw_message = None  # send_document non accetta "message"
-
-            # FIX TELEGRAM ANIMATION (GIF)
-            if "telegram_bot.send_animation" in full_service_name:
-                animation_url = specific_data.pop("animation", None)
-                if animation_url:
-                    base_service_payload["url"] = animation_url
-
-                caption = specific_data.pop("caption", target_raw_message)
-                if caption:
-                    base_service_payload["caption"] = caption
-
-                target_raw_message = None  # send_animation non accetta "message"
-
-            # FIX TELEGRAM AUDIO
-            if "telegram_bot.send_audio" in full_service_name:
-                audio_url = specific_data.pop("audio", None)
-                if audio_url:
-                    base_service_payload["url"] = audio_url
-
-                caption = specific_data.pop("caption", target_raw_message)
-                if caption:
-                    base_service_payload["caption"] = caption
-
-                target_raw_message = None  # send_audio non accetta "message"
-
-            # FIX TELEGRAM VOICE (nota: usa "voice", non "audio")
-            if "telegram_bot.send_voice" in full_service_name:
-                voice_url = specific_data.pop("voice", None)
-                if voice_url:
-                    base_service_payload["url"] = voice_url
+            service_type = specific_data.get(CONF_TYPE, runtime_data.get(CONF_TYPE, None))
+            route = channel_route.resolve(service_type)
+            full_service_name = route.full_service_name
+            is_voice_channel = route.is_voice
+
+            # DND (solo canali voice): controllato prima di costruire il payload
+            if is_voice_channel and is_dnd_active and not is_priority:
+                if cfg.defer_dnd and digest is not None and not _is_command(target_raw_message):
+                    # Rimandata al riepilogo di fine DND (i duplicati sono già in attesa)
+                    _LOGGER.info(f"UniNotifier: DND attivo, audio rimandato su {target_alias}")
+                    # Contesto per ricostruire la consegna a fine DND (player, type, ...)
+                    context = {}
+                    if runtime_data:
+                        context[CONF_DATA] = dict(runtime_data)
+                    target_overrides = {
+                        key: value for key, value in specific_data.items() if key != CONF_MESSAGE
+                    }
+                    if target_overrides:
+                        context[CONF_TARGET_DATA] = target_overrides
+                    digest.add(target_alias, str(target_raw_message), now, context)
+                    results[RESULT_DEFERRED].append(target_alias)
+                    stats.deferred += 1
+                    journal.add(target_alias, full_service_name, RESULT_DEFERRED, "dnd")
+                    continue
+                _LOGGER.info(f"UniNotifier: DND attivo, skip audio su {target_alias}")
+                results[RESULT_SKIPPED].append(target_alias)
+                stats.skipped_dnd += 1
+                journal.add(target_alias, full_service_name, RESULT_SKIPPED, "dnd")
+                continue # Salta questo target
+
+            # Circuito aperto: niente attesa sul provider giù, al più il fallback
+            is_fallback = False
+            if breakers is not None and not breakers.allow(target_alias, time.monotonic()):
+                fallback_route = channel_route.alt_routes.get(FALLBACK_SERVICE)
+                if fallback_route is None:
+                    _LOGGER.debug(f"UniNotifier: circuito aperto, salto {target_alias}")
+                    results[RESULT_CIRCUIT_OPEN].append(target_alias)
+                    stats.circuit_open += 1
+                    journal.add(target_alias, full_service_name, RESULT_CIRCUIT_OPEN)
+                    continue
+                _LOGGER.debug(f"UniNotifier: circuito aperto, {target_alias} via {fallback_route.full_service_name}")
+                route = fallback_route
+                full_service_name = route.full_service_name
+                is_voice_channel = route.is_voice
+                is_fallback = True
+                stats.fallback += 1
+
+            # Payload a livelli: config del canale, 'data' e target_data non
+            # vengono né copiati né modificati; il dict finale nasce in F.
+            # message e type del target sono usati qui, non inoltrati
+            payload = LayeredPayload(
+                route.service_data, runtime_data, specific_data, consumed=(CONF_MESSAGE, CONF_TYPE)
+            )
+
+            # Deduplica: stessa notifica (testo e payload) allo stesso target entro la finestra
+            if dedupe_cache is not None and dedupe_cache.check_and_add(
+                dedupe_key(target_alias, full_service_name, target_raw_message, title,
+                           payload.build()),
+                time.monotonic(),
+            ):
+                _LOGGER.debug(f"UniNotifier: notifica duplicata soppressa per {target_alias}")
+                results[RESULT_DEDUPLICATED].append(target_alias)
+                stats.deduplicated += 1
+                journal.add(target_alias, full_service_name, RESULT_DEDUPLICATED)
+                continue
 
-                caption = specific_data.pop("caption", target_raw_message)
+            # Coalescing solo per i messaggi testuali (mai per comandi e priorità)
+            coalesce_window = route.coalesce_window
+            if coalesce_window and (is_priority or _is_command(target_raw_message)):
+                coalesce_window = 0.0
+
+            # Rate limit: prenotazione del token prima di costruire il payload.
+            # I canali con coalescing sono già limitati a un invio per finestra;
+            # le priorità consumano il token ma non aspettano.
+            not_before = 0.0
+            if rate_limiter and not coalesce_window:
+                not_before = rate_limiter.reserve(target_alias, is_priority)
+                if not_before is None:
+                    _LOGGER.warning(f"UniNotifier: rate limit superato, scarto {target_alias}")
+                    results[RESULT_RATE_LIMITED].append(target_alias)
+                    stats.rate_limited += 1
+                    journal.add(target_alias, full_service_name, RESULT_RATE_LIMITED)
+                    continue
+
+            # FIX TELEGRAM PHOTO / VIDEO / DOCUMENT / ANIMATION / AUDIO / VOICE
+            # Telegram media usa "url" e "caption" e non accetta "message"
+            if route.media_kind:
+                media_url = payload.take(route.media_kind)
+                if media_url:
+                    payload.set_default("url", media_url)
+
+                caption = payload.take("caption", target_raw_message)
                 if caption:
-                    base_service_payload["caption"] = caption
+                    payload.set_default("caption", caption)
 
-                target_raw_message = None  # send_voice non accetta "message"
+                target_raw_message = None
 
             # C. Check Comandi (per mobile app)
-            is_command_message = False
-            if target_raw_message in COMPANION_COMMANDS or str(target_raw_message).startswith("command_"):
-                is_command_message = True
+            is_command_message = _is_command(target_raw_message)
 
             # D. Costruzione Messaggio Finale e Formattazione
             # Tentiamo di indovinare o leggere il parse_mode
             parse_mode = specific_data.get("parse_mode", runtime_data.get("parse_mode"))
-            if not parse_mode and "telegram_bot" in full_service_name:
-                # Default Telegram è spesso HTML se non specificato altrimenti
-                parse_mode = "html"
+            if not parse_mode:
+                parse_mode = route.default_parse_mode
 
-            final_msg = ""
-            
+            render_time = None
+            templated = False
             if is_command_message:
                 # Se è un comando, passiamo il raw message senza alterazioni
                 final_msg = target_raw_message
             else:
-                if is_voice_channel:
-                    # Logica TTS (Niente Bolding, solo testo pulito)
-                    clean_msg = clean_text_for_tts(str(target_raw_message))
-                    clean_greet = clean_text_for_tts(current_greeting)
-                    final_msg = f"{clean_greet}. {clean_msg}" if clean_greet else clean_msg
-                else:
-                    # Logica Visuale: Sanitizzazione + Bolding
-                    
-                    # 1. Sanitizziamo i componenti base
-                    clean_name = sanitize_text_visual(raw_name, parse_mode)
-                    clean_time = sanitize_text_visual(raw_time_str, parse_mode)
-                    clean_msg = sanitize_text_visual(str(target_raw_message), parse_mode)
-                    clean_greet = sanitize_text_visual(current_greeting, parse_mode)
-
-                    # NON applicare bold a name/time in markdown
-                    if use_bold_prefix and parse_mode and "html" in parse_mode.lower():
-                        clean_name = apply_formatting(clean_name, parse_mode, "bold")
-                        clean_time = apply_formatting(clean_time, parse_mode, "bold")
-
-                    # Prefisso RAW senza markup (Markdown non deve vedere asterischi dentro [])
-                    raw_prefix = f"{raw_name}"
-                    if raw_time_str:
-                        raw_prefix += f" - {raw_time_str}"
-
-                    # Markdown: grassetto SOLO sul prefisso intero
-                    if parse_mode and "markdown" in parse_mode.lower():
-                        clean_prefix = f"*[{raw_prefix}]* "
-
-                    # HTML: grassetto sul prefisso intero
-                    elif parse_mode and "html" in parse_mode.lower():
-                        clean_prefix = f"<b>[{raw_prefix}]</b> "
-
-                    # Nessun parse_mode
-                    else:
-                        clean_prefix = f"[{raw_prefix}] "
-
-                    # ============================
-                    # Prefisso + Titolo Inline
-                    # ============================
-
-                    title_inline = ""
-
-                    if title and specific_data.get("inject_title_inline"):
-                        # HTML
-                        if parse_mode and "html" in parse_mode.lower():
-                            title_inline = f" <b>{sanitize_text_visual(title, parse_mode)}</b>"
-                        # Markdown V1
-                        elif parse_mode and "markdown" in parse_mode.lower():
-                            title_inline = f" *{sanitize_text_visual(title, parse_mode)}*"
-                        # Nessun parse_mode
-                        else:
-                            title_inline = f" {title}"
-
-                    # Linea 1: prefisso + titolo
-                    line1 = f"{clean_prefix}{title_inline}"
-
-                    # ============================
-                    # Newline dopo prefisso+titolo
-                    # ============================
-
-                    newline = "\n"
-
-                    # ============================
-                    # Messaggio finale
-                    # ============================
-
-                    final_msg = f"{line1}{newline}{clean_msg}"
-
-            # E. Gestione Volume (Solo Canali Voice) e DND
+                # Voice: testo pulito + saluto. Visuale: [nome - ora] + titolo inline + messaggio
+                render_start = time.perf_counter()
+                final_msg = None
+                if route.message_template is not None:
+                    # Template del canale (reso una volta per messaggio); se fallisce, formato standard
+                    final_msg = renderer.render_template(
+                        route.message_template, str(target_raw_message), target_alias
+                    )
+                    templated = final_msg is not None
+                if final_msg is None:
+                    final_msg = renderer.render(
+                        str(target_raw_message),
+                        parse_mode,
+                        is_voice_channel,
+                        inject_title=specific_data.get("inject_title_inline", False),
+                    )
+                render_time = time.perf_counter() - render_start
+
+            # E. Gestione Volume (Solo Canali Voice); il DND è già stato controllato
+            player_entity = None
+            target_volume = None
             if is_voice_channel:
-                if is_dnd_active and not is_priority:
-                    _LOGGER.info(f"UniNotifier: DND attivo, skip audio su {target_alias}")
-                    continue # Salta questo target
-                
                 target_volume = PRIORITY_VOLUME if is_priority else slot_volume
                 
                 # Cerchiamo l'entity_id del player per settare il volume
-                # Può essere in service_data (config) o data (runtime)
-                player_entity = base_service_payload.get(CONF_ENTITY_ID) or \
-                                runtime_data.get(CONF_ENTITY_ID)
-                
-                if player_entity:
-                    await hass.services.async_call(
-                        "media_player",
-                        "volume_set",
-                        {CONF_ENTITY_ID: player_entity, "volume_level": target_volume}
-                    )
+                # Può essere in service_data (config) o data (runtime).
+                # Il volume_set viene eseguito dal dispatcher subito prima del TTS,
+                # nel turno del player (saltato se il volume è già quello giusto).
+                player_entity = volume_target(route.service_data.get(CONF_ENTITY_ID) or
+                                              runtime_data.get(CONF_ENTITY_ID))
             else:
                 # Canali NON vocali (es. Telegram)
                 # Se c'è DND, di solito inviamo comunque (silenzioso), a meno che tu non voglia bloccare tutto.
@@ -426,60 +699,316 @@ async def async_setup(hass: HomeAssistant, config: dict):
                 pass
 
             # F. Costruzione Payload Finale
-            final_payload = base_service_payload.copy()
-            final_payload.update(runtime_data) # Merge dati generali
-            final_payload.update(specific_data) # Merge override target
+            # (livelli: service_data < url/caption < data < target_data < valori qui sotto)
 
             # Inseriamo il messaggio finale
-            final_payload[CONF_MESSAGE] = final_msg
+            payload[CONF_MESSAGE] = final_msg
+            target_title = title
+            if route.title_template is not None and not is_command_message:
+                rendered_title = renderer.render_template(
+                    route.title_template, str(target_raw_message), target_alias
+                )
+                if rendered_title is not None:
+                    target_title = rendered_title
             # Non inviare il titolo ai canali che lo rifiutano (es. Telegram)
-            if title and not specific_data.get("drop_title"):
-                final_payload[CONF_TITLE] = title
+            if target_title and not specific_data.get("drop_title"):
+                payload[CONF_TITLE] = target_title
 
             # F3. Gestione parse_mode per servizi Telegram
-            pm = final_payload.pop("parse_mode", None)
+            pm = payload.pop("parse_mode", None)
 
-            if pm and "telegram" in full_service_name:
+            if pm and route.parse_mode_location == PARSE_MODE_ROOT:
                 # Caso telegram_bot.send_message → parse_mode al root
-                if "telegram_bot" in full_service_name:
-                    final_payload["parse_mode"] = pm
+                payload["parse_mode"] = pm
 
+            elif pm and route.parse_mode_location == PARSE_MODE_DATA:
                 # Caso notify.telegram → parse_mode dentro data:
-                else:
-                    data_block = final_payload.get("data", {})
-                    if not isinstance(data_block, dict):
-                        data_block = {}
-                    data_block["parse_mode"] = pm
-                    final_payload["data"] = data_block
+                # copia del blocco, che appartiene al canale o alla chiamata
+                data_block = payload.get("data")
+                data_block = dict(data_block) if isinstance(data_block, dict) else {}
+                data_block["parse_mode"] = pm
+                payload["data"] = data_block
 
             # F2. Rimozione entity_id per servizi notify.alexa_media (schema non lo accetta)
-            if full_service_name.startswith("notify.alexa_media"):
-                final_payload.pop(CONF_ENTITY_ID, None)
+            if route.strip_entity_id:
+                payload.pop(CONF_ENTITY_ID, None)
 
             # G. Gestione Entity ID del Provider (Fix CONF_TARGET)
             # Se la configurazione del canale ha 'target' (es. tts.google),
-            # lo iniettiamo nel payload come 'entity_id' (o come richiesto dal servizio).
-            # NON aggiungere entity_id ai servizi notify.* (Alexa, Mobile App, Telegram)
-            if CONF_TARGET in channel_conf and not full_service_name.startswith("notify."):
-                final_payload[CONF_ENTITY_ID] = channel_conf[CONF_TARGET]
-
-            # H. Chiamata al Servizio
-            domain_service = full_service_name.split(".")
-            if len(domain_service) == 2:
-                srv_domain, srv_name = domain_service
-                try:
-                    await hass.services.async_call(srv_domain, srv_name, final_payload)
-                except Exception as e:
-                    _LOGGER.error(f"UniNotifier: Errore chiamata {full_service_name}: {e}")
+            # lo iniettiamo nel payload come 'entity_id'.
+            # La route non lo prevede mai per i servizi notify.* (Alexa, Mobile App, Telegram)
+            if route.inject_entity_id is not None:
+                payload[CONF_ENTITY_ID] = route.inject_entity_id
+
+            # H. Accodamento della consegna (l'invio avviene dopo, tutto insieme)
+            if route.is_valid:
+                delivery = Delivery(
+                    target=target_alias,
+                    domain=route.domain,
+                    service=route.service,
+                    # Unico dict materializzato per la consegna
+                    payload=payload.build(),
+                    volume_entity=player_entity,
+                    volume_level=target_volume,
+                    not_before=not_before,
+                    priority=is_priority,
+                    is_voice=is_voice_channel,
+                    fallback=is_fallback,
+                    render_time=render_time,
+                )
+                if coalesce_window:
+                    # Inviato allo scadere della finestra, insieme agli altri messaggi:
+                    # il testo senza prefisso serve a combinarli sotto un solo prefisso
+                    # (un template produce il messaggio intero, che resta tale)
+                    body = None if templated else renderer.render_body(
+                        str(target_raw_message), parse_mode, is_voice_channel
+                    )
+                    coalescer.add(delivery, coalesce_window, body)
+                    results[RESULT_COALESCED].append(target_alias)
+                    journal.add(target_alias, full_service_name, RESULT_COALESCED,
+                                f"window {coalesce_window}s", render_time)
+                else:
+                    deliveries.append(delivery)
             else:
                 _LOGGER.error(f"UniNotifier: Servizio non valido {full_service_name}")
+                results[RESULT_FAILED].append(target_alias)
+                stats.failed += 1
+                journal.add(target_alias, full_service_name, RESULT_FAILED, "invalid_service")
+
+        return deliveries
+
+    # Invii in background ancora in corso (riferimenti forti fino alla fine)
+    background_tasks: set = set()
+
+    async def async_deliver(call: ServiceCall, cfg: NotifierState, deliveries: list,
+                            results: dict) -> ServiceResponse:
+        """
+        Invia le consegne della chiamata e restituisce gli esiti per target.
+        Con 'background: true' risponde subito con un delivery_id e gli esiti
+        già noti (skipped, deduplicated, ...); ogni consegna conclusa genera
+        un evento universal_notifier_delivered / universal_notifier_failed.
+        Se la chiamata non chiede una risposta (niente response_variable) e
+        'background' non è indicato, l'invio parte senza attendere i provider
+        e senza eventi: l'automazione prosegue subito, come con i notify di HA.
+        """
+        concurrent = call.data.get(CONF_CONCURRENT, cfg.concurrent)
+
+        async def _async_send(send_results: dict, on_done=None) -> dict:
+            # Media scaricati una volta per tutti i target, prima dell'invio
+            if attachments is not None:
+                await attachments.async_prepare(deliveries)
+            return await async_dispatch(
+                hass, deliveries, send_results,
+                concurrent=concurrent,
+                lanes=lanes,
+                on_failure=retry_queue.enqueue if retry_queue else None,
+                metrics=metrics,
+                sequencer=sequencer,
+                on_done=on_done,
+                breakers=breakers,
+                journal=journal,
+            )
+
+        def _spawn(coro, name: str) -> None:
+            task = hass.async_create_background_task(coro, name)
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
+        background = call.data.get(CONF_BACKGROUND)
+        if background is None and not call.return_response:
+            # Nessuno legge gli esiti: timeout, retry, metriche e giornale
+            # restano attivi, ma il chiamante non aspetta
+            if deliveries:
+                _spawn(_async_send(results), f"{DOMAIN}_send")
+            return None
+        if not background:
+            return await _async_send(results)
+
+        delivery_id = uuid.uuid4().hex
+        accepted = time.perf_counter()
+
+        def on_done(delivery: Delivery, outcome: str, duration: float, queued: bool) -> None:
+            hass.bus.async_fire(
+                EVENT_DELIVERED if outcome == RESULT_SENT else EVENT_FAILED,
+                {
+                    ATTR_DELIVERY_ID: delivery_id,
+                    "target": delivery.target,
+                    "service": delivery.full_service_name,
+                    "outcome": outcome,
+                    "queued": queued,
+                    "duration": round(duration, 3),
+                    "elapsed": round(time.perf_counter() - accepted, 3),
+                },
+            )
+
+        _spawn(_async_send(new_results(), on_done), f"{DOMAIN}_{delivery_id}")
+
+        results[ATTR_DELIVERY_ID] = delivery_id
+        results[ATTR_PENDING] = [delivery.target for delivery in deliveries]
+        return results
+
+    async def async_send_notification(call: ServiceCall) -> ServiceResponse:
+        """
+        Handler principale del servizio 'send'.
+        Costruisce prima tutti i payload, poi li invia (in sequenza o in parallelo)
+        e restituisce gli esiti per target.
+        """
+        cfg = state
+        now = dt_util.now()
+        results = new_results()
+        deliveries = build_deliveries(cfg, call.data, now, cfg.schedule.state(now), results)
+        return await async_deliver(call, cfg, deliveries, results)
+
+    async def async_send_many(call: ServiceCall) -> ServiceResponse:
+        """
+        Handler del servizio 'send_many': più notifiche in una sola chiamata.
+        Schema e contesto orario sono risolti una volta per tutto il batch; le
+        consegne passano dallo stesso dispatcher, raggruppate per canale.
+        """
+        cfg = state
+        now = dt_util.now()
+        schedule_state = cfg.schedule.state(now)
+        results = new_results()
+
+        deliveries = []
+        for notification in call.data[CONF_NOTIFICATIONS]:
+            deliveries.extend(build_deliveries(cfg, notification, now, schedule_state, results))
+        return await async_deliver(call, cfg, deliveries, results)
 
     # Registrazione del servizio con lo SCHEMA ESPLICITO
     hass.services.async_register(
         DOMAIN, 
-        "send", 
+        SERVICE_SEND, 
         async_send_notification, 
-        schema=SEND_SERVICE_SCHEMA
+        schema=SEND_SERVICE_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SEND_MANY,
+        async_send_many,
+        schema=SEND_MANY_SERVICE_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
     )
+
+    async def async_stats(call: ServiceCall) -> ServiceResponse:
+        """Contatori e latenze per canale, più lo stato di rate limiter e coda."""
+        response = metrics.as_dict()
+        if state.rate_limiter:
+            response["rate_limit_tokens"] = state.rate_limiter.state()
+        if retry_queue is not None:
+            response["queue_depth"] = retry_queue.depth
+        response["lanes"] = lanes.as_dict()
+        response["background"] = len(background_tasks)
+        if attachments is not None:
+            response["attachments"] = attachments.state()
+        if digest is not None:
+            response["deferred"] = len(digest)
+        occupied = occupancy.state()
+        if occupied:
+            response["occupancy"] = occupied
+        if breakers is not None:
+            response["circuits"] = breakers.as_dict(time.monotonic())
+        players = sequencer.state()
+        if players:
+            response["players"] = players
+        return response
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_STATS, async_stats,
+        supports_response=SupportsResponse.ONLY,
+    )
+
+    async def async_history(call: ServiceCall) -> ServiceResponse:
+        """Ultimi esiti di consegna, filtrati per canale (o gruppo), esito e intervallo."""
+        targets = call.data.get(CONF_TARGETS)
+        if targets is not None:
+            targets = set(resolve_targets(targets, state.groups))
+        outcomes = call.data.get(ATTR_OUTCOMES)
+
+        def _timestamp(key: str) -> float | None:
+            value = call.data.get(key)
+            if value is None:
+                return None
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=dt_util.DEFAULT_TIME_ZONE)
+            return value.timestamp()
+
+        entries = journal.query(
+            targets=targets,
+            outcomes=set(outcomes) if outcomes is not None else None,
+            start=_timestamp(ATTR_START),
+            end=_timestamp(ATTR_END),
+            limit=call.data[ATTR_LIMIT],
+        )
+        return {"size": len(journal), "entries": entries}
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_HISTORY, async_history,
+        schema=HISTORY_SERVICE_SCHEMA, supports_response=SupportsResponse.ONLY,
+    )
+
+    async def async_reload(call: ServiceCall) -> None:
+        """
+        Rilegge la sezione YAML e sostituisce lo stato compilato.
+        Servizi, corsie, code (retry, riepilogo DND, coalescing) e metriche
+        restano quelli attuali: nessuna consegna in attesa va persa.
+        """
+        nonlocal state
+        new_config = await async_integration_yaml_config(hass, DOMAIN)
+        if not new_config or DOMAIN not in new_config:
+            _LOGGER.error("UniNotifier: reload annullato, configurazione non valida o assente")
+            return
+
+        new_state = compile_state(new_config[DOMAIN], template_cache)
+        metrics.add_channels(new_state.routes.keys())
+        occupancy.update(presence_map(new_state))
+        if new_state.defer_dnd:
+            await async_setup_digest(new_state)
+        if retry_queue is not None:
+            retry_queue.update(new_state.schedule)
+        # Finestre di coalescing aperte con la configurazione precedente: consegna subito
+        coalescer.async_flush_all()
+
+        # Swap unico: le chiamate già iniziate finiscono con lo stato precedente
+        state = new_state
+        hass.data[DOMAIN][DATA_RATE_LIMITER] = new_state.rate_limiter
+        _LOGGER.info(f"UniNotifier: configurazione ricaricata ({len(new_state.routes)} canali)")
+
+    async_register_admin_service(hass, DOMAIN, SERVICE_RELOAD, async_reload)
+
+    # Sensori diagnostici (metriche per canale e profondità della coda)
+    hass.async_create_task(
+        discovery.async_load_platform(hass, Platform.SENSOR, DOMAIN, {}, config)
+    )
+
+    if retry_queue is not None:
+
+        async def async_queue_status(call: ServiceCall) -> ServiceResponse:
+            """Profondità e contenuto della coda di retry."""
+            return {"depth": retry_queue.depth, "entries": retry_queue.entries()}
+
+        async def async_queue_flush(call: ServiceCall) -> ServiceResponse:
+            """Ritenta subito le entry selezionate (tutte se nessun filtro)."""
+            count = retry_queue.flush(call.data.get(ATTR_IDS), call.data.get(CONF_TARGETS))
+            return {"flushed": count, "depth": retry_queue.depth}
+
+        async def async_queue_cancel(call: ServiceCall) -> ServiceResponse:
+            """Rimuove le entry selezionate (tutte se nessun filtro)."""
+            count = retry_queue.cancel(call.data.get(ATTR_IDS), call.data.get(CONF_TARGETS))
+            return {"cancelled": count, "depth": retry_queue.depth}
+
+        hass.services.async_register(
+            DOMAIN, SERVICE_QUEUE_STATUS, async_queue_status,
+            supports_response=SupportsResponse.ONLY,
+        )
+        hass.services.async_register(
+            DOMAIN, SERVICE_QUEUE_FLUSH, async_queue_flush,
+            schema=QUEUE_FILTER_SCHEMA, supports_response=SupportsResponse.OPTIONAL,
+        )
+        hass.services.async_register(
+            DOMAIN, SERVICE_QUEUE_CANCEL, async_queue_cancel,
+            schema=QUEUE_FILTER_SCHEMA, supports_response=SupportsResponse.OPTIONAL,
+        )
     
     return True
@@ -0,0 +1,211 @@
+# /config/custom_components/universal_notifier/attachments.py
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from .const import TELEGRAM_MEDIA_SERVICES
+from .dispatcher import Delivery
+
+_LOGGER = logging.getLogger(__name__)
+
+# Parametri di telegram_bot che richiedono il download autenticato: lasciamo fare a Telegram
+_AUTH_KEYS = ("username", "password", "authentication")
+
+# Nomi dei file creati dalla cache: solo questi sono rimossi all'avvio, la
+# directory può essere condivisa con altri file dell'utente
+_FILE_PREFIX = "uninotifier_"
+_OWN_FILE_RE = re.compile(rf"{_FILE_PREFIX}[0-9a-f]{{20}}(\.\w{{1,9}})?(\.tmp)?")
+
+# ==============================================================================
+# CACHE DEGLI ALLEGATI
+# ==============================================================================
+
+class _CachedFile:
+    __slots__ = ("path", "size", "fetched_at")
+
+    def __init__(self, path: str, size: int, fetched_at: float) -> None:
+        self.path = path
+        self.size = size
+        self.fetched_at = fetched_at
+
+
+class AttachmentCache:
+    """
+    Scarica una sola volta i media referenziati dalle notifiche Telegram e li
+    serve da una directory locale: entro `ttl` secondi lo stesso URL non viene
+    riscaricato, e le richieste concorrenti per lo stesso URL condividono un
+    unico download. La directory è limitata a `max_bytes` con eviction LRU.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        directory: str,
+        max_bytes: int,
+        ttl: float,
+        timeout: float,
+    ) -> None:
+        self._hass = hass
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._timeout = timeout
+        # url -> _CachedFile, dal meno al più recentemente usato
+        self._files: OrderedDict = OrderedDict()
+        self._total = 0
+        # Download in corso: le richieste successive attendono lo stesso future
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def _remove_own_files(self) -> None:
+        # La cache non sopravvive al riavvio: si rimuovono i file lasciati
+        # dall'esecuzione precedente, mai il resto della directory
+        os.makedirs(self._directory, exist_ok=True)
+        with os.scandir(self._directory) as entries:
+            stale = [
+                entry.path for entry in entries
+                if _OWN_FILE_RE.fullmatch(entry.name) and entry.is_file(follow_symlinks=False)
+            ]
+        _remove_files(stale)
+
+    async def async_setup(self) -> None:
+        await self._hass.async_add_executor_job(self._remove_own_files)
+
+    # --------------------------------------------------------------------------
+
+    def _file_path(self, url: str, content_type: str | None) -> str:
+        digest = hashlib.sha1(url.encode()).hexdigest()[:20]
+        ext = os.path.splitext(urlsplit(url).path)[1][1:]
+        if not ext and content_type:
+            ext = (mimetypes.guess_extension(content_type.split(";")[0].strip()) or "")[1:]
+        ext = re.sub(r"\W", "", ext)[:9]
+        name = f"{_FILE_PREFIX}{digest}.{ext}" if ext else f"{_FILE_PREFIX}{digest}"
+        return os.path.join(self._directory, name)
+
+    async def _async_download(self, url: str, verify_ssl: bool) -> _CachedFile:
+        session = async_get_clientsession(self._hass, verify_ssl=verify_ssl)
+        async with asyncio.timeout(self._timeout):
+            async with session.get(url) as response:
+                response.raise_for_status()
+                chunks = []
+                size = 0
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > self._max_bytes:
+                        raise ValueError(f"allegato più grande della cache ({self._max_bytes} byte)")
+                    chunks.append(chunk)
+                path = self._file_path(url, response.headers.get("Content-Type"))
+
+        await self._hass.async_add_executor_job(_write_file, path, b"".join(chunks))
+        return _CachedFile(path, size, time.monotonic())
+
+    def _store(self, url: str, cached: _CachedFile) -> None:
+        previous = self._files.pop(url, None)
+        if previous is not None:
+            self._total -= previous.size
+        self._files[url] = cached
+        self._total += cached.size
+
+        evicted = []
+        while self._total > self._max_bytes and len(self._files) > 1:
+            _, old = self._files.popitem(last=False)
+            self._total -= old.size
+            if old.path != cached.path:
+                evicted.append(old.path)
+        if evicted:
+            self._hass.async_add_executor_job(_remove_files, evicted)
+
+    async def async_fetch(self, url: str, verify_ssl: bool = True) -> str:
+        """Percorso locale del media (scaricato se assente o più vecchio del TTL)."""
+        cached = self._files.get(url)
+        if cached is not None and time.monotonic() - cached.fetched_at < self._ttl:
+            self._files.move_to_end(url)
+            return cached.path
+
+        future = self._inflight.get(url)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._inflight[url] = asyncio.get_running_loop().create_future()
+        try:
+            cached = await self._async_download(url, verify_ssl)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evita "exception was never retrieved" se nessuno era in attesa
+            future.exception()
+            raise
+        finally:
+            del self._inflight[url]
+        self._store(url, cached)
+        future.set_result(cached.path)
+        return cached.path
+
+    async def async_prepare(self, deliveries: list) -> None:
+        """
+        Sostituisce 'url' con il file locale nei payload dei send_* media di
+        Telegram. Ogni URL è scaricato una volta sola; se il download fallisce
+        il payload resta invariato e sarà Telegram a scaricare il media.
+        Il payload originale resta in `source_payload`: la cache è svuotata al
+        riavvio, quindi la coda di retry deve conservare l'URL e non il file.
+        """
+        by_url: dict[tuple, list] = {}
+        for delivery in deliveries:
+            payload = delivery.payload
+            if not _is_telegram_media(delivery) or "url" not in payload:
+                continue
+            if any(key in payload for key in _AUTH_KEYS):
+                continue
+            key = (payload["url"], payload.get("verify_ssl", True))
+            by_url.setdefault(key, []).append(delivery)
+        if not by_url:
+            return
+
+        paths = await asyncio.gather(
+            *(self.async_fetch(url, verify_ssl) for url, verify_ssl in by_url),
+            return_exceptions=True,
+        )
+        for ((url, _), group), path in zip(by_url.items(), paths):
+            if isinstance(path, BaseException):
+                _LOGGER.warning(f"UniNotifier: download allegato fallito ({url}): {path!r}")
+                continue
+            for delivery in group:
+                payload = dict(delivery.payload)
+                del payload["url"]
+                payload.pop("verify_ssl", None)
+                payload["file"] = path
+                delivery.source_payload = delivery.payload
+                delivery.payload = payload
+
+    def state(self) -> dict:
+        return {"files": len(self._files), "bytes": self._total}
+
+
+def _is_telegram_media(delivery: Delivery) -> bool:
+    return delivery.domain == "telegram_bot" and delivery.service in TELEGRAM_MEDIA_SERVICES
+
+
+def _write_file(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _remove_files(paths: list) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
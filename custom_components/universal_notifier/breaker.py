@@ -0,0 +1,127 @@
+# /config/custom_components/universal_notifier/breaker.py
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# Stati del circuito
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# ==============================================================================
+# CIRCUITO DI UN CANALE
+# ==============================================================================
+
+class _Circuit:
+    __slots__ = ("state", "failures", "opened_at", "probe_started", "trips")
+
+    def __init__(self) -> None:
+        self.state = STATE_CLOSED
+        # Fallimenti consecutivi (timeout inclusi) a circuito chiuso
+        self.failures = 0
+        self.opened_at = 0.0
+        # Inizio della consegna di prova (half-open)
+        self.probe_started = 0.0
+        # Quante volte il circuito si è aperto
+        self.trips = 0
+
+# ==============================================================================
+# CIRCUIT BREAKER PER CANALE
+# ==============================================================================
+
+class CircuitBreakers:
+    """
+    Un circuito per alias. Dopo `failure_threshold` fallimenti consecutivi il
+    circuito si apre e le consegne al canale sono saltate (o deviate sul
+    fallback) senza chiamare il provider. Trascorsi `reset_timeout` secondi
+    passa a half-open: una sola consegna di prova, che lo richiude se va a
+    buon fine o lo riapre se fallisce. Una prova che non riporta alcun esito
+    (es. scartata dal rate limit) scade dopo altri `reset_timeout` secondi.
+    I tempi sono in time.monotonic().
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self._threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._circuits: dict[str, _Circuit] = {}
+
+    def _circuit(self, alias: str) -> _Circuit:
+        circuit = self._circuits.get(alias)
+        if circuit is None:
+            circuit = self._circuits[alias] = _Circuit()
+        return circuit
+
+    def allow(self, alias: str, now: float) -> bool:
+        """True se la consegna può chiamare il provider (eventualmente come prova)."""
+        circuit = self._circuits.get(alias)
+        if circuit is None or circuit.state == STATE_CLOSED:
+            return True
+        if circuit.state == STATE_OPEN:
+            if now - circuit.opened_at < self._reset_timeout:
+                return False
+            circuit.state = STATE_HALF_OPEN
+        elif now - circuit.probe_started < self._reset_timeout:
+            # Half-open con una prova già in corso
+            return False
+        circuit.probe_started = now
+        _LOGGER.info(f"UniNotifier: circuito di {alias} half-open, consegna di prova")
+        return True
+
+    def is_open(self, alias: str, now: float) -> bool:
+        """Circuito aperto e non ancora pronto per una prova (non cambia stato)."""
+        circuit = self._circuits.get(alias)
+        return (
+            circuit is not None
+            and circuit.state == STATE_OPEN
+            and now - circuit.opened_at < self._reset_timeout
+        )
+
+    def retry_in(self, alias: str, now: float) -> float:
+        """Secondi mancanti alla prossima consegna di prova (0 se il circuito è chiuso)."""
+        circuit = self._circuits.get(alias)
+        if circuit is None or circuit.state == STATE_CLOSED:
+            return 0.0
+        since = circuit.opened_at if circuit.state == STATE_OPEN else circuit.probe_started
+        return max(0.0, self._reset_timeout - (now - since))
+
+    def record_success(self, alias: str) -> None:
+        circuit = self._circuits.get(alias)
+        if circuit is None:
+            return
+        if circuit.state != STATE_CLOSED:
+            _LOGGER.info(f"UniNotifier: circuito di {alias} richiuso, provider di nuovo raggiungibile")
+        circuit.state = STATE_CLOSED
+        circuit.failures = 0
+
+    def record_failure(self, alias: str, now: float) -> None:
+        circuit = self._circuit(alias)
+        if circuit.state == STATE_OPEN:
+            # Consegna partita prima dell'apertura: il circuito è già aperto
+            return
+        circuit.failures += 1
+        if circuit.state == STATE_HALF_OPEN or circuit.failures >= self._threshold:
+            circuit.state = STATE_OPEN
+            circuit.opened_at = now
+            circuit.trips += 1
+            _LOGGER.warning(
+                f"UniNotifier: circuito di {alias} aperto dopo {circuit.failures} fallimenti, "
+                f"consegne sospese per {self._reset_timeout}s"
+            )
+
+    def state(self, alias: str) -> str:
+        circuit = self._circuits.get(alias)
+        return circuit.state if circuit is not None else STATE_CLOSED
+
+    def as_dict(self, now: float) -> dict:
+        """Circuiti non chiusi o che si sono aperti almeno una volta."""
+        return {
+            alias: {
+                "state": circuit.state,
+                "failures": circuit.failures,
+                "trips": circuit.trips,
+                "retry_in": round(self.retry_in(alias, now), 1),
+            }
+            for alias, circuit in self._circuits.items()
+            if circuit.state != STATE_CLOSED or circuit.trips
+        }
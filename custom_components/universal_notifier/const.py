@@ -9,6 +9,41 @@ CONF_DATE_FORMAT = "date_format"
 CONF_GREETINGS = "greetings"
 CONF_TIME_SLOTS = "time_slots"
 CONF_DND = "dnd"
+CONF_CONCURRENT = "concurrent"
+CONF_MAX_CONCURRENCY = "max_concurrency"
+CONF_TARGET_TIMEOUT = "target_timeout"
+CONF_RETRY = "retry"
+CONF_MAX_ATTEMPTS = "max_attempts"
+CONF_BASE_DELAY = "base_delay"
+CONF_MAX_DELAY = "max_delay"
+CONF_MAX_SIZE = "max_size"
+CONF_RATE_LIMIT = "rate_limit"
+CONF_RATE = "rate"
+CONF_BURST = "burst"
+CONF_POLICY = "policy"
+CONF_MAX_WAIT = "max_wait"
+CONF_DEDUPE = "dedupe"
+CONF_WINDOW = "window"
+CONF_MAX_ENTRIES = "max_entries"
+CONF_COALESCE = "coalesce"
+CONF_NOTIFICATIONS = "notifications"
+CONF_BACKGROUND = "background"
+CONF_ATTACHMENTS = "attachments"
+CONF_DIRECTORY = "directory"
+CONF_MAX_SIZE_MB = "max_size_mb"
+CONF_TTL = "ttl"
+CONF_RESTORE_VOLUME = "restore_volume"
+CONF_RESTORE_DELAY = "restore_delay"
+CONF_GROUPS = "groups"
+CONF_PRIORITY_CONCURRENCY = "priority_max_concurrency"
+CONF_PRIORITY_TIMEOUT = "priority_timeout"
+CONF_DEFER = "defer"
+CONF_CIRCUIT_BREAKER = "circuit_breaker"
+CONF_FAILURE_THRESHOLD = "failure_threshold"
+CONF_RESET_TIMEOUT = "reset_timeout"
+CONF_HISTORY = "history"
+CONF_PERSIST = "persist"
+CONF_MAX_DEFERRED = "max_deferred"
 
 # --- Chiavi Parametri Servizio (Service Call) ---
 # Usiamo queste costanti sia nello schema che nel codice
@@ -22,6 +57,8 @@ CONF_SKIP_GREETING = "skip_greeting"
 CONF_INCLUDE_TIME = "include_time"
 CONF_OVERRIDE_GREETINGS = "override_greetings"
 CONF_BOLD_PREFIX = "bold_prefix"
+CONF_ONLY_OCCUPIED = "only_occupied"
+CONF_PRESENCE_FALLBACK = "presence_fallback"
 
 # --- Chiavi Canale Singolo ---
 CONF_SERVICE = "service"
@@ -31,6 +68,9 @@ CONF_ENTITY_ID = "entity_id"
 CONF_IS_VOICE = "is_voice"
 CONF_ALT_SERVICES = "alt_services"
 CONF_TYPE = "type"
+CONF_MESSAGE_TEMPLATE = "message_template"
+CONF_TITLE_TEMPLATE = "title_template"
+CONF_PRESENCE = "presence"
 
 # --- Defaults ---
 DEFAULT_NAME = "Hal9000"
@@ -38,6 +78,113 @@ DEFAULT_DATE_FORMAT = "%H:%M:%S"
 DEFAULT_INCLUDE_TIME = True
 DEFAULT_BOLD_PREFIX = True
 
+# --- Dispatch ---
+# concurrent=False mantiene l'invio sequenziale (comportamento storico)
+DEFAULT_CONCURRENT = False
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TARGET_TIMEOUT = 30  # secondi per singolo target (volume_set + chiamata)
+# Corsia prioritaria (priority: true): budget separato e timeout più stretto
+DEFAULT_PRIORITY_CONCURRENCY = 2
+DEFAULT_PRIORITY_TIMEOUT = 10
+
+# Esiti riportati nella risposta del servizio
+RESULT_SENT = "sent"
+RESULT_FAILED = "failed"
+RESULT_TIMED_OUT = "timed_out"
+RESULT_SKIPPED = "skipped"
+RESULT_QUEUED = "queued"
+RESULT_RATE_LIMITED = "rate_limited"
+RESULT_DEDUPLICATED = "deduplicated"
+RESULT_COALESCED = "coalesced"
+RESULT_PREEMPTED = "preempted"
+RESULT_DEFERRED = "deferred"
+RESULT_CIRCUIT_OPEN = "circuit_open"
+
+# --- Rate Limit ---
+# queue: il messaggio attende il token (fino a max_wait secondi), drop: scartato
+RATE_POLICY_QUEUE = "queue"
+RATE_POLICY_DROP = "drop"
+DEFAULT_RATE_POLICY = RATE_POLICY_QUEUE
+DEFAULT_MAX_WAIT = 60
+
+# --- Dedupe / Coalescing ---
+DEFAULT_DEDUPE_WINDOW = 30     # secondi in cui una notifica identica viene soppressa
+DEFAULT_DEDUPE_ENTRIES = 1000  # massimo numero di hash ricordati
+
+# --- Annunci vocali ---
+# Il volume originale del player è ripristinato quando nessun annuncio arriva
+# per restore_delay secondi (il TTS continua a suonare dopo la chiamata)
+DEFAULT_RESTORE_VOLUME = True
+DEFAULT_RESTORE_DELAY = 10
+
+# --- Retry Queue ---
+# Abilitata solo se la sezione 'retry' è presente nella configurazione
+DEFAULT_MAX_ATTEMPTS = 5       # tentativi totali, incluso il primo invio
+DEFAULT_BASE_DELAY = 10        # secondi, raddoppia ad ogni tentativo
+DEFAULT_MAX_DELAY = 900        # tetto del backoff (secondi)
+DEFAULT_QUEUE_SIZE = 500
+QUEUE_FILE = "universal_notifier.queue"  # in <config>/.storage/
+
+# --- Circuit breaker ---
+# Abilitato solo se la sezione 'circuit_breaker' è presente nella configurazione
+DEFAULT_FAILURE_THRESHOLD = 3  # fallimenti consecutivi che aprono il circuito
+DEFAULT_RESET_TIMEOUT = 60     # secondi prima della consegna di prova
+# alt_service usato al posto del servizio principale a circuito aperto
+FALLBACK_SERVICE = "fallback"
+
+# --- Template di canale ---
+TEMPLATE_CACHE_SIZE = 64       # template compilati tenuti in memoria (LRU)
+
+# --- Giornale delle consegne (servizio history) ---
+DEFAULT_HISTORY_SIZE = 200     # ultimi esiti per target tenuti in memoria
+HISTORY_STORAGE_KEY = "universal_notifier.history"  # con 'persist: true'
+DEFAULT_HISTORY_LIMIT = 50     # record restituiti dal servizio se 'limit' non è indicato
+
+# --- Cache allegati (media Telegram) ---
+# Abilitata solo se la sezione 'attachments' è presente nella configurazione
+DEFAULT_ATTACHMENT_SIZE_MB = 100
+DEFAULT_ATTACHMENT_TTL = 60     # secondi in cui lo stesso URL non viene riscaricato
+ATTACHMENT_DIR = "universal_notifier"  # dentro la media dir 'local' (già in allowlist)
+
+# --- Riepilogo DND ---
+# Con 'defer: true' nella sezione dnd le notifiche vocali sono rimandate
+# e annunciate insieme alla fine della finestra
+DEFAULT_MAX_DEFERRED = 50
+DIGEST_STORAGE_KEY = "universal_notifier.digest"  # Store di HA in <config>/.storage/
+
+# --- hass.data ---
+DATA_RETRY_QUEUE = "retry_queue"
+DATA_RATE_LIMITER = "rate_limiter"
+DATA_METRICS = "metrics"
+DATA_SEQUENCER = "sequencer"
+DATA_LANES = "lanes"
+DATA_DIGEST = "digest"
+DATA_ATTACHMENTS = "attachments"
+DATA_BREAKERS = "breakers"
+DATA_JOURNAL = "journal"
+DATA_OCCUPANCY = "occupancy"
+
+# --- Servizi ---
+SERVICE_SEND = "send"
+SERVICE_RELOAD = "reload"
+SERVICE_SEND_MANY = "send_many"
+SERVICE_STATS = "stats"
+SERVICE_QUEUE_STATUS = "queue_status"
+SERVICE_QUEUE_FLUSH = "queue_flush"
+SERVICE_QUEUE_CANCEL = "queue_cancel"
+SERVICE_HISTORY = "history"
+ATTR_IDS = "ids"
+ATTR_DELIVERY_ID = "delivery_id"
+ATTR_PENDING = "pending"
+ATTR_OUTCOMES = "outcomes"
+ATTR_START = "start"
+ATTR_END = "end"
+ATTR_LIMIT = "limit"
+
+# --- Eventi (invii in background) ---
+EVENT_DELIVERED = f"{DOMAIN}_delivered"
+EVENT_FAILED = f"{DOMAIN}_failed"
+
 # --- Default Time Slots & Volumes ---
 # Definisce quando inizia la fascia e il volume (0.0 - 1.0) di default per quella fascia
 DEFAULT_TIME_SLOTS = {
@@ -47,6 +194,10 @@ DEFAULT_TIME_SLOTS = {
     "night":     {"start": "22:00", "volume": 0.1},
 }
 
+# Slot/volume usati se nessuno slot è configurato
+FALLBACK_SLOT = "day"
+FALLBACK_VOLUME = 0.5
+
 # --- Default DND (Do Not Disturb) ---
 # Se non configurato, il DND è disabilitato di default (start == end)
 DEFAULT_DND = {"start": "23:00", "end": "06:00"}
@@ -62,6 +213,22 @@ DEFAULT_GREETINGS = {
     "night": ["Buonanotte", "Sogni d'oro", "È tardi"],
 }
 
+# --- Routing ---
+# Servizi media di telegram_bot -> chiave in target_data con l'URL del file.
+# Questi servizi non accettano "message": usano url + caption.
+TELEGRAM_MEDIA_SERVICES = {
+    "send_photo": "photo",
+    "send_video": "video",
+    "send_document": "document",
+    "send_animation": "animation",
+    "send_audio": "audio",
+    "send_voice": "voice",  # nota: usa "voice", non "audio"
+}
+
+# Posizione del parse_mode nel payload finale
+PARSE_MODE_ROOT = "root"   # telegram_bot.send_* -> parse_mode al root
+PARSE_MODE_DATA = "data"   # notify.telegram -> parse_mode dentro data:
+
 # --- Companion App Commands ---
 COMPANION_COMMANDS = [
     "TTS",
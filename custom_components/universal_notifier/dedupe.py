@@ -0,0 +1,146 @@
+# /config/custom_components/universal_notifier/dedupe.py
+
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import replace
+from functools import partial
+from typing import Awaitable, Callable, Mapping
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import CONF_MESSAGE
+from .dispatcher import Delivery
+
+_LOGGER = logging.getLogger(__name__)
+
+# ==============================================================================
+# DEDUPLICA
+# ==============================================================================
+
+class TTLCache:
+    """
+    Insieme limitato di chiavi con scadenza.
+    Il TTL è unico, quindi l'ordine di inserimento coincide con quello di
+    scadenza: l'eviction scorre solo la testa e la memoria resta costante.
+    """
+
+    __slots__ = ("_ttl", "_max_entries", "_data")
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _evict(self, now: float) -> None:
+        data = self._data
+        while data:
+            key, expires = next(iter(data.items()))
+            if expires > now:
+                break
+            del data[key]
+
+    def check_and_add(self, key, now: float) -> bool:
+        """True se la chiave è già presente (duplicato), altrimenti la registra."""
+        self._evict(now)
+        if key in self._data:
+            return True
+        self._data[key] = now + self._ttl
+        if len(self._data) > self._max_entries:
+            self._data.popitem(last=False)
+        return False
+
+
+def dedupe_key(target: str, service: str, message, title, payload: Mapping) -> int:
+    """
+    Hash compatto della notifica: in cache teniamo solo l'intero.
+    Conta il testo originale (senza prefisso [nome - ora] né saluto) e il
+    payload in forma canonica, quindi due annunci con lo stesso testo verso
+    player diversi, o due foto con la stessa didascalia, non sono duplicati.
+    """
+    try:
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    except TypeError:
+        # Chiavi di tipo misto (non ordinabili)
+        canonical = repr(sorted(payload.items(), key=lambda item: str(item[0])))
+    return hash((target, service, str(message), title, canonical))
+
+# ==============================================================================
+# COALESCING
+# ==============================================================================
+
+class Coalescer:
+    """
+    Raccoglie i messaggi testuali diretti allo stesso canale entro una finestra
+    e li consegna come un unico messaggio combinato allo scadere del timer:
+    prefisso e titolo del primo messaggio, poi i testi di tutti, in ordine.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        flush: Callable[[list], Awaitable],
+    ) -> None:
+        self._hass = hass
+        self._flush = flush
+        # alias -> [(consegna, testo senza prefisso o None), ...]
+        self._batches: dict[str, list] = {}
+        self._timers: dict[str, CALLBACK_TYPE] = {}
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def add(self, delivery: Delivery, window: float, body: str | None = None) -> None:
+        """
+        Accoda la consegna alla finestra del suo canale. `body` è il solo testo
+        del messaggio, da accodare a quello del primo; None se il messaggio va
+        riportato per intero (es. reso da un template).
+        """
+        batch = self._batches.get(delivery.target)
+        if batch is None:
+            self._batches[delivery.target] = [(delivery, body)]
+            self._timers[delivery.target] = async_call_later(
+                self._hass, window, partial(self._async_fire, delivery.target)
+            )
+        else:
+            batch.append((delivery, body))
+
+    @callback
+    def _async_fire(self, target: str, _now) -> None:
+        self._timers.pop(target, None)
+        batch = self._batches.pop(target, None)
+        if not batch:
+            return
+        self._hass.async_create_task(self._flush([self._merge(batch)]))
+
+    @callback
+    def async_flush_all(self, _event=None) -> None:
+        """Annulla i timer e consegna subito le finestre aperte (stop di HA, reload)."""
+        timers, self._timers = self._timers, {}
+        for unsub in timers.values():
+            unsub()
+        batches, self._batches = self._batches, {}
+        if batches:
+            self._hass.async_create_task(
+                self._flush([self._merge(batch) for batch in batches.values()])
+            )
+
+    @staticmethod
+    def _merge(batch: list) -> Delivery:
+        """Il payload del primo messaggio fa da base; i testi sono accodati in ordine."""
+        first = batch[0][0]
+        if len(batch) == 1:
+            return first
+        _LOGGER.debug(f"UniNotifier: {len(batch)} messaggi combinati per {first.target}")
+        lines = [first.payload[CONF_MESSAGE]]
+        lines.extend(
+            delivery.payload[CONF_MESSAGE] if body is None else body
+            for delivery, body in batch[1:]
+        )
+        payload = dict(first.payload)
+        payload[CONF_MESSAGE] = "\n".join(lines)
+        return replace(first, payload=payload, not_before=0.0)
@@ -0,0 +1,167 @@
+# /config/custom_components/universal_notifier/digest.py
+
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_track_point_in_time
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .const import DIGEST_STORAGE_KEY
+from .schedule import TimeSchedule
+
+_LOGGER = logging.getLogger(__name__)
+
+_STORAGE_VERSION = 1
+# Le aggiunte ravvicinate (es. una raffica di eventi notturni) sono salvate insieme
+_SAVE_DELAY = 10
+
+
+def combine_messages(messages: list) -> str:
+    """Un unico testo per l'annuncio di riepilogo: una frase per messaggio."""
+    sentences = []
+    for message in messages:
+        message = message.strip()
+        if message and message[-1] not in ".!?":
+            message += "."
+        sentences.append(message)
+    return " ".join(sentences)
+
+
+def _context_key(context: dict) -> str:
+    """Forma canonica del contesto, per confronti e raggruppamenti."""
+    return json.dumps(context, sort_keys=True, separators=(",", ":"), default=str)
+
+# ==============================================================================
+# DIGEST DND
+# ==============================================================================
+
+class DndDigest:
+    """
+    Notifiche vocali arrivate durante il DND, conservate (su disco, con un
+    tetto) fino alla fine della finestra. Alla fine del DND un solo callback
+    programmato consegna un annuncio di riepilogo per canale.
+    Ogni notifica conserva il contesto della chiamata che serve a ricostruire
+    la consegna ('data' e target_data, es. l'entity_id del player o 'type'):
+    un riepilogo raccoglie i messaggi dello stesso canale con lo stesso
+    contesto. I messaggi identici (stesso canale e contesto) sono tenuti una
+    volta sola; oltre `max_size` si scartano i più vecchi.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        schedule: TimeSchedule,
+        max_size: int,
+        flush: Callable[[list], Awaitable],
+    ) -> None:
+        self._hass = hass
+        self._schedule = schedule
+        self._max_size = max_size
+        self._flush = flush
+        self._store = Store(hass, _STORAGE_VERSION, DIGEST_STORAGE_KEY)
+        # (alias, messaggio, chiave del contesto) -> contesto, nell'ordine di arrivo
+        self._entries: OrderedDict = OrderedDict()
+        self._unsub: CALLBACK_TYPE | None = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def update(self, schedule: TimeSchedule, max_size: int) -> None:
+        """Nuova finestra DND e nuovo tetto dopo un reload."""
+        self._schedule = schedule
+        self._max_size = max_size
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+            self._schedule_flush(dt_util.now())
+
+    async def async_load(self) -> None:
+        data = await self._store.async_load()
+        for entry in (data or {}).get("entries", [])[-self._max_size:]:
+            # Le versioni precedenti salvavano solo [alias, messaggio]
+            alias, message = entry[0], entry[1]
+            context = entry[2] if len(entry) > 2 else {}
+            self._entries[(alias, message, _context_key(context))] = context
+        if self._entries:
+            _LOGGER.info(f"UniNotifier: {len(self._entries)} notifiche DND in attesa di riepilogo")
+
+    def _data_to_save(self) -> dict:
+        return {
+            "entries": [
+                [alias, message, context]
+                for (alias, message, _), context in self._entries.items()
+            ]
+        }
+
+    def add(self, alias: str, message: str, now: datetime, context: dict | None = None) -> bool:
+        """
+        Rimanda la notifica alla fine del DND, con il contesto per ricostruirla.
+        False se era già in attesa.
+        """
+        context = context or {}
+        key = (alias, message, _context_key(context))
+        if key in self._entries:
+            return False
+        self._entries[key] = context
+        if len(self._entries) > self._max_size:
+            dropped_alias = self._entries.popitem(last=False)[0][0]
+            _LOGGER.warning(
+                f"UniNotifier: riepilogo DND pieno ({self._max_size}), scartata la notifica "
+                f"più vecchia per {dropped_alias}"
+            )
+        self._store.async_delay_save(self._data_to_save, _SAVE_DELAY)
+        self._schedule_flush(now)
+        return True
+
+    def _schedule_flush(self, now: datetime) -> None:
+        if self._unsub is not None or not self._entries:
+            return
+        end = self._schedule.next_dnd_end(now)
+        if end is None:
+            # DND disabilitato (es. configurazione cambiata): consegna subito
+            end = now
+        self._unsub = async_track_point_in_time(self._hass, self._async_fire, end)
+
+    @callback
+    def _async_fire(self, now: datetime) -> None:
+        self._unsub = None
+        if self._schedule.state(now).dnd_active:
+            self._schedule_flush(now)
+            return
+        if not self._entries:
+            return
+
+        # (alias, chiave del contesto) -> (alias, contesto, messaggi)
+        groups: dict[tuple, tuple] = {}
+        for (alias, message, context_key), context in self._entries.items():
+            group = groups.get((alias, context_key))
+            if group is None:
+                group = groups[(alias, context_key)] = (alias, context, [])
+            group[2].append(message)
+        self._entries.clear()
+        self._store.async_delay_save(self._data_to_save, 0)
+
+        batch = list(groups.values())
+        aliases = dict.fromkeys(alias for alias, _, _ in batch)
+        _LOGGER.info(f"UniNotifier: fine DND, riepilogo per {', '.join(aliases)}")
+        self._hass.async_create_task(self._flush(batch))
+
+    @callback
+    def start(self) -> None:
+        """A HA avviato: consegna subito se il DND è già finito, altrimenti programma."""
+        now = dt_util.now()
+        if not self._schedule.state(now).dnd_active:
+            self._async_fire(now)
+        else:
+            self._schedule_flush(now)
+
+    @callback
+    def async_stop(self, _event=None) -> None:
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
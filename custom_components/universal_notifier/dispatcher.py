@@ -0,0 +1,368 @@
+# /config/custom_components/universal_notifier/dispatcher.py
+
+import asyncio
+import contextlib
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Callable
+
+from homeassistant.core import HomeAssistant
+
+from .breaker import CircuitBreakers
+from .journal import DeliveryJournal
+from .metrics import ChannelStats, LatencyHistogram, NotifierMetrics
+from .sequencer import AnnouncementPreempted, PlayerSequencer
+from .const import (
+    CONF_ENTITY_ID,
+    RESULT_SENT, RESULT_FAILED, RESULT_TIMED_OUT, RESULT_SKIPPED, RESULT_QUEUED,
+    RESULT_RATE_LIMITED, RESULT_DEDUPLICATED, RESULT_COALESCED, RESULT_PREEMPTED,
+    RESULT_DEFERRED, RESULT_CIRCUIT_OPEN,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# ==============================================================================
+# DELIVERY
+# ==============================================================================
+
+@dataclass(slots=True)
+class Delivery:
+    """Consegna verso un singolo target, con payload già costruito."""
+    target: str
+    domain: str
+    service: str
+    payload: dict
+    # Step opzionale di volume (solo canali voice): eseguito SEMPRE prima della chiamata.
+    # Uno o più player (lista ordinata), normalizzati da volume_target()
+    volume_entity: str | list | None = None
+    volume_level: float | None = None
+    # Istante (time.monotonic) prenotato dal rate limiter; 0 = subito
+    not_before: float = 0.0
+    # Corsia prioritaria (priority: true nella chiamata)
+    priority: bool = False
+    # Canale vocale: soggetto al DND anche nei nuovi tentativi
+    is_voice: bool = False
+    # Deviata sul servizio di fallback (circuito aperto): non conta per il circuito
+    fallback: bool = False
+    # Tempo di rendering del messaggio (secondi), riportato nel giornale
+    render_time: float | None = None
+    # Payload originale (con 'url') se gli allegati hanno sostituito il media
+    # con un file in cache: è quello che va accodato per i nuovi tentativi
+    source_payload: dict | None = None
+
+    @property
+    def full_service_name(self) -> str:
+        return f"{self.domain}.{self.service}"
+
+
+def player_slot(sequencer: PlayerSequencer | None, delivery: Delivery):
+    """Turno esclusivo sul media player della consegna (no-op se non c'è volume)."""
+    if sequencer is None or not delivery.volume_entity:
+        return contextlib.nullcontext()
+    return sequencer.announcement(delivery.volume_entity, delivery.priority)
+
+
+def new_results() -> dict:
+    """Struttura vuota degli esiti, restituita come risposta del servizio."""
+    return {
+        RESULT_SENT: [],
+        RESULT_FAILED: [],
+        RESULT_TIMED_OUT: [],
+        RESULT_SKIPPED: [],
+        RESULT_QUEUED: [],
+        RESULT_RATE_LIMITED: [],
+        RESULT_DEDUPLICATED: [],
+        RESULT_COALESCED: [],
+        RESULT_PREEMPTED: [],
+        RESULT_DEFERRED: [],
+        RESULT_CIRCUIT_OPEN: [],
+    }
+
+# ==============================================================================
+# CORSIE
+# ==============================================================================
+
+class Lane:
+    """
+    Corsia di dispatch: budget di concorrenza e timeout propri, condivisi tra
+    tutte le chiamate al servizio. Tiene traccia di coda e tempi di attesa.
+    """
+
+    __slots__ = ("name", "timeout", "_semaphore", "waiting", "in_flight", "wait_time")
+
+    def __init__(self, name: str, max_concurrency: int, timeout: float) -> None:
+        self.name = name
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.waiting = 0
+        self.in_flight = 0
+        # Dall'ingresso in coda all'inizio della chiamata (turno del player incluso)
+        self.wait_time = LatencyHistogram()
+
+    @asynccontextmanager
+    async def slot(self, sequencer: PlayerSequencer | None, delivery: Delivery):
+        """Turno sul player e posto nella corsia, acquisiti in quest'ordine."""
+        start = time.perf_counter()
+        self.waiting += 1
+        queued = True
+        try:
+            # Il player prima del semaforo: chi aspetta un Echo non occupa posti
+            async with player_slot(sequencer, delivery), self._semaphore:
+                self.waiting -= 1
+                queued = False
+                self.wait_time.observe(time.perf_counter() - start)
+                self.in_flight += 1
+                try:
+                    yield
+                finally:
+                    self.in_flight -= 1
+        finally:
+            if queued:
+                self.waiting -= 1
+
+    def as_dict(self) -> dict:
+        return {
+            "depth": self.waiting,
+            "in_flight": self.in_flight,
+            "wait": self.wait_time.as_dict(),
+        }
+
+
+class DispatchLanes:
+    """Corsia normale e corsia prioritaria: gli allarmi non aspettano la routine."""
+
+    __slots__ = ("normal", "priority")
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        timeout: float,
+        priority_max_concurrency: int,
+        priority_timeout: float,
+    ) -> None:
+        self.normal = Lane("normal", max_concurrency, timeout)
+        self.priority = Lane("priority", priority_max_concurrency, priority_timeout)
+
+    def lane(self, delivery: Delivery) -> Lane:
+        return self.priority if delivery.priority else self.normal
+
+    def as_dict(self) -> dict:
+        return {lane.name: lane.as_dict() for lane in (self.normal, self.priority)}
+
+# ==============================================================================
+# ESECUZIONE
+# ==============================================================================
+
+async def async_execute_delivery(
+    hass: HomeAssistant,
+    delivery: Delivery,
+    stats: ChannelStats | None = None,
+    sequencer: PlayerSequencer | None = None,
+) -> None:
+    """
+    Esegue volume_set (se previsto) e poi la chiamata al provider, in ordine.
+    Se `stats` è presente, registra la latenza di entrambi i passi.
+    Con un `sequencer` la consegna deve già essere dentro `player_slot`: il
+    volume_set è saltato se il player è già al livello richiesto e la chiamata
+    può essere interrotta da un annuncio prioritario (AnnouncementPreempted).
+    """
+    if delivery.volume_entity:
+        start = time.perf_counter()
+        called = True
+        try:
+            if sequencer is not None:
+                called = await sequencer.async_set_volume(
+                    delivery.volume_entity, delivery.volume_level
+                )
+            else:
+                await hass.services.async_call(
+                    "media_player",
+                    "volume_set",
+                    {CONF_ENTITY_ID: delivery.volume_entity, "volume_level": delivery.volume_level},
+                    blocking=True,
+                )
+        except Exception as e:
+            # Il volume non è bloccante: l'annuncio parte comunque
+            _LOGGER.warning(f"UniNotifier: volume_set fallito su {delivery.volume_entity}: {e}")
+        if stats is not None:
+            if called:
+                stats.volume_latency.observe(time.perf_counter() - start)
+            else:
+                stats.volume_skipped += 1
+
+    start = time.perf_counter()
+    try:
+        call = hass.services.async_call(
+            delivery.domain, delivery.service, delivery.payload, blocking=True
+        )
+        if sequencer is not None and delivery.volume_entity:
+            await sequencer.async_announce(delivery.volume_entity, delivery.priority, call)
+        else:
+            await call
+    finally:
+        if stats is not None:
+            stats.call_latency.observe(time.perf_counter() - start)
+
+
+async def async_dispatch(
+    hass: HomeAssistant,
+    deliveries: list,
+    results: dict,
+    concurrent: bool,
+    lanes: DispatchLanes,
+    on_failure: Callable[[Delivery], str | None] | None = None,
+    metrics: NotifierMetrics | None = None,
+    sequencer: PlayerSequencer | None = None,
+    on_done: Callable[[Delivery, str, float, bool], None] | None = None,
+    breakers: CircuitBreakers | None = None,
+    journal: DeliveryJournal | None = None,
+) -> dict:
+    """
+    Invia le consegne e popola `results` con gli esiti per target.
+    In modalità concorrente le consegne sono raggruppate per canale: ogni
+    canale riceve i suoi messaggi in ordine, i canali procedono in parallelo.
+    In modalità sequenziale i canali che devono attendere il rate limiter
+    proseguono per conto loro (sempre in ordine): l'attesa di un canale non
+    ritarda i target successivi.
+    Concorrenza massima e timeout (per singola consegna) sono quelli della
+    corsia della consegna, condivisi con le altre chiamate in corso; le
+    consegne prioritarie partono per prime.
+    Le consegne fallite o scadute sono passate a `on_failure`, se presente,
+    che restituisce l'id di accodamento; quelle interrotte da un annuncio
+    prioritario no, perché il player le ha già iniziate.
+    Con un `sequencer` gli annunci verso lo stesso media player sono
+    serializzati; l'attesa del turno non conta nel timeout.
+    `on_done`, se presente, riceve ogni consegna conclusa con esito, durata
+    (secondi) e se è stata accodata per un nuovo tentativo.
+    Con `breakers` gli esiti aggiornano il circuito del canale e le consegne
+    il cui circuito si è aperto nel frattempo sono saltate senza chiamata.
+    Con `journal` ogni esito è registrato nel giornale delle consegne, e il
+    passaggio alla coda di retry come record 'queued' aggiuntivo.
+    """
+
+    def _failed(delivery: Delivery) -> str | None:
+        """Id di accodamento per un nuovo tentativo, o None."""
+        if on_failure is None:
+            return None
+        queue_id = on_failure(delivery)
+        if queue_id is not None:
+            results[RESULT_QUEUED].append(delivery.target)
+        return queue_id
+
+    async def _run(delivery: Delivery, timeout: float) -> None:
+        stats = metrics.channel(delivery.target) if metrics is not None else None
+        start = time.perf_counter()
+        queue_id = None
+        reason = "fallback" if delivery.fallback else None
+        try:
+            async with asyncio.timeout(timeout):
+                await async_execute_delivery(hass, delivery, stats, sequencer)
+        except TimeoutError:
+            _LOGGER.error(
+                f"UniNotifier: Timeout ({timeout}s) chiamata {delivery.full_service_name} "
+                f"per {delivery.target}"
+            )
+            outcome = RESULT_TIMED_OUT
+            reason = f"timeout {timeout}s"
+            if stats is not None:
+                stats.timed_out += 1
+            if breakers is not None and not delivery.fallback:
+                breakers.record_failure(delivery.target, time.monotonic())
+            queue_id = _failed(delivery)
+        except AnnouncementPreempted:
+            _LOGGER.warning(
+                f"UniNotifier: annuncio per {delivery.target} interrotto da un annuncio prioritario"
+            )
+            outcome = RESULT_PREEMPTED
+            if stats is not None:
+                stats.preempted += 1
+            # Non accodata: il player ha già iniziato a riprodurla (annullare
+            # la chiamata non ferma l'Echo) e un retry la farebbe sentire due volte
+        except Exception as e:
+            _LOGGER.error(f"UniNotifier: Errore chiamata {delivery.full_service_name}: {e}")
+            outcome = RESULT_FAILED
+            reason = str(e)[:200] or type(e).__name__
+            if stats is not None:
+                stats.failed += 1
+            if breakers is not None and not delivery.fallback:
+                breakers.record_failure(delivery.target, time.monotonic())
+            queue_id = _failed(delivery)
+        else:
+            outcome = RESULT_SENT
+            if stats is not None:
+                stats.sent += 1
+            if breakers is not None and not delivery.fallback:
+                breakers.record_success(delivery.target)
+        duration = time.perf_counter() - start
+        results[outcome].append(delivery.target)
+        if journal is not None:
+            journal.add(delivery.target, delivery.full_service_name, outcome, reason,
+                        delivery.render_time, duration)
+            # Passaggio alla coda di retry: record a parte, con l'id della voce
+            if queue_id is not None:
+                journal.add(delivery.target, delivery.full_service_name, RESULT_QUEUED,
+                            f"retry {queue_id}")
+        if on_done is not None:
+            on_done(delivery, outcome, duration, queue_id is not None)
+
+    async def _run_queued(delivery: Delivery) -> None:
+        # Attesa del token prenotato dal rate limiter (fuori da timeout e corsia)
+        delay = delivery.not_before - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Circuito aperto da una consegna precedente: nessuna attesa sul provider
+        if (breakers is not None and not delivery.fallback
+                and breakers.is_open(delivery.target, time.monotonic())):
+            _LOGGER.debug(f"UniNotifier: circuito aperto, salto {delivery.target}")
+            results[RESULT_CIRCUIT_OPEN].append(delivery.target)
+            stats = metrics.channel(delivery.target) if metrics is not None else None
+            if stats is not None:
+                stats.circuit_open += 1
+            if journal is not None:
+                journal.add(delivery.target, delivery.full_service_name, RESULT_CIRCUIT_OPEN,
+                            render_time=delivery.render_time)
+            if on_done is not None:
+                on_done(delivery, RESULT_CIRCUIT_OPEN, 0.0, False)
+            return
+        # Turno sul player e posto nella corsia sono acquisiti fuori dal
+        # timeout: l'attesa in coda non conta
+        lane = lanes.lane(delivery)
+        async with lane.slot(sequencer, delivery):
+            await _run(delivery, lane.timeout)
+
+    async def _run_in_order(ordered: list) -> None:
+        for delivery in ordered:
+            await _run_queued(delivery)
+
+    # Ordinamento stabile: le prioritarie davanti, il resto nell'ordine originale
+    if any(delivery.priority for delivery in deliveries):
+        deliveries = sorted(deliveries, key=lambda delivery: not delivery.priority)
+
+    if concurrent and len(deliveries) > 1:
+        by_channel = {}
+        for delivery in deliveries:
+            by_channel.setdefault(delivery.target, []).append(delivery)
+        await asyncio.gather(*(_run_in_order(group) for group in by_channel.values()))
+        return results
+
+    now = time.monotonic()
+    throttled = {delivery.target for delivery in deliveries if delivery.not_before > now}
+    if not throttled:
+        await _run_in_order(deliveries)
+        return results
+
+    # Tutte le consegne di un canale rallentato vanno nella sua sequenza,
+    # così il canale mantiene l'ordine dei messaggi
+    sequence, by_channel = [], {}
+    for delivery in deliveries:
+        if delivery.target in throttled:
+            by_channel.setdefault(delivery.target, []).append(delivery)
+        else:
+            sequence.append(delivery)
+    await asyncio.gather(
+        _run_in_order(sequence), *(_run_in_order(group) for group in by_channel.values())
+    )
+
+    return results
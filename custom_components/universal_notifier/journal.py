@@ -0,0 +1,126 @@
+# /config/custom_components/universal_notifier/journal.py
+
+import logging
+import time
+from collections import deque
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .const import HISTORY_STORAGE_KEY
+
+_LOGGER = logging.getLogger(__name__)
+
+_STORAGE_VERSION = 1
+# Il giornale su disco è riscritto al più una volta ogni FLUSH_DELAY secondi
+_FLUSH_DELAY = 60
+
+# ==============================================================================
+# RECORD
+# ==============================================================================
+
+class JournalRecord:
+    """Esito di una consegna verso un singolo target (tempi in secondi)."""
+
+    __slots__ = ("time", "target", "service", "outcome", "reason", "render_time", "call_time")
+
+    def __init__(self, time: float, target: str, service: str | None, outcome: str,
+                 reason: str | None, render_time: float | None, call_time: float | None) -> None:
+        self.time = time
+        self.target = target
+        self.service = service
+        self.outcome = outcome
+        self.reason = reason
+        self.render_time = render_time
+        self.call_time = call_time
+
+    def as_record(self) -> list:
+        """Forma compatta su disco: una lista posizionale per record."""
+        return [
+            round(self.time, 3), self.target, self.service, self.outcome, self.reason,
+            _round(self.render_time), _round(self.call_time),
+        ]
+
+    def as_dict(self) -> dict:
+        return {
+            "time": dt_util.utc_from_timestamp(self.time).isoformat(),
+            "target": self.target,
+            "service": self.service,
+            "outcome": self.outcome,
+            "reason": self.reason,
+            "render_time": _round(self.render_time),
+            "call_time": _round(self.call_time),
+        }
+
+
+def _round(seconds: float | None) -> float | None:
+    return round(seconds, 6) if seconds is not None else None
+
+# ==============================================================================
+# GIORNALE DELLE CONSEGNE
+# ==============================================================================
+
+class DeliveryJournal:
+    """
+    Ultimi `max_entries` esiti di consegna in un ring buffer: la memoria
+    resta costante qualunque sia il traffico. Con `persist` il giornale è
+    salvato in .storage (al più ogni minuto e allo stop di HA) e ricaricato
+    al riavvio.
+    """
+
+    def __init__(self, hass: HomeAssistant, max_entries: int, persist: bool) -> None:
+        self._records: deque = deque(maxlen=max_entries)
+        self._store = Store(hass, _STORAGE_VERSION, HISTORY_STORAGE_KEY) if persist else None
+        self._save_scheduled = False
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    async def async_load(self) -> None:
+        if self._store is None:
+            return
+        data = await self._store.async_load()
+        for record in (data or {}).get("records", []):
+            try:
+                self._records.append(JournalRecord(*record))
+            except TypeError:
+                _LOGGER.debug(f"UniNotifier: record del giornale non valido ignorato: {record}")
+
+    def _data_to_save(self) -> dict:
+        self._save_scheduled = False
+        return {"records": [record.as_record() for record in self._records]}
+
+    def add(self, target: str, service: str | None, outcome: str, reason: str | None = None,
+            render_time: float | None = None, call_time: float | None = None) -> None:
+        self._records.append(
+            JournalRecord(time.time(), target, service, outcome, reason, render_time, call_time)
+        )
+        # Un solo salvataggio programmato alla volta: il traffico non lo rimanda
+        if self._store is not None and not self._save_scheduled:
+            self._save_scheduled = True
+            self._store.async_delay_save(self._data_to_save, _FLUSH_DELAY)
+
+    def query(
+        self,
+        targets=None,
+        outcomes=None,
+        start: float | None = None,
+        end: float | None = None,
+        limit: int | None = None,
+    ) -> list:
+        """Record filtrati, dal più recente; `start`/`end` sono timestamp UNIX."""
+        entries = []
+        for record in reversed(self._records):
+            if end is not None and record.time > end:
+                continue
+            if start is not None and record.time < start:
+                break  # i record sono in ordine di tempo
+            if targets is not None and record.target not in targets:
+                continue
+            if outcomes is not None and record.outcome not in outcomes:
+                continue
+            entries.append(record.as_dict())
+            if limit is not None and len(entries) >= limit:
+                break
+        return entries
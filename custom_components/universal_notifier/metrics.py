@@ -0,0 +1,133 @@
+# /config/custom_components/universal_notifier/metrics.py
+
+import bisect
+
+# Limiti superiori dei bucket di latenza (secondi); l'ultimo bucket è +inf
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# ==============================================================================
+# ISTOGRAMMA
+# ==============================================================================
+
+class LatencyHistogram:
+    """Istogramma a bucket fissi: observe() non alloca nulla."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float | None:
+        """Stima del quantile: limite superiore del bucket che lo contiene."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 4),
+        }
+
+# ==============================================================================
+# CONTATORI
+# ==============================================================================
+
+class ChannelStats:
+    """Contatori di un canale, allocati una volta al setup."""
+
+    __slots__ = ("sent", "failed", "timed_out", "skipped_dnd", "deferred", "rate_limited",
+                 "deduplicated", "preempted", "circuit_open", "fallback", "unoccupied", "volume_skipped",
+                 "call_latency", "volume_latency")
+
+    def __init__(self) -> None:
+        self.sent = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.skipped_dnd = 0
+        self.deferred = 0
+        self.rate_limited = 0
+        self.deduplicated = 0
+        # Annunci ordinari interrotti da un annuncio prioritario
+        self.preempted = 0
+        # Consegne saltate a circuito aperto / deviate sul servizio di fallback
+        self.circuit_open = 0
+        self.fallback = 0
+        # Saltate con 'only_occupied' perché la stanza era vuota
+        self.unoccupied = 0
+        # volume_set non eseguiti perché il player era già al livello richiesto
+        self.volume_skipped = 0
+        self.call_latency = LatencyHistogram()
+        self.volume_latency = LatencyHistogram()
+
+    def as_dict(self) -> dict:
+        total = self.sent + self.failed + self.timed_out
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "skipped_dnd": self.skipped_dnd,
+            "deferred": self.deferred,
+            "rate_limited": self.rate_limited,
+            "deduplicated": self.deduplicated,
+            "preempted": self.preempted,
+            "circuit_open": self.circuit_open,
+            "fallback": self.fallback,
+            "unoccupied": self.unoccupied,
+            "volume_skipped": self.volume_skipped,
+            "failure_rate": round((self.failed + self.timed_out) / total, 4) if total else 0.0,
+            "call_latency": self.call_latency.as_dict(),
+            "volume_latency": self.volume_latency.as_dict(),
+        }
+
+
+class NotifierMetrics:
+    """Metriche del componente: un ChannelStats per alias + target sconosciuti."""
+
+    def __init__(self, aliases) -> None:
+        self.channels = {alias: ChannelStats() for alias in aliases}
+        self.unknown_target = 0
+
+    def add_channels(self, aliases) -> None:
+        """Contatori per i canali aggiunti da un reload (quelli esistenti restano)."""
+        for alias in aliases:
+            if alias not in self.channels:
+                self.channels[alias] = ChannelStats()
+
+    def channel(self, alias: str) -> ChannelStats | None:
+        return self.channels.get(alias)
+
+    @property
+    def sent(self) -> int:
+        return sum(stats.sent for stats in self.channels.values())
+
+    @property
+    def failed(self) -> int:
+        return sum(stats.failed + stats.timed_out for stats in self.channels.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "unknown_target": self.unknown_target,
+            "channels": {alias: stats.as_dict() for alias, stats in self.channels.items()},
+        }
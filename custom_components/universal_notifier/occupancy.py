@@ -0,0 +1,103 @@
+# /config/custom_components/universal_notifier/occupancy.py
+
+import logging
+from typing import Mapping
+
+from homeassistant.const import STATE_HOME, STATE_ON, STATE_UNAVAILABLE, STATE_UNKNOWN
+from homeassistant.core import CALLBACK_TYPE, Event, HomeAssistant, State, callback
+from homeassistant.helpers.event import async_track_state_change_event
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def is_occupied(state: State | None) -> bool:
+    """
+    Presenza da uno stato: on (occupancy/motion), home (person, device_tracker)
+    o un conteggio > 0 (zone). Entità assenti o non disponibili contano come
+    occupate: meglio un annuncio in più che uno perso.
+    """
+    if state is None or state.state in (STATE_UNKNOWN, STATE_UNAVAILABLE):
+        return True
+    if state.state in (STATE_ON, STATE_HOME):
+        return True
+    try:
+        return float(state.state) > 0
+    except ValueError:
+        return False
+
+# ==============================================================================
+# MAPPA DI OCCUPAZIONE
+# ==============================================================================
+
+class OccupancyTracker:
+    """
+    Occupazione dei canali con entità di presenza, tenuta in memoria e
+    aggiornata dagli eventi di cambio stato: durante l'invio decidere se un
+    canale è occupato è una lettura da dict, senza accessi allo state machine.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self._hass = hass
+        # alias -> entità di presenza; entità -> alias che la usano
+        self._presence: Mapping = {}
+        self._aliases_by_entity: dict[str, list] = {}
+        self._entity_occupied: dict[str, bool] = {}
+        self._occupied: dict[str, bool] = {}
+        self._unsub: CALLBACK_TYPE | None = None
+
+    def update(self, presence: Mapping) -> None:
+        """Nuova tabella alias -> tuple di entità (setup e reload)."""
+        self.async_stop()
+        self._presence = presence
+        self._aliases_by_entity = {}
+        for alias, entities in presence.items():
+            for entity_id in entities:
+                self._aliases_by_entity.setdefault(entity_id, []).append(alias)
+
+        # Unica lettura dello state machine: lo stato iniziale delle entità
+        self._entity_occupied = {
+            entity_id: is_occupied(self._hass.states.get(entity_id))
+            for entity_id in self._aliases_by_entity
+        }
+        self._occupied = {alias: self._compute(alias) for alias in presence}
+        if self._aliases_by_entity:
+            self._unsub = async_track_state_change_event(
+                self._hass, list(self._aliases_by_entity), self._async_state_changed
+            )
+
+    def _compute(self, alias: str) -> bool:
+        return any(self._entity_occupied[entity_id] for entity_id in self._presence[alias])
+
+    @callback
+    def _async_state_changed(self, event: Event) -> None:
+        entity_id = event.data["entity_id"]
+        occupied = is_occupied(event.data.get("new_state"))
+        if self._entity_occupied.get(entity_id) == occupied:
+            return
+        self._entity_occupied[entity_id] = occupied
+        for alias in self._aliases_by_entity.get(entity_id, ()):
+            self._occupied[alias] = self._compute(alias)
+
+    def tracks(self, alias: str) -> bool:
+        return alias in self._occupied
+
+    def split(self, targets) -> tuple[list, list]:
+        """(target da usare, target con presenza ma vuoti)."""
+        if not self._occupied:
+            return list(targets), []
+        kept, vacant = [], []
+        for alias in targets:
+            if self._occupied.get(alias, True):
+                kept.append(alias)
+            else:
+                vacant.append(alias)
+        return kept, vacant
+
+    def state(self) -> dict:
+        return dict(self._occupied)
+
+    @callback
+    def async_stop(self, _event=None) -> None:
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
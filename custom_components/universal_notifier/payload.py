@@ -0,0 +1,95 @@
+# /config/custom_components/universal_notifier/payload.py
+
+from types import MappingProxyType
+from typing import Mapping
+
+_MISSING = object()
+
+# Livello vuoto condiviso (es. target senza target_data)
+EMPTY_LAYER = MappingProxyType({})
+
+# ==============================================================================
+# PAYLOAD A LIVELLI
+# ==============================================================================
+
+class LayeredPayload:
+    """
+    Payload di una consegna costruito per livelli, senza copiare né modificare
+    le sorgenti. In ordine di precedenza crescente:
+      1. service_data del canale (configurazione, condivisa tra le chiamate)
+      2. valori di base calcolati dal notifier (`set_default`, es. url/caption)
+      3. 'data' della chiamata (condiviso tra i target)
+      4. target_data del target
+      5. valori impostati durante la costruzione (messaggio, titolo, ...)
+    I livelli 1, 3 e 4 sono solo letti: le chiavi "consumate" del target (message,
+    type, ...) e quelle rimosse sono annotate a parte, e il dict finale è
+    materializzato una volta sola da `build()`.
+    """
+
+    __slots__ = ("_config", "_defaults", "_runtime", "_target", "_consumed", "_overrides",
+                 "_removed")
+
+    def __init__(self, config: Mapping, runtime: Mapping, target: Mapping,
+                 consumed: tuple = ()) -> None:
+        self._config = config
+        self._defaults: dict = {}
+        self._runtime = runtime
+        self._target = target
+        # Chiavi del target usate dal notifier e non inoltrate al provider
+        self._consumed: set = set(consumed)
+        self._overrides: dict = {}
+        self._removed: set = set()
+
+    def take(self, key: str, default=None):
+        """Legge e consuma una chiave del solo livello target (come un pop)."""
+        if key in self._consumed:
+            return default
+        self._consumed.add(key)
+        return self._target.get(key, default)
+
+    def get(self, key: str, default=None):
+        """Valore effettivo della chiave, dal livello con precedenza più alta."""
+        if key in self._removed:
+            return default
+        value = self._overrides.get(key, _MISSING)
+        if value is _MISSING and key not in self._consumed:
+            value = self._target.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._runtime.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._defaults.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._config.get(key, default)
+        return value
+
+    def set_default(self, key: str, value) -> None:
+        """Valore sotto 'data' e target_data, che possono ancora sovrascriverlo."""
+        self._defaults[key] = value
+        self._removed.discard(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        self._overrides[key] = value
+        self._removed.discard(key)
+
+    def pop(self, key: str, default=None):
+        """Valore effettivo della chiave, che non comparirà nel payload finale."""
+        value = self.get(key, default)
+        self._overrides.pop(key, None)
+        self._removed.add(key)
+        return value
+
+    def build(self) -> dict:
+        """Il payload finale: l'unico dict allocato per la consegna."""
+        payload = dict(self._config)
+        payload.update(self._defaults)
+        payload.update(self._runtime)
+        if self._consumed:
+            payload.update(
+                (key, value) for key, value in self._target.items() if key not in self._consumed
+            )
+        else:
+            payload.update(self._target)
+        payload.update(self._overrides)
+        for key in self._removed:
+            payload.pop(key, None)
+        return payload
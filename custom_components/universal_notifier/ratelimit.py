@@ -0,0 +1,117 @@
+# /config/custom_components/universal_notifier/ratelimit.py
+
+import time
+
+from .const import (
+    CONF_RATE, CONF_BURST, CONF_POLICY, CONF_MAX_WAIT,
+    RATE_POLICY_DROP,
+)
+
+# ==============================================================================
+# TOKEN BUCKET
+# ==============================================================================
+
+class TokenBucket:
+    """Token bucket classico: `rate` token al secondo, fino a `burst` accumulati."""
+
+    __slots__ = ("rate", "burst", "_tokens", "_stamp")
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def wait_time(self, now: float) -> float:
+        """Secondi da attendere prima che un token sia disponibile (0 = subito)."""
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def consume(self) -> None:
+        # I token possono andare in negativo: è la prenotazione dei messaggi in coda
+        self._tokens -= 1
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class _Limit:
+    __slots__ = ("bucket", "policy", "max_wait")
+
+    def __init__(self, conf: dict) -> None:
+        self.bucket = TokenBucket(conf[CONF_RATE], conf[CONF_BURST])
+        self.policy = conf[CONF_POLICY]
+        self.max_wait = conf[CONF_MAX_WAIT]
+
+    def accepts(self, wait: float) -> bool:
+        if wait <= 0:
+            return True
+        return self.policy != RATE_POLICY_DROP and wait <= self.max_wait
+
+# ==============================================================================
+# RATE LIMITER
+# ==============================================================================
+
+class RateLimiter:
+    """
+    Limiti per canale (chiave: alias) più un tetto globale opzionale.
+    `reserve` restituisce l'istante (monotonic) da cui la consegna può partire,
+    oppure None se va scartata secondo la policy.
+    Le consegne prioritarie consumano comunque i token ma partono subito.
+    """
+
+    def __init__(self, channel_limits: dict, global_limit: dict | None = None) -> None:
+        self._limits = {alias: _Limit(conf) for alias, conf in channel_limits.items()}
+        self._global = _Limit(global_limit) if global_limit else None
+
+    def __bool__(self) -> bool:
+        return bool(self._limits) or self._global is not None
+
+    def reserve(self, alias: str, priority: bool = False) -> float | None:
+        now = time.monotonic()
+        limit = self._limits.get(alias)
+
+        if priority:
+            # Il debito di token ricade sulle consegne ordinarie successive
+            for bucket_limit in (limit, self._global):
+                if bucket_limit is not None:
+                    bucket_limit.bucket.wait_time(now)
+                    bucket_limit.bucket.consume()
+            return now
+
+        wait = 0.0
+        if limit is not None:
+            wait = limit.bucket.wait_time(now)
+            if not limit.accepts(wait):
+                return None
+        if self._global is not None:
+            global_wait = self._global.bucket.wait_time(now)
+            if not self._global.accepts(global_wait):
+                return None
+            wait = max(wait, global_wait)
+
+        # Prenotiamo solo dopo che entrambi i limiti hanno accettato
+        if limit is not None:
+            limit.bucket.consume()
+        if self._global is not None:
+            self._global.bucket.consume()
+        return now + wait
+
+    def state(self) -> dict:
+        """Token disponibili per canale (per diagnostica)."""
+        now = time.monotonic()
+        state = {}
+        for alias, limit in self._limits.items():
+            limit.bucket.wait_time(now)
+            state[alias] = round(limit.bucket.tokens, 2)
+        if self._global is not None:
+            self._global.bucket.wait_time(now)
+            state["_global"] = round(self._global.bucket.tokens, 2)
+        return state
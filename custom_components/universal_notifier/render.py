@@ -0,0 +1,173 @@
+# /config/custom_components/universal_notifier/render.py
+
+import re
+from functools import lru_cache
+
+# ==============================================================================
+# PATTERN PRECOMPILATI
+# ==============================================================================
+
+# Markdown base e parentesi
+_TTS_MARKUP_RE = re.compile(r'[*_`\[\]]')
+# URL
+_TTS_URL_RE = re.compile(r'http\S+')
+
+
+def clean_text_for_tts(text: str) -> str:
+    """Rimuove caratteri speciali per la sintesi vocale."""
+    if not text:
+        return ""
+    text = _TTS_MARKUP_RE.sub('', text)
+    text = _TTS_URL_RE.sub('', text)
+    return text.strip()
+
+# ==============================================================================
+# FORMATTER PER PARSE MODE
+# ==============================================================================
+
+class Formatter:
+    """Formatter testuale senza markup (nessun parse_mode)."""
+    key = "plain"
+
+    def escape(self, text: str) -> str:
+        return text
+
+    def bold(self, text: str) -> str:
+        return text
+
+
+class HtmlFormatter(Formatter):
+    key = "html"
+
+    def escape(self, text: str) -> str:
+        return text.replace("<", "&lt;").replace(">", "&gt;")
+
+    def bold(self, text: str) -> str:
+        return f"<b>{text}</b>"
+
+
+class MarkdownFormatter(Formatter):
+    key = "markdown"
+
+    # Markdown V1: nessun escape, il grassetto va SOLO sul prefisso intero
+    def bold(self, text: str) -> str:
+        return f"*{text}*"
+
+
+class TtsFormatter(Formatter):
+    """Testo pulito per la sintesi vocale (niente bolding)."""
+    key = "tts"
+
+    def escape(self, text: str) -> str:
+        return clean_text_for_tts(text)
+
+
+PLAIN = Formatter()
+HTML = HtmlFormatter()
+MARKDOWN = MarkdownFormatter()
+TTS = TtsFormatter()
+
+
+@lru_cache(maxsize=32)
+def get_formatter(parse_mode: str | None, voice: bool = False) -> Formatter:
+    """Risolve il formatter una sola volta per ogni valore di parse_mode."""
+    if voice:
+        return TTS
+    mode = parse_mode.lower() if parse_mode else ""
+    if "html" in mode:
+        return HTML
+    if "markdown" in mode:
+        return MARKDOWN
+    return PLAIN
+
+# ==============================================================================
+# RENDERER (uno per chiamata al servizio)
+# ==============================================================================
+
+class MessageRenderer:
+    """
+    Rende i messaggi di una singola chiamata: il prefisso [nome - ora] e il
+    saluto sono calcolati una volta per formatter, e i risultati sono messi
+    in cache per (messaggio, formatter, titolo inline), così un broadcast a
+    molti target con lo stesso parse_mode rende il testo una sola volta.
+    Anche i template di canale sono resi una volta per messaggio, e per
+    target solo se il template usa la variabile `target`.
+    """
+
+    __slots__ = ("_name", "_time_str", "_greeting", "_title", "_bold_prefix",
+                 "_slot", "_priority", "_prefixes", "_cache")
+
+    def __init__(self, name: str, time_str: str, greeting: str,
+                 title: str | None, bold_prefix: bool = True,
+                 slot: str | None = None, priority: bool = False) -> None:
+        self._name = name
+        self._time_str = time_str
+        self._greeting = greeting
+        self._title = title
+        self._bold_prefix = bold_prefix
+        self._slot = slot
+        self._priority = priority
+        self._prefixes = {}
+        self._cache = {}
+
+    def _prefix(self, fmt: Formatter) -> str:
+        prefix = self._prefixes.get(fmt.key)
+        if prefix is None:
+            if fmt is TTS:
+                greeting = clean_text_for_tts(self._greeting)
+                prefix = f"{greeting}. " if greeting else ""
+            else:
+                # Prefisso senza markup interno (Markdown non deve vedere asterischi dentro [])
+                raw_prefix = f"{self._name} - {self._time_str}" if self._time_str else f"{self._name}"
+                raw_prefix = f"[{fmt.escape(raw_prefix)}]"
+                prefix = fmt.bold(raw_prefix) if self._bold_prefix else raw_prefix
+                prefix += " "
+            self._prefixes[fmt.key] = prefix
+        return prefix
+
+    def render(self, message: str, parse_mode: str | None, voice: bool,
+               inject_title: bool = False) -> str:
+        """Messaggio finale per un target (comandi esclusi)."""
+        fmt = get_formatter(parse_mode, voice)
+        inject_title = bool(inject_title and self._title and not voice)
+        key = (message, fmt.key, inject_title)
+
+        rendered = self._cache.get(key)
+        if rendered is not None:
+            return rendered
+
+        if voice:
+            rendered = f"{self._prefix(fmt)}{fmt.escape(message)}"
+        else:
+            # Linea 1: prefisso + titolo inline, poi il messaggio
+            title_inline = f" {fmt.bold(fmt.escape(self._title))}" if inject_title else ""
+            rendered = f"{self._prefix(fmt)}{title_inline}\n{fmt.escape(message)}"
+
+        self._cache[key] = rendered
+        return rendered
+
+    def render_body(self, message: str, parse_mode: str | None, voice: bool) -> str:
+        """Il solo testo del messaggio, senza prefisso né titolo (messaggi combinati)."""
+        return get_formatter(parse_mode, voice).escape(message)
+
+    def render_template(self, template, message: str, target: str) -> str | None:
+        """
+        Testo di un template di canale (ChannelTemplate) con il contesto della
+        chiamata. None se il rendering fallisce.
+        """
+        key = (template, message, target if template.uses_target else None)
+        if key in self._cache:
+            return self._cache[key]
+
+        rendered = template.render({
+            "message": message,
+            "title": self._title,
+            "greeting": self._greeting,
+            "slot": self._slot,
+            "priority": self._priority,
+            "name": self._name,
+            "time": self._time_str,
+            "target": target,
+        })
+        self._cache[key] = rendered
+        return rendered
@@ -0,0 +1,423 @@
+# /config/custom_components/universal_notifier/retry_queue.py
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass, replace
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+
+from .breaker import CircuitBreakers
+from .const import RESULT_SENT, RESULT_FAILED, RESULT_TIMED_OUT, RESULT_PREEMPTED
+from .dispatcher import Delivery, DispatchLanes, async_execute_delivery
+from .journal import DeliveryJournal
+from .metrics import NotifierMetrics
+from .schedule import TimeSchedule
+from .sequencer import AnnouncementPreempted, PlayerSequencer
+
+_LOGGER = logging.getLogger(__name__)
+
+# Operazioni del file append-only (una riga JSON compatta per operazione)
+_OP_ADD = "a"     # ["a", id, target, domain, service, payload, vol_entity, vol_level, attempts, next, priority, fallback, voice]
+_OP_RETRY = "r"   # ["r", id, attempts, next]
+_OP_DONE = "d"    # ["d", id]
+
+# Compattiamo il file quando le righe morte superano questa soglia
+_COMPACT_MIN_DEAD = 200
+
+# ==============================================================================
+# ENTRY
+# ==============================================================================
+
+@dataclass(slots=True)
+class QueueEntry:
+    """Consegna fallita in attesa di un nuovo tentativo."""
+    id: str
+    delivery: Delivery
+    attempts: int = 0
+    next_attempt: float = 0.0
+
+    def as_record(self) -> list:
+        d = self.delivery
+        return [_OP_ADD, self.id, d.target, d.domain, d.service, d.payload,
+                d.volume_entity, d.volume_level, self.attempts, self.next_attempt, d.priority,
+                d.fallback, d.is_voice]
+
+    @classmethod
+    def from_record(cls, record: list) -> "QueueEntry":
+        (_, entry_id, target, domain, service, payload,
+         volume_entity, volume_level, attempts, next_attempt) = record[:10]
+        # 'priority', 'fallback' e 'voice' assenti nei file scritti dalle versioni
+        # precedenti (il volume è impostato solo per i canali vocali)
+        priority = bool(record[10]) if len(record) > 10 else False
+        fallback = bool(record[11]) if len(record) > 11 else False
+        is_voice = bool(record[12]) if len(record) > 12 else volume_level is not None
+        return cls(
+            id=entry_id,
+            delivery=Delivery(
+                target, domain, service, payload, volume_entity, volume_level,
+                priority=priority, is_voice=is_voice, fallback=fallback,
+            ),
+            attempts=attempts,
+            next_attempt=next_attempt,
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "target": self.delivery.target,
+            "service": self.delivery.full_service_name,
+            "attempts": self.attempts,
+            "next_attempt": self.next_attempt,
+        }
+
+
+def _dump(record: list) -> str:
+    return json.dumps(record, separators=(",", ":"), default=str, ensure_ascii=False)
+
+# ==============================================================================
+# CODA PERSISTENTE
+# ==============================================================================
+
+class RetryQueue:
+    """
+    Coda durevole delle consegne fallite.
+    I tentativi seguono un backoff esponenziale con jitter; lo stato è
+    registrato in un file append-only (compattato al caricamento e quando
+    accumula troppe righe morte) e smaltito da un worker in background.
+    I tentativi scaduti partono insieme, in ordine per canale, entro il
+    budget della corsia; con uno `schedule` i tentativi vocali non prioritari
+    durante il DND sono rimandati alla sua fine.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        path: str,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        max_size: int,
+        lanes: DispatchLanes,
+        metrics: NotifierMetrics | None = None,
+        sequencer: PlayerSequencer | None = None,
+        breakers: CircuitBreakers | None = None,
+        journal: DeliveryJournal | None = None,
+        schedule: TimeSchedule | None = None,
+    ) -> None:
+        self._hass = hass
+        self._schedule = schedule
+        self._journal = journal
+        self._breakers = breakers
+        self._metrics = metrics
+        self._sequencer = sequencer
+        self._path = path
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._max_size = max_size
+        self._lanes = lanes
+
+        self._entries: dict[str, QueueEntry] = {}
+        self._dead_lines = 0
+        self._pending_lines: list[str] = []
+        self._write_lock = asyncio.Lock()
+        self._write_scheduled = False
+        self._wakeup = asyncio.Event()
+        self._worker: asyncio.Task | None = None
+
+    def update(self, schedule: TimeSchedule) -> None:
+        """Nuova finestra DND dopo un reload."""
+        self._schedule = schedule
+        self._wakeup.set()
+
+    @property
+    def depth(self) -> int:
+        return len(self._entries)
+
+    def entries(self) -> list:
+        return [entry.as_dict() for entry in self._entries.values()]
+
+    # --------------------------------------------------------------------------
+    # PERSISTENZA
+    # --------------------------------------------------------------------------
+
+    def _read_file(self) -> list:
+        if not os.path.exists(self._path):
+            return []
+        records = []
+        with open(self._path, encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Riga troncata (es. crash durante la scrittura): la ignoriamo
+                    _LOGGER.debug("UniNotifier: riga coda non valida ignorata")
+        return records
+
+    def _append_file(self, lines: list) -> None:
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(self._path, "a", encoding="utf-8") as file:
+            file.write("".join(lines))
+
+    def _rewrite_file(self, lines: list) -> None:
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write("".join(lines))
+        os.replace(tmp_path, self._path)
+
+    async def async_load(self) -> None:
+        """Ricostruisce la coda dal file e lo compatta."""
+        records = await self._hass.async_add_executor_job(self._read_file)
+        for record in records:
+            try:
+                op = record[0]
+                if op == _OP_ADD:
+                    entry = QueueEntry.from_record(record)
+                    self._entries[entry.id] = entry
+                elif op == _OP_RETRY and record[1] in self._entries:
+                    entry = self._entries[record[1]]
+                    entry.attempts, entry.next_attempt = record[2], record[3]
+                elif op == _OP_DONE:
+                    self._entries.pop(record[1], None)
+            except (IndexError, TypeError, ValueError):
+                _LOGGER.debug(f"UniNotifier: record coda non valido ignorato: {record}")
+
+        if self._entries:
+            _LOGGER.info(f"UniNotifier: {len(self._entries)} notifiche in coda ripristinate")
+        await self._async_compact()
+
+    def _log(self, record: list) -> None:
+        self._pending_lines.append(_dump(record) + "\n")
+        if record[0] != _OP_ADD:
+            self._dead_lines += 1
+        if not self._write_scheduled:
+            self._write_scheduled = True
+            self._hass.async_create_task(self._async_write())
+
+    async def _async_write(self) -> None:
+        async with self._write_lock:
+            self._write_scheduled = False
+            lines, self._pending_lines = self._pending_lines, []
+            if lines:
+                try:
+                    await self._hass.async_add_executor_job(self._append_file, lines)
+                except OSError as e:
+                    _LOGGER.error(f"UniNotifier: scrittura coda fallita: {e}")
+
+        if self._dead_lines > max(_COMPACT_MIN_DEAD, 2 * len(self._entries)):
+            await self._async_compact()
+
+    async def _async_compact(self) -> None:
+        async with self._write_lock:
+            # Lo stato in memoria è autorevole: sostituisce anche le righe pendenti
+            lines = [_dump(entry.as_record()) + "\n" for entry in self._entries.values()]
+            self._pending_lines = []
+            self._dead_lines = 0
+            try:
+                await self._hass.async_add_executor_job(self._rewrite_file, lines)
+            except OSError as e:
+                _LOGGER.error(f"UniNotifier: compattazione coda fallita: {e}")
+
+    # --------------------------------------------------------------------------
+    # API
+    # --------------------------------------------------------------------------
+
+    def _backoff(self, attempts: int) -> float:
+        """Backoff esponenziale con jitter (tra metà e intero intervallo)."""
+        delay = min(self._max_delay, self._base_delay * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def enqueue(self, delivery: Delivery) -> str | None:
+        """Accoda una consegna fallita; restituisce l'id (None se la coda è piena)."""
+        if len(self._entries) >= self._max_size:
+            _LOGGER.error(
+                f"UniNotifier: coda piena ({self._max_size}), notifica per "
+                f"{delivery.target} persa"
+            )
+            return None
+
+        if delivery.source_payload is not None:
+            # Mai il file della cache allegati (svuotata al riavvio): si riparte dall'URL
+            delivery = replace(delivery, payload=delivery.source_payload, source_payload=None)
+        entry = QueueEntry(
+            id=uuid.uuid4().hex,
+            delivery=delivery,
+            attempts=1,
+            next_attempt=time.time() + self._backoff(1),
+        )
+        self._entries[entry.id] = entry
+        self._log(entry.as_record())
+        self._wakeup.set()
+        return entry.id
+
+    def _select(self, ids: list | None, targets: list | None) -> list:
+        return [
+            entry for entry in self._entries.values()
+            if (ids is None or entry.id in ids)
+            and (targets is None or entry.delivery.target in targets)
+        ]
+
+    def flush(self, ids: list | None = None, targets: list | None = None) -> int:
+        """Anticipa subito il prossimo tentativo delle entry selezionate."""
+        selected = self._select(ids, targets)
+        for entry in selected:
+            entry.next_attempt = 0.0
+        self._wakeup.set()
+        return len(selected)
+
+    def cancel(self, ids: list | None = None, targets: list | None = None) -> int:
+        """Rimuove dalla coda le entry selezionate (tutte se nessun filtro)."""
+        selected = self._select(ids, targets)
+        for entry in selected:
+            del self._entries[entry.id]
+            self._log([_OP_DONE, entry.id])
+        return len(selected)
+
+    # --------------------------------------------------------------------------
+    # WORKER
+    # --------------------------------------------------------------------------
+
+    def _postpone(self, entry: QueueEntry, next_attempt: float) -> None:
+        """Rimanda il tentativo senza consumarlo."""
+        entry.next_attempt = next_attempt
+        self._log([_OP_RETRY, entry.id, entry.attempts, entry.next_attempt])
+
+    async def _async_attempt(self, entry: QueueEntry) -> None:
+        delivery = entry.delivery
+        if delivery.is_voice and not delivery.priority and self._schedule is not None:
+            now = dt_util.now()
+            if self._schedule.state(now).dnd_active:
+                # Annuncio in pieno DND: si riprova alla fine della finestra
+                end = self._schedule.next_dnd_end(now)
+                if end is not None:
+                    _LOGGER.debug(f"UniNotifier: DND attivo, tentativo per {delivery.target} rimandato")
+                    self._postpone(entry, end.timestamp())
+                    return
+
+        breakers = self._breakers if not delivery.fallback else None
+        if breakers is not None and not breakers.allow(delivery.target, time.monotonic()):
+            # Circuito aperto: rimandata alla prossima prova, senza consumare tentativi
+            self._postpone(entry, time.time() + max(
+                breakers.retry_in(delivery.target, time.monotonic()), self._base_delay
+            ))
+            return
+
+        stats = self._metrics.channel(delivery.target) if self._metrics is not None else None
+        # Stessa corsia (budget e timeout) degli invii diretti
+        lane = self._lanes.lane(delivery)
+        attempt = entry.attempts + 1
+        start = time.perf_counter()
+        try:
+            async with lane.slot(self._sequencer, delivery):
+                async with asyncio.timeout(lane.timeout):
+                    await async_execute_delivery(self._hass, delivery, stats, self._sequencer)
+        except AnnouncementPreempted:
+            # Già iniziata sul player: come per gli invii diretti, nessun altro tentativo
+            _LOGGER.warning(
+                f"UniNotifier: tentativo per {delivery.target} interrotto da un annuncio prioritario"
+            )
+            if stats is not None:
+                stats.preempted += 1
+            self._record(delivery, RESULT_PREEMPTED, f"attempt {attempt}", start)
+            if self._entries.pop(entry.id, None) is not None:
+                self._log([_OP_DONE, entry.id])
+        except Exception as e:  # include TimeoutError
+            if isinstance(e, TimeoutError):
+                outcome, detail = RESULT_TIMED_OUT, f"timeout {lane.timeout}s"
+                if stats is not None:
+                    stats.timed_out += 1
+            else:
+                outcome, detail = RESULT_FAILED, str(e)[:200] or type(e).__name__
+                if stats is not None:
+                    stats.failed += 1
+            if breakers is not None:
+                breakers.record_failure(delivery.target, time.monotonic())
+            if entry.id not in self._entries:
+                # Cancellata durante il tentativo
+                self._record(delivery, outcome, f"attempt {attempt}: {detail}", start)
+                return
+            entry.attempts = attempt
+            if entry.attempts >= self._max_attempts:
+                _LOGGER.error(
+                    f"UniNotifier: {delivery.full_service_name} per {delivery.target} "
+                    f"fallito dopo {entry.attempts} tentativi, notifica scartata: {e!r}"
+                )
+                self._record(
+                    delivery, outcome, f"attempt {attempt}, dropped: {detail}", start
+                )
+                del self._entries[entry.id]
+                self._log([_OP_DONE, entry.id])
+                return
+            self._record(delivery, outcome, f"attempt {attempt}: {detail}", start)
+            _LOGGER.debug(
+                f"UniNotifier: tentativo {entry.attempts}/{self._max_attempts} per "
+                f"{delivery.target} fallito: {e!r}"
+            )
+            self._postpone(entry, time.time() + self._backoff(entry.attempts))
+        else:
+            if stats is not None:
+                stats.sent += 1
+            if breakers is not None:
+                breakers.record_success(delivery.target)
+            self._record(delivery, RESULT_SENT, f"attempt {attempt}", start)
+            _LOGGER.info(
+                f"UniNotifier: notifica per {delivery.target} consegnata al tentativo {attempt}"
+            )
+            if self._entries.pop(entry.id, None) is not None:
+                self._log([_OP_DONE, entry.id])
+
+    def _record(self, delivery: Delivery, outcome: str, reason: str, start: float) -> None:
+        if self._journal is not None:
+            self._journal.add(
+                delivery.target, delivery.full_service_name, outcome, reason,
+                delivery.render_time, time.perf_counter() - start,
+            )
+
+    async def _async_attempt_channel(self, entries: list) -> None:
+        # Un canale riceve i suoi tentativi in ordine, come negli invii diretti
+        for entry in entries:
+            await self._async_attempt(entry)
+
+    async def _async_run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            by_channel: dict[str, list] = {}
+            for entry in self._entries.values():
+                if entry.next_attempt <= now:
+                    by_channel.setdefault(entry.delivery.target, []).append(entry)
+            if by_channel:
+                # Canali in parallelo; concorrenza e timeout sono quelli della corsia
+                await asyncio.gather(
+                    *(self._async_attempt_channel(entries) for entries in by_channel.values())
+                )
+
+            next_due = min((e.next_attempt for e in self._entries.values()), default=None)
+            timeout = None if next_due is None else max(0.0, next_due - time.time())
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = self._hass.async_create_background_task(
+                self._async_run(), "universal_notifier_retry_queue"
+            )
+
+    async def async_stop(self, *_) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        await self._async_write()
@@ -0,0 +1,205 @@
+# /config/custom_components/universal_notifier/routing.py
+
+import logging
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from typing import Mapping
+
+from .const import (
+    CONF_SERVICE, CONF_SERVICE_DATA, CONF_TARGET,
+    CONF_IS_VOICE, CONF_ALT_SERVICES, CONF_COALESCE, CONF_MESSAGE_TEMPLATE, CONF_TITLE_TEMPLATE,
+    CONF_PRESENCE,
+    TELEGRAM_MEDIA_SERVICES, PARSE_MODE_ROOT, PARSE_MODE_DATA,
+)
+
+from .templates import ChannelTemplate, TemplateCache
+
+_LOGGER = logging.getLogger(__name__)
+
+_EMPTY = MappingProxyType({})
+
+# ==============================================================================
+# ROUTE COMPILATE
+# ==============================================================================
+
+@dataclass(frozen=True, slots=True)
+class ChannelRoute:
+    """
+    Piano di instradamento di un canale (o di un suo alt_service),
+    calcolato una sola volta dalla configurazione YAML statica.
+    """
+    alias: str
+    full_service_name: str
+    domain: str | None
+    service: str | None
+    service_data: Mapping = field(default_factory=lambda: _EMPTY)
+    is_voice: bool = False
+    # Chiave in target_data con l'URL del media (photo, video, ...) se il
+    # servizio è un send_* media di Telegram: url/caption al posto di message
+    media_kind: str | None = None
+    # Dove va il parse_mode: root (telegram_bot), data (notify.telegram) o scartato
+    parse_mode_location: str | None = None
+    default_parse_mode: str | None = None
+    # notify.alexa_media non accetta entity_id nello schema
+    strip_entity_id: bool = False
+    # 'target' del canale iniettato come entity_id (mai per i notify.*)
+    inject_entity_id: str | None = None
+    # Finestra (secondi) in cui i messaggi testuali vengono combinati; 0 = off
+    coalesce_window: float = 0.0
+    alt_routes: Mapping = field(default_factory=lambda: _EMPTY)
+    # Formato del messaggio/titolo definito dall'utente (al posto di [nome - ora])
+    message_template: ChannelTemplate | None = None
+    title_template: ChannelTemplate | None = None
+    # Entità di presenza della stanza (con 'only_occupied' il canale vuoto è saltato)
+    presence_entities: tuple = ()
+
+    @property
+    def is_valid(self) -> bool:
+        return self.domain is not None
+
+    def resolve(self, service_type: str | None) -> "ChannelRoute":
+        """Restituisce la route dell'alt_service richiesto, o se stessa."""
+        if service_type and service_type in self.alt_routes:
+            return self.alt_routes[service_type]
+        return self
+
+
+def _compile_route(alias: str, service_conf: dict, target, is_voice: bool,
+                   alt_routes: Mapping = _EMPTY, coalesce_window: float = 0.0,
+                   templates: tuple = (None, None)) -> ChannelRoute:
+    full_service_name = service_conf[CONF_SERVICE]
+
+    domain_service = full_service_name.split(".")
+    if len(domain_service) == 2:
+        domain, service = domain_service
+    else:
+        _LOGGER.error(f"UniNotifier: Servizio non valido {full_service_name} ({alias})")
+        domain, service = None, None
+
+    media_kind = None
+    if domain == "telegram_bot":
+        media_kind = TELEGRAM_MEDIA_SERVICES.get(service)
+
+    parse_mode_location = None
+    if "telegram" in full_service_name:
+        parse_mode_location = PARSE_MODE_ROOT if "telegram_bot" in full_service_name else PARSE_MODE_DATA
+
+    is_notify = full_service_name.startswith("notify.")
+    inject_entity_id = None
+    if target is not None and not is_notify:
+        inject_entity_id = target
+
+    return ChannelRoute(
+        alias=alias,
+        full_service_name=full_service_name,
+        domain=domain,
+        service=service,
+        service_data=MappingProxyType(dict(service_conf.get(CONF_SERVICE_DATA) or {})),
+        is_voice=is_voice,
+        media_kind=media_kind,
+        parse_mode_location=parse_mode_location,
+        # Default Telegram è spesso HTML se non specificato altrimenti
+        default_parse_mode="html" if "telegram_bot" in full_service_name else None,
+        strip_entity_id=full_service_name.startswith("notify.alexa_media"),
+        inject_entity_id=inject_entity_id,
+        # Solo messaggi testuali: mai per voice e media
+        coalesce_window=coalesce_window if not (is_voice or media_kind) else 0.0,
+        alt_routes=alt_routes,
+        message_template=templates[0],
+        title_template=templates[1],
+    )
+
+
+def compile_routes(channels_config: dict, template_cache: TemplateCache | None = None) -> Mapping:
+    """
+    Compila tutti i canali in una tabella alias -> ChannelRoute (immutabile).
+    I template di canale sono compilati tramite `template_cache`, se presente.
+    """
+    routes = {}
+    for alias, channel_conf in channels_config.items():
+        target = channel_conf.get(CONF_TARGET)
+
+        templates = (None, None)
+        if template_cache is not None:
+            templates = (
+                template_cache.get(channel_conf.get(CONF_MESSAGE_TEMPLATE)),
+                template_cache.get(channel_conf.get(CONF_TITLE_TEMPLATE)),
+            )
+
+        # I servizi alternativi non sono considerati "Voice" per logica volume/saluti;
+        # i template valgono per tutto il canale
+        alt_routes = {
+            service_type: _compile_route(alias, alt_conf, target, False, templates=templates)
+            for service_type, alt_conf in (channel_conf.get(CONF_ALT_SERVICES) or {}).items()
+        }
+
+        route = _compile_route(
+            alias, channel_conf, target, channel_conf[CONF_IS_VOICE],
+            MappingProxyType(alt_routes) if alt_routes else _EMPTY,
+            channel_conf.get(CONF_COALESCE, 0.0),
+            templates,
+        )
+        if channel_conf.get(CONF_PRESENCE):
+            route = replace(route, presence_entities=tuple(channel_conf[CONF_PRESENCE]))
+        routes[alias] = route
+    return MappingProxyType(routes)
+
+# ==============================================================================
+# GRUPPI
+# ==============================================================================
+
+def expand_groups(groups_config: dict, aliases) -> Mapping:
+    """
+    Espande i gruppi (anche annidati) in una tabella nome -> tuple di alias,
+    senza duplicati e nell'ordine di dichiarazione.
+    Solleva ValueError per cicli, alias sconosciuti e nomi in conflitto.
+    """
+    aliases = set(aliases)
+    for name in groups_config:
+        if name in aliases:
+            raise ValueError(f"il gruppo '{name}' ha lo stesso nome di un canale")
+
+    expanded: dict[str, tuple] = {}
+
+    def _expand(name: str, path: tuple) -> tuple:
+        if name in expanded:
+            return expanded[name]
+        if name in path:
+            cycle = " -> ".join(path[path.index(name):] + (name,))
+            raise ValueError(f"ciclo nei gruppi: {cycle}")
+
+        members: dict = {}
+        for member in groups_config[name]:
+            if member in aliases:
+                members[member] = None
+            elif member in groups_config:
+                members.update(dict.fromkeys(_expand(member, path + (name,))))
+            else:
+                raise ValueError(f"il gruppo '{name}' contiene '{member}', che non è né un canale né un gruppo")
+
+        expanded[name] = tuple(members)
+        return expanded[name]
+
+    for name in groups_config:
+        _expand(name, ())
+    return MappingProxyType(expanded)
+
+
+def resolve_targets(targets, groups: Mapping):
+    """Sostituisce i gruppi con i loro alias, senza duplicati; i nomi sconosciuti restano."""
+    if isinstance(targets, str):
+        targets = [targets]
+    # Caso comune: un solo gruppo, già espanso al setup
+    if len(targets) == 1:
+        return groups.get(targets[0], targets)
+    if not groups:
+        return list(dict.fromkeys(targets))
+
+    resolved = {}
+    for target in targets:
+        group = groups.get(target)
+        if group is None:
+            resolved[target] = None
+        else:
+            resolved.update(dict.fromkeys(group))
+    return list(resolved)
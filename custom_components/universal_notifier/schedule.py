@@ -0,0 +1,128 @@
+# /config/custom_components/universal_notifier/schedule.py
+
+import bisect
+from datetime import datetime, time, timedelta
+from typing import NamedTuple
+
+from homeassistant.util import dt as dt_util
+
+from .const import FALLBACK_SLOT, FALLBACK_VOLUME
+
+# ==============================================================================
+# TIME SLOTS + DND
+# ==============================================================================
+
+class ScheduleState(NamedTuple):
+    """Contesto orario valido fino al prossimo confine (inizio slot o DND)."""
+    slot: str
+    volume: float
+    dnd_active: bool
+
+
+def _as_time(value) -> time:
+    """Accetta sia oggetti time (da cv.time) sia stringhe 'HH:MM'."""
+    if isinstance(value, time):
+        return value
+    parsed = dt_util.parse_time(str(value))
+    if parsed is None:
+        raise ValueError(f"Orario non valido: {value}")
+    return parsed
+
+
+class TimeSchedule:
+    """
+    Tabella degli slot e finestra DND, parsate e ordinate una sola volta.
+    Lo stato corrente viene messo in cache fino al prossimo confine orario,
+    così la maggior parte delle chiamate non ricalcola nulla.
+    """
+
+    def __init__(self, slots_conf: dict, dnd_conf: dict) -> None:
+        slots = sorted(
+            (_as_time(data["start"]), name, data.get("volume", FALLBACK_VOLUME))
+            for name, data in (slots_conf or {}).items()
+        )
+        self._starts = [start for start, _, _ in slots]
+        self._slots = [(name, volume) for _, name, volume in slots]
+
+        dnd_conf = dnd_conf or {}
+        self._dnd_start = _as_time(dnd_conf["start"]) if "start" in dnd_conf else None
+        self._dnd_end = _as_time(dnd_conf["end"]) if "end" in dnd_conf else None
+        # start == end (o finestra incompleta) significa DND disabilitato
+        self._dnd_enabled = (
+            self._dnd_start is not None
+            and self._dnd_end is not None
+            and self._dnd_start != self._dnd_end
+        )
+
+        boundaries = set(self._starts)
+        if self._dnd_enabled:
+            boundaries.update((self._dnd_start, self._dnd_end))
+        self._boundaries = sorted(boundaries)
+
+        self._cached: ScheduleState | None = None
+        self._valid_from: datetime | None = None
+        self._valid_until: datetime | None = None
+
+    # --------------------------------------------------------------------------
+
+    def slot_at(self, now_time: time) -> tuple:
+        """Restituisce (nome_slot, volume) per l'orario dato."""
+        if not self._slots:
+            return FALLBACK_SLOT, FALLBACK_VOLUME
+        # Ultimo slot già iniziato; prima del primo slot (es. 01:00 e il primo
+        # è 07:00) siamo ancora nell'ultimo slot della lista (notte): indice -1
+        index = bisect.bisect_right(self._starts, now_time) - 1
+        return self._slots[index]
+
+    def is_dnd(self, now_time: time) -> bool:
+        """Controlla se l'orario è nella finestra DND (gestisce accavallamento notte)."""
+        if not self._dnd_enabled:
+            return False
+        start, end = self._dnd_start, self._dnd_end
+        if start < end:
+            return start <= now_time < end
+        return start <= now_time or now_time < end
+
+    def next_dnd_end(self, now: datetime) -> datetime | None:
+        """Prossima fine della finestra DND dopo `now` (None se DND disabilitato)."""
+        if not self._dnd_enabled:
+            return None
+        end = self._dnd_end
+        day = now if now.time().replace(tzinfo=None) < end else now + timedelta(days=1)
+        return day.replace(
+            hour=end.hour, minute=end.minute, second=end.second, microsecond=end.microsecond,
+        )
+
+    def _next_boundary(self, now: datetime) -> datetime | None:
+        if not self._boundaries:
+            return None
+        now_time = now.time().replace(tzinfo=None)
+        index = bisect.bisect_right(self._boundaries, now_time)
+        day = now
+        if index == len(self._boundaries):
+            index = 0
+            day = now + timedelta(days=1)
+        boundary = self._boundaries[index]
+        return day.replace(
+            hour=boundary.hour, minute=boundary.minute,
+            second=boundary.second, microsecond=boundary.microsecond,
+        )
+
+    def state(self, now: datetime) -> ScheduleState:
+        """Stato corrente (slot, volume, DND), dalla cache se ancora valido."""
+        cached = self._cached
+        if (
+            cached is not None
+            and self._valid_from <= now
+            and (self._valid_until is None or now < self._valid_until)
+        ):
+            return cached
+
+        now_time = now.time().replace(tzinfo=None)
+        slot, volume = self.slot_at(now_time)
+        cached = ScheduleState(slot, volume, self.is_dnd(now_time))
+
+        self._cached = cached
+        self._valid_from = now
+        self._valid_until = self._next_boundary(now)
+        return cached
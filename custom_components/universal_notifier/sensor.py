@@ -0,0 +1,99 @@
+# /config/custom_components/universal_notifier/sensor.py
+
+from datetime import timedelta
+
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.const import EntityCategory
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .breaker import CircuitBreakers
+from .const import DOMAIN, DATA_METRICS, DATA_RETRY_QUEUE, DATA_BREAKERS
+from .metrics import ChannelStats, NotifierMetrics
+
+# I contatori vivono in memoria: il sensore li legge periodicamente,
+# così il percorso di invio non scrive mai nello state machine
+SCAN_INTERVAL = timedelta(seconds=30)
+
+
+async def async_setup_platform(
+    hass: HomeAssistant,
+    config: dict,
+    async_add_entities: AddEntitiesCallback,
+    discovery_info: dict | None = None,
+) -> None:
+    """Sensori diagnostici creati da async_setup via discovery."""
+    if discovery_info is None:
+        return
+
+    data = hass.data[DOMAIN]
+    metrics = data[DATA_METRICS]
+    breakers = data.get(DATA_BREAKERS)
+
+    entities = [NotifierTotalSensor(metrics)]
+    entities.extend(
+        ChannelDeliverySensor(alias, stats, breakers) for alias, stats in metrics.channels.items()
+    )
+    if DATA_RETRY_QUEUE in data:
+        entities.append(RetryQueueSensor(data[DATA_RETRY_QUEUE]))
+
+    async_add_entities(entities)
+
+
+class _DiagnosticSensor(SensorEntity):
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_icon = "mdi:message-badge-outline"
+
+
+class NotifierTotalSensor(_DiagnosticSensor):
+    """Notifiche consegnate in totale; fallimenti e target sconosciuti come attributi."""
+
+    _attr_name = "Universal Notifier Sent"
+    _attr_unique_id = f"{DOMAIN}_sent"
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+    def __init__(self, metrics: NotifierMetrics) -> None:
+        self._metrics = metrics
+
+    async def async_update(self) -> None:
+        self._attr_native_value = self._metrics.sent
+        self._attr_extra_state_attributes = {
+            "failed": self._metrics.failed,
+            "unknown_target": self._metrics.unknown_target,
+        }
+
+
+class ChannelDeliverySensor(_DiagnosticSensor):
+    """Consegne di un canale, con contatori, latenze e stato del circuito come attributi."""
+
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+    def __init__(self, alias: str, stats: ChannelStats,
+                 breakers: CircuitBreakers | None = None) -> None:
+        self._alias = alias
+        self._stats = stats
+        self._breakers = breakers
+        self._attr_name = f"Universal Notifier {alias}"
+        self._attr_unique_id = f"{DOMAIN}_{alias}_sent"
+
+    async def async_update(self) -> None:
+        attributes = self._stats.as_dict()
+        self._attr_native_value = attributes.pop("sent")
+        if self._breakers is not None:
+            attributes["circuit"] = self._breakers.state(self._alias)
+        self._attr_extra_state_attributes = attributes
+
+
+class RetryQueueSensor(_DiagnosticSensor):
+    """Profondità della coda di retry."""
+
+    _attr_name = "Universal Notifier Retry Queue"
+    _attr_unique_id = f"{DOMAIN}_retry_queue"
+    _attr_icon = "mdi:tray-full"
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, retry_queue) -> None:
+        self._retry_queue = retry_queue
+
+    async def async_update(self) -> None:
+        self._attr_native_value = self._retry_queue.depth
@@ -0,0 +1,278 @@
+# /config/custom_components/universal_notifier/sequencer.py
+
+import asyncio
+import logging
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import partial
+from typing import Awaitable
+
+import voluptuous as vol
+import homeassistant.helpers.config_validation as cv
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import CONF_ENTITY_ID
+
+_LOGGER = logging.getLogger(__name__)
+
+# Differenza sotto la quale due livelli di volume sono considerati uguali
+VOLUME_TOLERANCE = 0.005
+
+
+class AnnouncementPreempted(Exception):
+    """Annuncio ordinario interrotto da un annuncio prioritario sullo stesso player."""
+
+
+def volume_target(value) -> str | list | None:
+    """
+    entity_id dei player di un canale voice (stringa, lista o "a, b"), come
+    passati a volume_set: stringa per un solo player, lista ordinata per più
+    player, None se assenti o non validi.
+    """
+    if not value:
+        return None
+    try:
+        entity_ids = sorted(set(cv.entity_ids(value)))
+    except vol.Invalid as e:
+        _LOGGER.warning(f"UniNotifier: entity_id del player non valido ({value!r}): {e}")
+        return None
+    if not entity_ids:
+        return None
+    return entity_ids[0] if len(entity_ids) == 1 else entity_ids
+
+
+def _entity_ids(entity_id: str | list) -> tuple:
+    # I turni di più player sono presi sempre nello stesso ordine: niente deadlock
+    return (entity_id,) if isinstance(entity_id, str) else tuple(sorted(entity_id))
+
+# ==============================================================================
+# STATO DEL PLAYER
+# ==============================================================================
+
+class _Player:
+    """Turno, code di attesa e stato del volume di un media player."""
+
+    __slots__ = ("busy", "waiters", "priority_waiters", "pending", "level",
+                 "snapshot", "in_burst", "end_timer", "call_task", "call_priority")
+
+    def __init__(self) -> None:
+        self.busy = False
+        self.waiters: deque = deque()
+        self.priority_waiters: deque = deque()
+        # Annunci in attesa o in corso
+        self.pending = 0
+        # Livello impostato da noi durante il burst corrente
+        self.level: float | None = None
+        # Volume originale da ripristinare a fine burst (None = sconosciuto)
+        self.snapshot: float | None = None
+        self.in_burst = False
+        self.end_timer: CALLBACK_TYPE | None = None
+        # Chiamata al provider in corso (interrompibile se non prioritaria)
+        self.call_task: asyncio.Task | None = None
+        self.call_priority = False
+
+# ==============================================================================
+# SEQUENCER PER MEDIA PLAYER
+# ==============================================================================
+
+class PlayerSequencer:
+    """
+    Serializza gli annunci verso lo stesso media player.
+    Un "burst" è una serie di annunci ravvicinati sullo stesso player: al primo
+    annuncio viene salvato il volume corrente, durante il burst il volume_set
+    è saltato se il livello è già quello richiesto, e `restore_delay` secondi
+    dopo l'ultimo annuncio il volume originale viene ripristinato.
+    Gli annunci prioritari passano davanti a quelli in attesa e interrompono
+    la chiamata ordinaria in corso sullo stesso player.
+    """
+
+    def __init__(self, hass: HomeAssistant, restore: bool, restore_delay: float) -> None:
+        self._hass = hass
+        self._restore = restore
+        self._restore_delay = restore_delay
+        self._players: dict[str, _Player] = {}
+
+    def _current_level(self, entity_id: str) -> float | None:
+        state = self._hass.states.get(entity_id)
+        if state is None:
+            return None
+        level = state.attributes.get("volume_level")
+        return float(level) if isinstance(level, (int, float)) else None
+
+    # --------------------------------------------------------------------------
+    # TURNO
+    # --------------------------------------------------------------------------
+
+    async def _acquire(self, player: _Player, priority: bool) -> None:
+        if not player.busy:
+            player.busy = True
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        queue = player.priority_waiters if priority else player.waiters
+        queue.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Il turno era già stato ceduto a noi: passa al successivo
+                self._release(player)
+            else:
+                queue.remove(waiter)
+            raise
+
+    @staticmethod
+    def _release(player: _Player) -> None:
+        # Il turno passa direttamente al prossimo in attesa, prioritari per primi
+        for queue in (player.priority_waiters, player.waiters):
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        player.busy = False
+
+    @asynccontextmanager
+    async def announcement(self, entity_id: str | list, priority: bool = False):
+        """
+        Slot esclusivo sul player (o su tutti i player di un canale, presi in
+        ordine di entity_id); l'attesa del turno avviene qui dentro.
+        """
+        async with AsyncExitStack() as stack:
+            for player_id in _entity_ids(entity_id):
+                await stack.enter_async_context(self._player_turn(player_id, priority))
+            yield
+
+    @asynccontextmanager
+    async def _player_turn(self, entity_id: str, priority: bool):
+        player = self._players.get(entity_id)
+        if player is None:
+            player = self._players[entity_id] = _Player()
+        player.pending += 1
+        # Un annuncio che arriva prima della fine del burst lo prolunga
+        if player.end_timer is not None:
+            player.end_timer()
+            player.end_timer = None
+        if priority and player.call_task is not None and not player.call_priority:
+            _LOGGER.info(f"UniNotifier: annuncio prioritario, interrotto l'annuncio in corso su {entity_id}")
+            player.call_task.cancel()
+
+        try:
+            await self._acquire(player, priority)
+            try:
+                if not player.in_burst:
+                    player.in_burst = True
+                    player.snapshot = self._current_level(entity_id)
+                yield
+            finally:
+                self._release(player)
+        finally:
+            player.pending -= 1
+            if not player.pending:
+                player.end_timer = async_call_later(
+                    self._hass, self._restore_delay, partial(self._async_end_burst, entity_id)
+                )
+
+    # --------------------------------------------------------------------------
+    # PASSI DELL'ANNUNCIO (dentro `announcement`)
+    # --------------------------------------------------------------------------
+
+    def _at_level(self, entity_id: str, level: float) -> bool:
+        current = self._players[entity_id].level
+        if current is None:
+            current = self._current_level(entity_id)
+        return current is not None and abs(current - level) < VOLUME_TOLERANCE
+
+    async def async_set_volume(self, entity_id: str | list, level: float) -> bool:
+        """
+        volume_set solo sui player il cui livello (impostato nel burst, o
+        attuale) è diverso, con una sola chiamata.
+        Restituisce True se la chiamata è partita.
+        """
+        stale = [player_id for player_id in _entity_ids(entity_id)
+                 if not self._at_level(player_id, level)]
+        if not stale:
+            return False
+
+        await self._hass.services.async_call(
+            "media_player",
+            "volume_set",
+            {CONF_ENTITY_ID: stale[0] if len(stale) == 1 else stale, "volume_level": level},
+            blocking=True,
+        )
+        for player_id in stale:
+            self._players[player_id].level = level
+        return True
+
+    async def async_announce(self, entity_id: str | list, priority: bool, call: Awaitable) -> None:
+        """
+        Esegue la chiamata al provider come task separato, così un annuncio
+        prioritario può interromperla senza cancellare il chiamante.
+        """
+        players = [self._players[player_id] for player_id in _entity_ids(entity_id)]
+        task = asyncio.ensure_future(call)
+        for player in players:
+            player.call_task, player.call_priority = task, priority
+        try:
+            await task
+        except asyncio.CancelledError:
+            # Cancellato il solo task della chiamata (non noi): preemption
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                raise AnnouncementPreempted(entity_id) from None
+            raise
+        finally:
+            for player in players:
+                player.call_task = None
+
+    # --------------------------------------------------------------------------
+    # FINE BURST
+    # --------------------------------------------------------------------------
+
+    @callback
+    def _async_end_burst(self, entity_id: str, _now) -> None:
+        self._players[entity_id].end_timer = None
+        self._hass.async_create_task(self._async_restore(entity_id))
+
+    async def _async_restore(self, entity_id: str) -> None:
+        player = self._players[entity_id]
+        await self._acquire(player, False)
+        try:
+            # Nel frattempo è iniziato (o già finito) un nuovo burst: decide lui
+            if player.pending or player.end_timer is not None or not player.in_burst:
+                return
+            level, snapshot = player.level, player.snapshot
+            player.level = player.snapshot = None
+            player.in_burst = False
+            if not self._restore or snapshot is None or level is None:
+                return
+            if abs(snapshot - level) < VOLUME_TOLERANCE:
+                return
+            try:
+                await self._hass.services.async_call(
+                    "media_player",
+                    "volume_set",
+                    {CONF_ENTITY_ID: entity_id, "volume_level": snapshot},
+                    blocking=True,
+                )
+            except Exception as e:
+                _LOGGER.warning(f"UniNotifier: ripristino volume fallito su {entity_id}: {e}")
+        finally:
+            self._release(player)
+
+    def state(self) -> dict:
+        """Player con un burst in corso: annunci pendenti e volume da ripristinare."""
+        return {
+            entity_id: {
+                "pending": player.pending,
+                "restore_to": player.snapshot,
+            }
+            for entity_id, player in self._players.items()
+            if player.in_burst
+        }
+
+    @callback
+    def async_stop(self, _event=None) -> None:
+        for player in self._players.values():
+            if player.end_timer is not None:
+                player.end_timer()
+                player.end_timer = None
@@ -0,0 +1,87 @@
+# /config/custom_components/universal_notifier/state.py
+
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+from .const import (
+    CONF_CHANNELS, CONF_GROUPS, CONF_ASSISTANT_NAME, CONF_DATE_FORMAT, CONF_INCLUDE_TIME,
+    CONF_BOLD_PREFIX, CONF_TIME_SLOTS, CONF_DND, CONF_GREETINGS, CONF_CONCURRENT,
+    CONF_RATE_LIMIT, CONF_DEFER, CONF_MAX_DEFERRED, CONF_PRESENCE_FALLBACK,
+    DEFAULT_NAME, DEFAULT_DATE_FORMAT, DEFAULT_INCLUDE_TIME, DEFAULT_BOLD_PREFIX,
+    DEFAULT_TIME_SLOTS, DEFAULT_DND, DEFAULT_GREETINGS, DEFAULT_CONCURRENT, DEFAULT_MAX_DEFERRED,
+)
+from .ratelimit import RateLimiter
+from .routing import compile_routes, expand_groups
+from .schedule import TimeSchedule
+from .templates import TemplateCache
+
+# ==============================================================================
+# CONFIGURAZIONE COMPILATA
+# ==============================================================================
+
+@dataclass(frozen=True, slots=True)
+class NotifierState:
+    """
+    Tutto ciò che il reload può cambiare, compilato dalla configurazione YAML.
+    Ogni chiamata al servizio legge lo stato una volta sola; il reload ne crea
+    uno nuovo e lo sostituisce in blocco, le chiamate in corso finiscono con
+    quello vecchio.
+    """
+    routes: Mapping
+    groups: Mapping
+    schedule: TimeSchedule
+    greetings: Mapping
+    assistant_name: str
+    date_format: str
+    include_time: bool
+    bold_prefix: bool
+    concurrent: bool
+    # Bucket per canale e globale: ricreati (pieni) ad ogni reload
+    rate_limiter: RateLimiter
+    defer_dnd: bool
+    max_deferred: int
+    # Canali/gruppi usati con 'only_occupied' quando nessuna stanza è occupata
+    presence_fallback: tuple
+
+
+def compile_state(conf: dict, template_cache: TemplateCache | None = None) -> NotifierState:
+    """Compila la sezione universal_notifier (già validata da CONFIG_SCHEMA)."""
+    # I canali sono compilati una volta sola in route immutabili (template inclusi)
+    routes = compile_routes(conf[CONF_CHANNELS], template_cache)
+    dnd_conf = conf.get(CONF_DND, DEFAULT_DND)
+
+    return NotifierState(
+        routes=routes,
+        # Gruppi espansi una volta sola: 'everyone' -> tuple piatta di alias
+        groups=expand_groups(conf.get(CONF_GROUPS, {}), routes),
+        # Slot e DND parsati e ordinati una volta sola (stato in cache fino al prossimo confine)
+        schedule=TimeSchedule(conf.get(CONF_TIME_SLOTS, DEFAULT_TIME_SLOTS), dnd_conf),
+        greetings=MappingProxyType(dict(conf.get(CONF_GREETINGS, DEFAULT_GREETINGS))),
+        assistant_name=conf.get(CONF_ASSISTANT_NAME, DEFAULT_NAME),
+        date_format=conf.get(CONF_DATE_FORMAT, DEFAULT_DATE_FORMAT),
+        include_time=conf.get(CONF_INCLUDE_TIME, DEFAULT_INCLUDE_TIME),
+        bold_prefix=conf.get(CONF_BOLD_PREFIX, DEFAULT_BOLD_PREFIX),
+        concurrent=conf.get(CONF_CONCURRENT, DEFAULT_CONCURRENT),
+        # Rate limit per canale (alias) + globale: controllo O(1)
+        rate_limiter=RateLimiter(
+            {
+                alias: channel_conf[CONF_RATE_LIMIT]
+                for alias, channel_conf in conf[CONF_CHANNELS].items()
+                if CONF_RATE_LIMIT in channel_conf
+            },
+            conf.get(CONF_RATE_LIMIT),
+        ),
+        defer_dnd=dnd_conf.get(CONF_DEFER, False),
+        max_deferred=dnd_conf.get(CONF_MAX_DEFERRED, DEFAULT_MAX_DEFERRED),
+        presence_fallback=tuple(conf.get(CONF_PRESENCE_FALLBACK, ())),
+    )
+
+
+def presence_map(state: NotifierState) -> Mapping:
+    """alias -> entità di presenza, per i soli canali che ne dichiarano."""
+    return MappingProxyType({
+        alias: route.presence_entities
+        for alias, route in state.routes.items()
+        if route.presence_entities
+    })
@@ -0,0 +1,89 @@
+# /config/custom_components/universal_notifier/templates.py
+
+import logging
+from collections import OrderedDict
+
+import jinja2
+from jinja2 import meta
+
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import TemplateError
+from homeassistant.helpers.template import Template
+
+_LOGGER = logging.getLogger(__name__)
+
+# Solo per l'analisi delle variabili usate (stesse estensioni dei template di HA)
+_PARSE_ENV = jinja2.Environment(extensions=["jinja2.ext.loopcontrols", "jinja2.ext.do"])
+
+# ==============================================================================
+# TEMPLATE COMPILATO
+# ==============================================================================
+
+class ChannelTemplate:
+    """
+    Template di canale (message_template / title_template) compilato una volta.
+    `uses_target` indica se il testo dipende dall'alias del target: se no, lo
+    stesso risultato vale per tutti i target di una chiamata.
+    """
+
+    __slots__ = ("source", "template", "uses_target")
+
+    def __init__(self, source: str, template: Template, uses_target: bool) -> None:
+        self.source = source
+        self.template = template
+        self.uses_target = uses_target
+
+    def render(self, variables: dict) -> str | None:
+        """Testo reso, o None se il rendering fallisce (si usa il formato standard)."""
+        try:
+            return str(self.template.async_render(variables, parse_result=False)).strip()
+        except TemplateError as e:
+            _LOGGER.warning(f"UniNotifier: rendering del template fallito ({self.source!r}): {e}")
+            return None
+
+
+def _uses_target(source: str) -> bool:
+    try:
+        return "target" in meta.find_undeclared_variables(_PARSE_ENV.parse(source))
+    except jinja2.TemplateSyntaxError:
+        return True
+
+# ==============================================================================
+# CACHE DEI TEMPLATE
+# ==============================================================================
+
+class TemplateCache:
+    """
+    Template compilati per testo sorgente, con eviction LRU oltre `max_size`.
+    Vive per tutta la durata del componente: un reload riusa i template il
+    cui testo non è cambiato.
+    """
+
+    def __init__(self, hass: HomeAssistant, max_size: int) -> None:
+        self._hass = hass
+        self._max_size = max_size
+        self._templates: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def get(self, source: str | None) -> ChannelTemplate | None:
+        """Template compilato (None se assente o non valido, con errore nel log)."""
+        if not source:
+            return None
+        compiled = self._templates.get(source)
+        if compiled is not None:
+            self._templates.move_to_end(source)
+            return compiled
+
+        template = Template(source, self._hass)
+        try:
+            template.ensure_valid()
+        except TemplateError as e:
+            _LOGGER.error(f"UniNotifier: template non valido, ignorato ({source!r}): {e}")
+            return None
+
+        compiled = self._templates[source] = ChannelTemplate(source, template, _uses_target(source))
+        if len(self._templates) > self._max_size:
+            self._templates.popitem(last=False)
+        return compiled
@@ -0,0 +1,43 @@
+# tests/conftest.py
+"""
+Fixture comuni. I test dei singoli moduli usano un HomeAssistant reale (timer,
+Store, state machine); quelli dei servizi usano l'HomeAssistant finto di
+tests/helpers.py, con i servizi dei provider registrati in memoria.
+"""
+
+import pytest
+
+from homeassistant.core import HomeAssistant
+
+import custom_components.universal_notifier as un
+from custom_components.universal_notifier.const import DOMAIN
+
+from .helpers import FakeHass, FakeServices, Notifier, build_config
+
+
+@pytest.fixture
+async def hass(tmp_path):
+    """HomeAssistant reale sul loop del test, senza integrazioni caricate."""
+    hass = HomeAssistant(str(tmp_path))
+    yield hass
+    await hass.async_stop(force=True)
+
+
+@pytest.fixture
+def conf():
+    """2 Echo, 3 chat Telegram e il telefono; DND disabilitato."""
+    return build_config(voice_channels=2, text_channels=3)
+
+
+@pytest.fixture
+def setup_notifier(tmp_path):
+    """Factory: `await setup_notifier(conf)` configura il componente su FakeHass."""
+
+    async def _setup(conf: dict, states: dict | None = None, **services_kwargs) -> Notifier:
+        hass = FakeHass(FakeServices(**services_kwargs), str(tmp_path))
+        for entity_id, entity_state in (states or {}).items():
+            hass.states.set(entity_id, entity_state)
+        assert await un.async_setup(hass, un.CONFIG_SCHEMA({DOMAIN: conf}))
+        return Notifier(hass)
+
+    return _setup
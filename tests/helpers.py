@@ -0,0 +1,202 @@
+# tests/helpers.py
+"""
+HomeAssistant finto per i test dei servizi send / send_many: registro servizi
+in memoria che registra ogni chiamata ai provider, bus e stati minimi.
+"""
+
+import asyncio
+import os
+
+from homeassistant.core import Context, CoreState
+
+from custom_components.universal_notifier.const import DOMAIN
+
+# ==============================================================================
+# HOME ASSISTANT FINTO
+# ==============================================================================
+
+class FakeServices:
+    """
+    Servizi dei provider in memoria. `latency` è la durata di ogni chiamata,
+    `overrides` la durata per servizio ("dominio.servizio" -> secondi) e
+    `failures` i servizi che sollevano un errore.
+    """
+
+    def __init__(self, latency: float = 0.0, overrides: dict | None = None,
+                 failures=()) -> None:
+        self._latency = latency
+        self._overrides = overrides or {}
+        self._failures = set(failures)
+        self.handlers = {}
+        self.states = FakeStates()
+        # (servizio, dati) in ordine di chiamata
+        self.log = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def async_register(self, domain, service, handler, schema=None, supports_response=None):
+        self.handlers[(domain, service)] = (handler, schema)
+
+    def has_service(self, domain, service) -> bool:
+        return True
+
+    async def async_call(self, domain, service, data=None, blocking=False, **kwargs):
+        name = f"{domain}.{service}"
+        self.log.append((name, dict(data or {})))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            latency = self._overrides.get(name, self._latency)
+            if latency:
+                await asyncio.sleep(latency)
+            if name in self._failures:
+                raise RuntimeError(f"{name}: errore simulato")
+            if name == "media_player.volume_set":
+                entity_ids = data["entity_id"]
+                for entity_id in [entity_ids] if isinstance(entity_ids, str) else entity_ids:
+                    self.states.set_volume(entity_id, data["volume_level"])
+        finally:
+            self.in_flight -= 1
+
+
+class FakeBus:
+    def __init__(self) -> None:
+        self.events = []
+
+    def async_listen_once(self, event_type, listener):
+        return lambda: None
+
+    def async_listen(self, event_type, listener, *args, **kwargs):
+        return lambda: None
+
+    def async_fire(self, event_type, event_data=None, *args, **kwargs):
+        self.events.append((event_type, event_data))
+
+
+class FakeStates:
+    """Stati delle entità: volume_level dei media player aggiornato dai volume_set."""
+
+    def __init__(self) -> None:
+        self._states = {}
+
+    def get(self, entity_id):
+        return self._states.get(entity_id)
+
+    def set(self, entity_id, state: str) -> None:
+        self._states[entity_id] = FakeState({}, state)
+
+    def set_volume(self, entity_id, level) -> None:
+        self._states[entity_id] = FakeState({"volume_level": level})
+
+
+class FakeState:
+    __slots__ = ("attributes", "state")
+
+    def __init__(self, attributes: dict, state: str = "on") -> None:
+        self.attributes = attributes
+        self.state = state
+
+
+class FakeConfig:
+    def __init__(self, config_dir: str) -> None:
+        self.config_dir = config_dir
+
+    def path(self, *parts) -> str:
+        return os.path.join(self.config_dir, *parts)
+
+
+class FakeHass:
+    def __init__(self, services: FakeServices, config_dir: str) -> None:
+        self.services = services
+        self.states = services.states
+        self.bus = FakeBus()
+        self.config = FakeConfig(config_dir)
+        self.data = {}
+        self.state = CoreState.running
+        self.is_running = True
+        self.loop = asyncio.get_running_loop()
+        self._tasks = set()
+
+    def _track(self, task: asyncio.Task) -> asyncio.Task:
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def async_create_task(self, coro, *args, **kwargs):
+        # La piattaforma sensor non viene caricata: niente entità nei test
+        if getattr(coro, "__name__", "") == "async_load_platform":
+            coro.close()
+            return None
+        return self._track(self.loop.create_task(coro))
+
+    def async_run_hass_job(self, job, *args):
+        # Timer di async_call_later (fine burst dei player, coalescing)
+        result = job.target(*args)
+        if asyncio.iscoroutine(result):
+            return self._track(self.loop.create_task(result))
+        return result
+
+    def async_create_background_task(self, coro, name, *args, **kwargs):
+        return self._track(self.loop.create_task(coro, name=name))
+
+    async def async_add_executor_job(self, func, *args):
+        return await self.loop.run_in_executor(None, func, *args)
+
+    async def async_block_till_done(self) -> None:
+        """Attende i task creati dal componente (invii in background inclusi)."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class FakeCall:
+    __slots__ = ("data", "return_response", "context")
+
+    def __init__(self, data: dict, return_response: bool = True) -> None:
+        self.data = data
+        self.return_response = return_response
+        # Senza utente: i servizi admin (reload) sono permessi
+        self.context = Context()
+
+# ==============================================================================
+# CONFIGURAZIONE
+# ==============================================================================
+
+def build_config(voice_channels: int, text_channels: int) -> dict:
+    """Echo (voice), chat Telegram con servizi media e il telefono; DND disabilitato."""
+    channels = {}
+    for i in range(voice_channels):
+        channels[f"echo_{i}"] = {
+            "service": f"notify.alexa_media_echo_{i}",
+            "is_voice": True,
+            "service_data": {"entity_id": f"media_player.echo_{i}"},
+        }
+    for i in range(text_channels):
+        channels[f"telegram_{i}"] = {
+            "service": "telegram_bot.send_message",
+            "target": str(100000 + i),
+            "alt_services": {
+                "photo": {"service": "telegram_bot.send_photo"},
+                "video": {"service": "telegram_bot.send_video"},
+            },
+        }
+    channels["phone"] = {"service": "notify.mobile_app_phone"}
+    return {"channels": channels, "dnd": {"start": "00:00", "end": "00:00"}}
+
+
+class Notifier:
+    """Componente configurato su FakeHass, con accesso diretto agli handler."""
+
+    def __init__(self, hass: FakeHass) -> None:
+        self.hass = hass
+        self.services = hass.services
+
+    async def call(self, service: str, data: dict, return_response: bool = True):
+        handler, schema = self.services.handlers[(DOMAIN, service)]
+        call = FakeCall(schema(data) if schema is not None else data, return_response)
+        return await handler(call)
+
+    def provider_calls(self, service: str | None = None) -> list:
+        return [
+            data for name, data in self.services.log
+            if service is None or name == service
+        ]
@@ -0,0 +1,133 @@
+# tests/test_attachments.py
+
+import asyncio
+import os
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from custom_components.universal_notifier.attachments import AttachmentCache
+from custom_components.universal_notifier.dispatcher import Delivery
+
+
+class MediaServer:
+    """Server HTTP locale: /<nome> restituisce 10 byte e conta le richieste."""
+
+    def __init__(self) -> None:
+        self.requests = []
+        # Se impostato, le risposte attendono l'evento (download concorrenti)
+        self.gate: asyncio.Event | None = None
+        app = web.Application()
+        app.router.add_get("/{name}", self._handle)
+        self.server = TestServer(app)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        self.requests.append(name)
+        if self.gate is not None:
+            await self.gate.wait()
+        return web.Response(body=name.encode().ljust(10, b"."), content_type="image/jpeg")
+
+    def url(self, name: str) -> str:
+        return str(self.server.make_url(f"/{name}"))
+
+
+@pytest.fixture
+async def media():
+    server = MediaServer()
+    await server.server.start_server()
+    yield server
+    await server.server.close()
+
+
+def _cache(hass, tmp_path, **kwargs) -> AttachmentCache:
+    options = {"max_bytes": 1000, "ttl": 60, "timeout": 5}
+    options.update(kwargs)
+    return AttachmentCache(hass, str(tmp_path / "cache"), **options)
+
+
+async def test_each_url_is_fetched_once_within_the_ttl(hass, tmp_path, media):
+    cache = _cache(hass, tmp_path)
+    await cache.async_setup()
+    path = await cache.async_fetch(media.url("a.jpg"))
+    assert await cache.async_fetch(media.url("a.jpg")) == path
+    assert media.requests == ["a.jpg"]
+    with open(path, "rb") as f:
+        assert f.read() == b"a.jpg....."
+    assert cache.state() == {"files": 1, "bytes": 10}
+
+
+async def test_concurrent_fetches_share_one_download(hass, tmp_path, media):
+    cache = _cache(hass, tmp_path)
+    await cache.async_setup()
+    media.gate = asyncio.Event()
+    fetches = [asyncio.create_task(cache.async_fetch(media.url("a.jpg"))) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    media.gate.set()
+    paths = await asyncio.gather(*fetches)
+    assert len(set(paths)) == 1
+    assert media.requests == ["a.jpg"]
+
+
+async def test_expired_entries_are_fetched_again(hass, tmp_path, media):
+    cache = _cache(hass, tmp_path, ttl=0)
+    await cache.async_setup()
+    await cache.async_fetch(media.url("a.jpg"))
+    await cache.async_fetch(media.url("a.jpg"))
+    assert media.requests == ["a.jpg", "a.jpg"]
+    assert cache.state() == {"files": 1, "bytes": 10}
+
+
+async def test_least_recently_used_files_are_evicted(hass, tmp_path, media):
+    cache = _cache(hass, tmp_path, max_bytes=25)
+    await cache.async_setup()
+    path_a = await cache.async_fetch(media.url("a.jpg"))
+    path_b = await cache.async_fetch(media.url("b.jpg"))
+    # "a" torna la più recente: la vittima è "b"
+    await cache.async_fetch(media.url("a.jpg"))
+    await cache.async_fetch(media.url("c.jpg"))
+    await hass.async_block_till_done()
+
+    assert cache.state() == {"files": 2, "bytes": 20}
+    assert os.path.exists(path_a)
+    assert not os.path.exists(path_b)
+    await cache.async_fetch(media.url("b.jpg"))
+    assert media.requests == ["a.jpg", "b.jpg", "c.jpg", "b.jpg"]
+
+
+async def test_setup_removes_only_the_cache_files(hass, tmp_path, media):
+    cache = _cache(hass, tmp_path)
+    await cache.async_setup()
+    cached = await cache.async_fetch(media.url("a.jpg"))
+
+    directory = tmp_path / "cache"
+    (directory / "holiday.jpg").write_bytes(b"user file")
+    (directory / "album").mkdir()
+    (directory / "album" / "uninotifier_0123456789abcdef0123.jpg").write_bytes(b"user file")
+
+    # Riavvio: i file della cache precedente spariscono, il resto no
+    await _cache(hass, tmp_path).async_setup()
+    assert not os.path.exists(cached)
+    assert sorted(os.listdir(directory)) == ["album", "holiday.jpg"]
+    assert os.listdir(directory / "album") == ["uninotifier_0123456789abcdef0123.jpg"]
+
+
+async def test_prepare_swaps_the_url_for_the_local_file(hass, tmp_path, media):
+    cache = _cache(hass, tmp_path)
+    await cache.async_setup()
+    url = media.url("snapshot.jpg")
+
+    def photo(target: str, **extra) -> Delivery:
+        return Delivery(target, "telegram_bot", "send_photo", {"url": url, "caption": "x", **extra})
+
+    deliveries = [photo("tg_0"), photo("tg_1"), photo("tg_2", username="user")]
+    await cache.async_prepare(deliveries)
+    assert media.requests == ["snapshot.jpg"]
+
+    for delivery in deliveries[:2]:
+        assert delivery.payload == {"caption": "x", "file": deliveries[0].payload["file"]}
+        assert delivery.source_payload == {"url": url, "caption": "x"}
+    # Download autenticato: lasciato a Telegram
+    assert deliveries[2].payload["url"] == url
+    assert deliveries[2].source_payload is None
@@ -0,0 +1,74 @@
+# tests/test_breaker.py
+
+from custom_components.universal_notifier.breaker import (
+    STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreakers,
+)
+
+
+def test_opens_after_consecutive_failures():
+    breakers = CircuitBreakers(failure_threshold=3, reset_timeout=60)
+    breakers.record_failure("tg", 0.0)
+    breakers.record_failure("tg", 1.0)
+    # Un successo azzera il conteggio
+    breakers.record_success("tg")
+    breakers.record_failure("tg", 2.0)
+    breakers.record_failure("tg", 3.0)
+    assert breakers.state("tg") == STATE_CLOSED
+    assert breakers.allow("tg", 3.0)
+
+    breakers.record_failure("tg", 4.0)
+    assert breakers.state("tg") == STATE_OPEN
+    assert breakers.is_open("tg", 10.0)
+    assert not breakers.allow("tg", 10.0)
+    assert breakers.retry_in("tg", 10.0) == 54.0
+    # Gli altri canali non ne risentono
+    assert breakers.allow("phone", 10.0)
+
+
+def _open(breakers: CircuitBreakers, alias: str = "tg", now: float = 0.0) -> None:
+    for _ in range(2):
+        breakers.record_failure(alias, now)
+
+
+def test_half_open_allows_a_single_probe():
+    breakers = CircuitBreakers(failure_threshold=2, reset_timeout=60)
+    _open(breakers)
+    assert not breakers.is_open("tg", 60.0)
+    assert breakers.allow("tg", 60.0)
+    assert breakers.state("tg") == STATE_HALF_OPEN
+    # Prova in corso: le altre consegne restano ferme
+    assert not breakers.allow("tg", 61.0)
+
+
+def test_probe_success_closes_and_failure_reopens():
+    breakers = CircuitBreakers(failure_threshold=2, reset_timeout=60)
+    _open(breakers)
+    breakers.allow("tg", 60.0)
+    breakers.record_failure("tg", 61.0)
+    assert breakers.state("tg") == STATE_OPEN
+    assert not breakers.allow("tg", 100.0)
+
+    assert breakers.allow("tg", 121.0)
+    breakers.record_success("tg")
+    assert breakers.state("tg") == STATE_CLOSED
+    assert breakers.retry_in("tg", 121.0) == 0.0
+    assert breakers.as_dict(121.0)["tg"] == {
+        "state": STATE_CLOSED, "failures": 0, "trips": 2, "retry_in": 0.0,
+    }
+
+
+def test_probe_without_outcome_expires():
+    breakers = CircuitBreakers(failure_threshold=2, reset_timeout=60)
+    _open(breakers)
+    assert breakers.allow("tg", 60.0)
+    # Nessun esito (es. consegna scartata dal rate limit): nuova prova dopo reset_timeout
+    assert not breakers.allow("tg", 119.0)
+    assert breakers.allow("tg", 120.0)
+
+
+def test_failure_of_a_delivery_started_before_opening_is_ignored():
+    breakers = CircuitBreakers(failure_threshold=2, reset_timeout=60)
+    _open(breakers)
+    breakers.record_failure("tg", 30.0)
+    assert breakers.as_dict(30.0)["tg"]["trips"] == 1
+    assert breakers.retry_in("tg", 30.0) == 30.0
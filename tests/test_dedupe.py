@@ -0,0 +1,115 @@
+# tests/test_dedupe.py
+
+import asyncio
+
+from custom_components.universal_notifier.dedupe import Coalescer, TTLCache, dedupe_key
+from custom_components.universal_notifier.dispatcher import Delivery
+
+
+def test_ttl_cache_reports_duplicates_within_ttl():
+    cache = TTLCache(ttl=10, max_entries=100)
+    assert not cache.check_and_add("a", 0.0)
+    assert cache.check_and_add("a", 5.0)
+    # Scaduta: registrata di nuovo
+    assert not cache.check_and_add("a", 10.0)
+    assert len(cache) == 1
+
+
+def test_ttl_cache_evicts_expired_and_oldest_entries():
+    cache = TTLCache(ttl=10, max_entries=2)
+    cache.check_and_add("a", 0.0)
+    cache.check_and_add("b", 1.0)
+    cache.check_and_add("c", 2.0)
+    assert len(cache) == 2
+    assert not cache.check_and_add("a", 3.0)  # "a" era la più vecchia
+    cache.check_and_add("d", 20.0)
+    assert len(cache) == 1
+
+
+def test_dedupe_key_depends_on_the_whole_notification():
+    key = dedupe_key("tg", "notify.tg", "hello", None, {"data": {"a": 1, "b": 2}})
+    # Il payload è confrontato in forma canonica
+    assert key == dedupe_key("tg", "notify.tg", "hello", None, {"data": {"b": 2, "a": 1}})
+    assert key != dedupe_key("tg", "notify.tg", "hello", "title", {"data": {"a": 1, "b": 2}})
+    assert key != dedupe_key("phone", "notify.tg", "hello", None, {"data": {"a": 1, "b": 2}})
+    assert key != dedupe_key("tg", "telegram_bot.send_photo", "hello", None, {"data": {"a": 1, "b": 2}})
+    assert key != dedupe_key("tg", "notify.tg", "hello", None, {"data": {"a": 1, "b": 3}})
+    # Chiavi non ordinabili: nessun errore
+    assert dedupe_key("tg", "notify.tg", "hello", None, {1: "x", "a": "y"})
+
+
+async def test_dedupe_compares_the_payload_not_only_the_text(setup_notifier, conf):
+    conf["dedupe"] = {"window": 30}
+    notifier = await setup_notifier(conf)
+
+    # Stesso annuncio verso due player diversi
+    for player in ("media_player.kitchen", "media_player.bedroom"):
+        response = await notifier.call("send", {
+            "message": "Cena pronta", "targets": ["echo_0"],
+            "data": {"media_player_entity_id": player},
+        })
+        assert response["sent"] == ["echo_0"]
+
+    # Stessa didascalia, foto diverse
+    def photo(url: str) -> dict:
+        return {
+            "message": "Movimento", "targets": ["telegram_0"], "data": {"type": "photo"},
+            "target_data": {"telegram_0": {"photo": url}},
+        }
+
+    for url in ("http://cam/1.jpg", "http://cam/2.jpg"):
+        response = await notifier.call("send", photo(url))
+        assert response["sent"] == ["telegram_0"]
+
+    # Ripetizione identica: soppressa
+    response = await notifier.call("send", photo("http://cam/2.jpg"))
+    assert response["deduplicated"] == ["telegram_0"]
+    assert len(notifier.provider_calls("telegram_bot.send_photo")) == 2
+
+
+def _text(target: str, message: str, body: str | None) -> tuple:
+    return Delivery(target, "notify", "tg", {"message": message, "data": {"x": 1}}), body
+
+
+async def test_coalescer_merges_bodies_under_one_prefix(hass):
+    flushed = []
+
+    async def flush(deliveries):
+        flushed.extend(deliveries)
+
+    coalescer = Coalescer(hass, flush)
+    for delivery, body in (
+        _text("tg", "[Bot - 10:00] \none", "one"),
+        _text("tg", "[Bot - 10:01] \ntwo", "two"),
+        _text("tg", "<templated>", None),
+        _text("phone", "[Bot - 10:00] \nsolo", "solo"),
+    ):
+        coalescer.add(delivery, 0.05, body)
+    assert len(coalescer) == 2
+
+    await asyncio.sleep(0.1)
+    await hass.async_block_till_done()
+    merged = {delivery.target: delivery.payload for delivery in flushed}
+    assert merged["tg"] == {"message": "[Bot - 10:00] \none\ntwo\n<templated>", "data": {"x": 1}}
+    assert merged["phone"]["message"] == "[Bot - 10:00] \nsolo"
+    assert len(coalescer) == 0
+
+
+async def test_coalescer_flush_all_cancels_timers(hass):
+    flushed = []
+
+    async def flush(deliveries):
+        flushed.append(deliveries)
+
+    coalescer = Coalescer(hass, flush)
+    for delivery, body in (_text("tg", "[Bot] \none", "one"), _text("tg", "[Bot] \ntwo", "two")):
+        coalescer.add(delivery, 0.05, body)
+    coalescer.async_flush_all()
+    await hass.async_block_till_done()
+    assert len(flushed) == 1
+    assert flushed[0][0].payload["message"] == "[Bot] \none\ntwo"
+
+    # Il timer della finestra è stato annullato: nessun secondo invio
+    await asyncio.sleep(0.1)
+    await hass.async_block_till_done()
+    assert len(flushed) == 1
@@ -0,0 +1,99 @@
+# tests/test_digest.py
+
+import asyncio
+from datetime import timedelta
+
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from custom_components.universal_notifier.const import DIGEST_STORAGE_KEY
+from custom_components.universal_notifier.digest import DndDigest, combine_messages
+from custom_components.universal_notifier.schedule import TimeSchedule
+
+DND_OFF = TimeSchedule({}, {"start": "00:00", "end": "00:00"})
+
+
+def _dnd_now() -> TimeSchedule:
+    now = dt_util.now()
+    return TimeSchedule({}, {
+        "start": (now - timedelta(hours=1)).strftime("%H:%M"),
+        "end": (now + timedelta(hours=1)).strftime("%H:%M"),
+    })
+
+
+async def _run_timers(hass) -> None:
+    """Lascia scattare il timer di fine DND (programmato per 'adesso')."""
+    await asyncio.sleep(0.1)
+    await hass.async_block_till_done()
+
+
+def _digest(hass, schedule: TimeSchedule, flushed: list, max_size: int = 10) -> DndDigest:
+    async def flush(batch):
+        flushed.extend(batch)
+
+    return DndDigest(hass, schedule, max_size, flush)
+
+
+def test_combine_messages_adds_punctuation():
+    assert combine_messages(["Porta aperta", "Finestra chiusa!", "  "]) == (
+        "Porta aperta. Finestra chiusa! "
+    )
+
+
+async def test_flush_at_dnd_end_groups_by_channel_and_context(hass):
+    flushed = []
+    digest = _digest(hass, _dnd_now(), flushed)
+    now = dt_util.now()
+    kitchen = {"data": {"entity_id": "media_player.kitchen"}}
+    assert digest.add("echo", "uno", now, kitchen)
+    assert digest.add("echo", "due", now, kitchen)
+    assert digest.add("echo", "tre", now, {"data": {"entity_id": "media_player.bed"}})
+    assert digest.add("phone", "uno", now)
+    # Stesso messaggio, canale e contesto: già in attesa
+    assert not digest.add("echo", "uno", now, {"data": {"entity_id": "media_player.kitchen"}})
+    assert len(digest) == 4
+
+    # Ancora in DND: nessun riepilogo
+    await _run_timers(hass)
+    assert flushed == []
+
+    # Reload con il DND disabilitato: il riepilogo parte subito
+    digest.update(DND_OFF, 10)
+    await _run_timers(hass)
+    assert flushed == [
+        ("echo", kitchen, ["uno", "due"]),
+        ("echo", {"data": {"entity_id": "media_player.bed"}}, ["tre"]),
+        ("phone", {}, ["uno"]),
+    ]
+    assert len(digest) == 0
+
+
+async def test_oldest_entries_are_dropped_beyond_max_size(hass):
+    flushed = []
+    digest = _digest(hass, _dnd_now(), flushed, max_size=2)
+    now = dt_util.now()
+    for message in ("a", "b", "c"):
+        digest.add("echo", message, now)
+    digest.update(DND_OFF, 2)
+    await _run_timers(hass)
+    assert flushed == [("echo", {}, ["b", "c"])]
+
+
+async def test_entries_are_restored_from_storage(hass):
+    await Store(hass, 1, DIGEST_STORAGE_KEY).async_save({"entries": [
+        ["echo", "salvata", {"data": {"entity_id": "media_player.kitchen"}}],
+        # Formato delle versioni precedenti: senza contesto
+        ["echo", "vecchia"],
+    ]})
+    flushed = []
+    digest = _digest(hass, DND_OFF, flushed)
+    await digest.async_load()
+    assert len(digest) == 2
+
+    digest.start()
+    await hass.async_block_till_done()
+    assert flushed == [
+        ("echo", {"data": {"entity_id": "media_player.kitchen"}}, ["salvata"]),
+        ("echo", {}, ["vecchia"]),
+    ]
+    assert digest._data_to_save() == {"entries": []}
@@ -0,0 +1,151 @@
+# tests/test_dispatcher.py
+
+import asyncio
+import time
+
+from custom_components.universal_notifier.dispatcher import (
+    Delivery, DispatchLanes, async_dispatch, new_results,
+)
+from custom_components.universal_notifier.sequencer import PlayerSequencer
+
+
+class Provider:
+    """notify.<canale>: durata per messaggio e concorrenza massima osservata."""
+
+    def __init__(self, hass, durations: dict | None = None) -> None:
+        self.durations = durations or {}
+        self.order = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        hass.services.async_register("notify", "test", self._handle)
+
+    async def _handle(self, call) -> None:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            message = call.data["message"]
+            await asyncio.sleep(self.durations.get(message, 0.01))
+            if message == "error":
+                raise RuntimeError("boom")
+            self.order.append(message)
+        finally:
+            self.in_flight -= 1
+
+
+def _delivery(target: str, message: str, **kwargs) -> Delivery:
+    return Delivery(target, "notify", "test", {"message": message}, **kwargs)
+
+
+async def test_concurrent_dispatch_is_bounded_by_the_lane(hass):
+    provider = Provider(hass)
+    lanes = DispatchLanes(max_concurrency=3, timeout=1, priority_max_concurrency=1, priority_timeout=1)
+    deliveries = [_delivery(f"channel_{i}", f"m{i}") for i in range(8)]
+    results = await async_dispatch(hass, deliveries, new_results(), concurrent=True, lanes=lanes)
+    assert len(results["sent"]) == 8
+    assert provider.max_in_flight == 3
+    assert lanes.as_dict()["normal"]["in_flight"] == 0
+
+
+async def test_sequential_dispatch_keeps_the_order(hass):
+    provider = Provider(hass)
+    lanes = DispatchLanes(4, 1, 1, 1)
+    deliveries = [_delivery(f"channel_{i}", f"m{i}") for i in range(4)]
+    await async_dispatch(hass, deliveries, new_results(), concurrent=False, lanes=lanes)
+    assert provider.order == ["m0", "m1", "m2", "m3"]
+    assert provider.max_in_flight == 1
+
+
+async def test_messages_to_the_same_channel_stay_in_order(hass):
+    provider = Provider(hass, {"first": 0.05})
+    lanes = DispatchLanes(4, 1, 1, 1)
+    deliveries = [_delivery("tg", "first"), _delivery("phone", "other"), _delivery("tg", "second")]
+    await async_dispatch(hass, deliveries, new_results(), concurrent=True, lanes=lanes)
+    assert provider.order.index("first") < provider.order.index("second")
+    assert provider.order[0] == "other"
+
+
+async def test_failures_and_timeouts_go_to_on_failure(hass):
+    Provider(hass, {"slow": 1})
+    lanes = DispatchLanes(4, 0.05, 1, 0.05)
+    failed = []
+
+    def on_failure(delivery):
+        failed.append(delivery.payload["message"])
+        return "queued-id"
+
+    results = await async_dispatch(
+        hass, [_delivery("a", "slow"), _delivery("b", "error"), _delivery("c", "ok")],
+        new_results(), True, lanes, on_failure=on_failure,
+    )
+    assert results["timed_out"] == ["a"]
+    assert results["failed"] == ["b"]
+    assert results["sent"] == ["c"]
+    assert sorted(results["queued"]) == ["a", "b"]
+    assert sorted(failed) == ["error", "slow"]
+
+
+async def test_priority_lane_does_not_wait_for_the_routine_backlog(hass):
+    provider = Provider(hass, {"slow": 0.3})
+    lanes = DispatchLanes(1, 1, 1, 1)
+    routine = asyncio.create_task(async_dispatch(
+        hass, [_delivery("a", "slow"), _delivery("b", "slow")], new_results(), True, lanes,
+    ))
+    await asyncio.sleep(0.01)
+    assert lanes.as_dict()["normal"]["depth"] == 1
+
+    results = await async_dispatch(
+        hass, [_delivery("c", "alarm", priority=True)], new_results(), True, lanes,
+    )
+    assert results["sent"] == ["c"]
+    # Consegnato mentre il primo messaggio ordinario è ancora in corso
+    assert provider.order == ["alarm"]
+    await routine
+
+
+async def test_preempted_announcement_is_not_queued(hass):
+    Provider(hass, {"routine": 5})
+    hass.services.async_register("media_player", "volume_set", lambda call: None)
+    sequencer = PlayerSequencer(hass, restore=False, restore_delay=0)
+    lanes = DispatchLanes(4, 10, 1, 10)
+    queued = []
+
+    def on_failure(delivery):
+        queued.append(delivery.target)
+        return "queued-id"
+
+    def voice(message: str, priority: bool) -> Delivery:
+        return _delivery("echo", message, volume_entity="media_player.echo", volume_level=0.5,
+                         priority=priority, is_voice=True)
+
+    routine = asyncio.create_task(async_dispatch(
+        hass, [voice("routine", False)], new_results(), True, lanes,
+        on_failure=on_failure, sequencer=sequencer,
+    ))
+    await asyncio.sleep(0.02)
+    async with asyncio.timeout(1):
+        alarm = await async_dispatch(
+            hass, [voice("alarm", True)], new_results(), True, lanes,
+            on_failure=on_failure, sequencer=sequencer,
+        )
+        results = await routine
+    assert alarm["sent"] == ["echo"]
+    assert results["preempted"] == ["echo"]
+    assert results["queued"] == []
+    assert queued == []
+
+
+async def test_rate_limit_wait_does_not_hold_back_other_channels(hass):
+    provider = Provider(hass)
+    lanes = DispatchLanes(4, 1, 1, 1)
+    later = time.monotonic() + 0.1
+    deliveries = [
+        _delivery("tg", "tg-1", not_before=later),
+        _delivery("phone", "phone-1"),
+        _delivery("tg", "tg-2", not_before=later),
+        _delivery("echo", "echo-1"),
+    ]
+    results = await async_dispatch(hass, deliveries, new_results(), concurrent=False, lanes=lanes)
+    assert len(results["sent"]) == 4
+    # Il canale rallentato resta in ordine, gli altri non lo aspettano
+    assert provider.order == ["phone-1", "echo-1", "tg-1", "tg-2"]
+    assert provider.max_in_flight == 1
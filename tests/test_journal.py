@@ -0,0 +1,123 @@
+# tests/test_journal.py
+
+import time
+
+from homeassistant.util import dt as dt_util
+
+from custom_components.universal_notifier.dispatcher import (
+    Delivery, DispatchLanes, async_dispatch, new_results,
+)
+from custom_components.universal_notifier.journal import DeliveryJournal, JournalRecord
+
+
+def _journal(hass, records: list, max_entries: int = 10) -> DeliveryJournal:
+    """Giornale con record (target, esito, istante) già inseriti in ordine di tempo."""
+    journal = DeliveryJournal(hass, max_entries, persist=False)
+    for target, outcome, at in records:
+        journal._records.append(JournalRecord(at, target, "notify.test", outcome, None, None, None))
+    return journal
+
+
+def test_query_filters_newest_first(hass):
+    journal = _journal(hass, [
+        ("tg", "sent", 100.0), ("phone", "failed", 200.0), ("tg", "failed", 300.0),
+    ])
+    entries = journal.query()
+    assert [entry["time"] for entry in entries] == [
+        dt_util.utc_from_timestamp(at).isoformat() for at in (300.0, 200.0, 100.0)
+    ]
+    assert [entry["target"] for entry in journal.query(targets={"tg"})] == ["tg", "tg"]
+    assert [entry["target"] for entry in journal.query(outcomes={"failed"})] == ["tg", "phone"]
+    assert len(journal.query(limit=2)) == 2
+
+
+def test_query_time_range_stops_at_start(hass):
+    journal = _journal(hass, [("tg", "sent", float(at)) for at in range(100, 600, 100)])
+    entries = journal.query(start=200.0, end=400.0)
+    assert [entry["time"] for entry in entries] == [
+        dt_util.utc_from_timestamp(at).isoformat() for at in (400.0, 300.0, 200.0)
+    ]
+
+    # I record sono in ordine di tempo: la scansione si ferma al primo più vecchio
+    # di start, senza guardare quelli precedenti (qui un record fuori ordine)
+    unordered = _journal(hass, [("tg", "sent", 900.0), ("tg", "sent", 100.0)])
+    assert unordered.query(start=350.0) == []
+    assert len(unordered.query(end=950.0)) == 2
+
+
+def test_ring_buffer_keeps_the_latest_records(hass):
+    journal = DeliveryJournal(hass, 3, persist=False)
+    for i in range(5):
+        journal.add(f"channel_{i}", "notify.test", "sent")
+    assert len(journal) == 3
+    assert [entry["target"] for entry in journal.query()] == ["channel_4", "channel_3", "channel_2"]
+
+
+async def test_persisted_journal_is_reloaded(hass):
+    journal = DeliveryJournal(hass, 10, persist=True)
+    journal.add("tg", "telegram_bot.send_message", "failed", "boom", 0.001, 0.25)
+    journal.add("phone", "notify.mobile_app_phone", "sent")
+    # Stop di HA: il salvataggio ritardato è scritto subito
+    await journal._store.async_save(journal._data_to_save())
+
+    restored = DeliveryJournal(hass, 10, persist=True)
+    await restored.async_load()
+    # Su disco i tempi sono arrotondati al millisecondo
+    assert [record.as_record() for record in restored._records] == [
+        record.as_record() for record in journal._records
+    ]
+    assert restored.query()[1]["reason"] == "boom"
+
+
+async def test_invalid_stored_records_are_skipped(hass):
+    journal = DeliveryJournal(hass, 10, persist=True)
+    await journal._store.async_save({
+        "records": [[1.0, "tg"], [2.0, "tg", None, "sent", None, None, None]],
+    })
+    restored = DeliveryJournal(hass, 10, persist=True)
+    await restored.async_load()
+    assert len(restored) == 1
+
+
+async def test_retry_hand_off_is_recorded_as_queued(hass):
+    async def fail(call):
+        raise RuntimeError("provider down")
+
+    hass.services.async_register("notify", "test", fail)
+    journal = DeliveryJournal(hass, 10, persist=False)
+    results = await async_dispatch(
+        hass, [Delivery("tg", "notify", "test", {"message": "x"})], new_results(), True,
+        DispatchLanes(4, 1, 1, 1), on_failure=lambda delivery: "abc123", journal=journal,
+    )
+    assert results["queued"] == ["tg"]
+    assert [(entry["outcome"], entry["reason"]) for entry in journal.query()] == [
+        ("queued", "retry abc123"), ("failed", "provider down"),
+    ]
+    assert journal.query(outcomes={"queued"})[0]["target"] == "tg"
+
+
+async def test_history_service_filters(setup_notifier, conf):
+    conf["groups"] = {"chats": ["telegram_0", "telegram_1"]}
+    notifier = await setup_notifier(conf, failures=["telegram_bot.send_message"])
+    started = dt_util.now()
+    await notifier.call("send", {"message": "x", "targets": ["chats", "phone", "ghost"]})
+
+    history = await notifier.call("history", {})
+    assert history["size"] == 4
+    assert [entry["target"] for entry in history["entries"]] == [
+        "phone", "telegram_1", "telegram_0", "ghost",
+    ]
+
+    history = await notifier.call("history", {"targets": "chats", "outcomes": "failed"})
+    assert [entry["target"] for entry in history["entries"]] == ["telegram_1", "telegram_0"]
+
+    history = await notifier.call("history", {"outcomes": ["skipped"], "limit": 1})
+    assert history["entries"][0]["reason"] == "unknown_target"
+
+    future = dt_util.as_local(dt_util.utc_from_timestamp(time.time() + 3600))
+    history = await notifier.call("history", {"start": future.isoformat()})
+    assert history["entries"] == []
+    history = await notifier.call("history", {
+        "start": "2000-01-01 00:00:00", "end": started.isoformat(),
+    })
+    assert history["entries"] == []
@@ -0,0 +1,42 @@
+# tests/test_metrics.py
+
+from custom_components.universal_notifier.metrics import LatencyHistogram, NotifierMetrics
+
+
+def test_histogram_quantiles_are_bucket_upper_bounds():
+    histogram = LatencyHistogram()
+    assert histogram.quantile(0.5) is None
+    for seconds in (0.005, 0.02, 0.02, 0.3):
+        histogram.observe(seconds)
+    assert histogram.quantile(0.5) == 0.025
+    assert histogram.quantile(0.99) == 0.5
+    assert histogram.as_dict()["max"] == 0.3
+
+    histogram.observe(60.0)
+    # Oltre l'ultimo bucket il quantile è il massimo osservato
+    assert histogram.quantile(1.0) == 60.0
+
+
+def test_failure_rate_and_totals():
+    metrics = NotifierMetrics(["tg", "phone"])
+    metrics.channels["tg"].sent = 3
+    metrics.channels["tg"].timed_out = 1
+    metrics.channels["phone"].failed = 2
+    assert metrics.sent == 3
+    assert metrics.failed == 3
+    assert metrics.as_dict()["channels"]["tg"]["failure_rate"] == 0.25
+
+    # Un reload aggiunge i nuovi canali senza azzerare gli altri
+    metrics.add_channels(["tg", "echo"])
+    assert metrics.channels["tg"].sent == 3
+    assert metrics.channel("echo").sent == 0
+
+
+async def test_stats_service_counts_outcomes(setup_notifier, conf):
+    notifier = await setup_notifier(conf, failures=["notify.mobile_app_phone"])
+    await notifier.call("send", {"message": "x", "targets": ["telegram_0", "phone", "ghost"]})
+    stats = await notifier.call("stats", {})
+    assert stats["sent"] == 1
+    assert stats["failed"] == 1
+    assert stats["unknown_target"] == 1
+    assert stats["channels"]["telegram_0"]["call_latency"]["count"] == 1
@@ -0,0 +1,86 @@
+# tests/test_occupancy.py
+
+import pytest
+
+from homeassistant.const import STATE_HOME, STATE_NOT_HOME, STATE_OFF, STATE_ON, STATE_UNAVAILABLE
+
+from custom_components.universal_notifier.occupancy import OccupancyTracker, is_occupied
+
+
+class _State:
+    def __init__(self, state: str) -> None:
+        self.state = state
+
+
+@pytest.mark.parametrize(("state", "occupied"), [
+    (STATE_ON, True), (STATE_HOME, True), ("2", True),
+    (STATE_OFF, False), (STATE_NOT_HOME, False), ("0", False), ("office", False),
+    # Entità assenti o non disponibili: meglio un annuncio in più
+    (STATE_UNAVAILABLE, True), (None, True),
+])
+def test_is_occupied(state, occupied):
+    assert is_occupied(_State(state) if state is not None else None) is occupied
+
+
+async def test_occupancy_follows_state_changes(hass):
+    hass.states.async_set("binary_sensor.kitchen", STATE_OFF)
+    hass.states.async_set("person.anna", STATE_HOME)
+    tracker = OccupancyTracker(hass)
+    tracker.update({
+        "kitchen": ("binary_sensor.kitchen",),
+        "bedroom": ("binary_sensor.bedroom", "person.anna"),
+    })
+    assert tracker.state() == {"kitchen": False, "bedroom": True}
+    assert tracker.split(["kitchen", "bedroom", "phone"]) == (["bedroom", "phone"], ["kitchen"])
+
+    hass.states.async_set("binary_sensor.kitchen", STATE_ON)
+    hass.states.async_set("binary_sensor.bedroom", STATE_OFF)
+    hass.states.async_set("person.anna", STATE_NOT_HOME)
+    await hass.async_block_till_done()
+    assert tracker.state() == {"kitchen": True, "bedroom": False}
+
+    # Dopo lo stop la mappa non segue più gli eventi
+    tracker.async_stop()
+    hass.states.async_set("binary_sensor.kitchen", STATE_OFF)
+    await hass.async_block_till_done()
+    assert tracker.state()["kitchen"] is True
+
+
+async def test_update_replaces_the_tracked_entities(hass):
+    hass.states.async_set("binary_sensor.kitchen", STATE_OFF)
+    tracker = OccupancyTracker(hass)
+    tracker.update({"kitchen": ("binary_sensor.kitchen",)})
+    tracker.update({"office": ("binary_sensor.office",)})
+    assert not tracker.tracks("kitchen")
+
+    hass.states.async_set("binary_sensor.office", STATE_OFF)
+    await hass.async_block_till_done()
+    assert tracker.state() == {"office": False}
+    tracker.async_stop()
+
+
+async def test_only_occupied_skips_empty_rooms(setup_notifier, conf):
+    conf["channels"]["echo_0"]["presence"] = ["binary_sensor.kitchen"]
+    conf["channels"]["echo_1"]["presence"] = ["binary_sensor.bedroom"]
+    notifier = await setup_notifier(conf, states={"binary_sensor.kitchen": STATE_OFF})
+    # Nessuno stato per il sensore della camera: conta come occupata
+    response = await notifier.call("send", {
+        "message": "x", "targets": ["echo_0", "echo_1", "phone"], "only_occupied": True,
+    })
+    assert response["sent"] == ["echo_1", "phone"]
+    assert response["skipped"] == ["echo_0"]
+
+    # Senza only_occupied la presenza non conta
+    response = await notifier.call("send", {"message": "y", "targets": ["echo_0"]})
+    assert response["sent"] == ["echo_0"]
+
+
+async def test_presence_fallback_when_every_room_is_empty(setup_notifier, conf):
+    conf["channels"]["echo_0"]["presence"] = ["binary_sensor.kitchen"]
+    conf["presence_fallback"] = ["phone"]
+    notifier = await setup_notifier(conf, states={"binary_sensor.kitchen": STATE_OFF})
+    response = await notifier.call("send", {
+        "message": "x", "targets": ["echo_0"], "only_occupied": True,
+    })
+    assert response["sent"] == ["phone"]
+    assert response["skipped"] == ["echo_0"]
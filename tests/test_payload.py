@@ -0,0 +1,77 @@
+# tests/test_payload.py
+
+from types import MappingProxyType
+
+from custom_components.universal_notifier.payload import EMPTY_LAYER, LayeredPayload
+
+
+def _layers():
+    # Sorgenti in sola lettura: qualunque modifica solleverebbe TypeError
+    config = MappingProxyType({"entity_id": "media_player.echo", "data": {"type": "tts"}, "x": 1})
+    runtime = MappingProxyType({"x": 2, "y": 2, "parse_mode": "html"})
+    target = MappingProxyType({"y": 3, "message": "hi", "type": "photo", "photo": "http://a"})
+    return config, runtime, target
+
+
+def test_precedence_between_layers():
+    config, runtime, target = _layers()
+    payload = LayeredPayload(config, runtime, target)
+    assert payload.get("entity_id") == "media_player.echo"
+    assert payload.get("x") == 2
+    assert payload.get("y") == 3
+    payload["y"] = 4
+    assert payload.get("y") == 4
+    assert payload.get("missing", "default") == "default"
+
+
+def test_set_default_sits_below_call_data():
+    config, runtime, target = _layers()
+    payload = LayeredPayload(config, runtime, target)
+    payload.set_default("x", 10)
+    payload.set_default("caption", "c")
+    assert payload.get("x") == 2
+    assert payload.build()["caption"] == "c"
+
+
+def test_consumed_keys_are_not_forwarded():
+    config, runtime, target = _layers()
+    payload = LayeredPayload(config, runtime, target, consumed=("message", "type"))
+    assert payload.take("photo") == "http://a"
+    # Già consumata: una seconda lettura restituisce il default
+    assert payload.take("photo", "none") == "none"
+    built = payload.build()
+    assert "message" not in built
+    assert "photo" not in built
+    assert built["y"] == 3
+
+
+def test_pop_removes_the_key_from_every_layer():
+    config, runtime, target = _layers()
+    payload = LayeredPayload(config, runtime, target)
+    assert payload.pop("entity_id") == "media_player.echo"
+    assert payload.get("entity_id") is None
+    assert "entity_id" not in payload.build()
+    # Reimpostata dopo la rimozione
+    payload["entity_id"] = "media_player.other"
+    assert payload.build()["entity_id"] == "media_player.other"
+
+
+def test_build_leaves_sources_untouched():
+    config, runtime, target = _layers()
+    payload = LayeredPayload(config, runtime, target, consumed=("message",))
+    payload["message"] = "rendered"
+    payload.pop("parse_mode")
+    built = payload.build()
+    assert built == {
+        "entity_id": "media_player.echo", "data": {"type": "tts"}, "x": 2, "y": 3,
+        "type": "photo", "photo": "http://a", "message": "rendered",
+    }
+    assert dict(runtime) == {"x": 2, "y": 2, "parse_mode": "html"}
+    assert target["message"] == "hi"
+    # Ogni build è un dict nuovo
+    assert payload.build() is not built
+
+
+def test_empty_layers():
+    payload = LayeredPayload(EMPTY_LAYER, EMPTY_LAYER, EMPTY_LAYER)
+    assert payload.build() == {}
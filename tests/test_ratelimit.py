@@ -0,0 +1,75 @@
+# tests/test_ratelimit.py
+
+import time
+
+import pytest
+
+from custom_components.universal_notifier.const import (
+    CONF_BURST, CONF_MAX_WAIT, CONF_POLICY, CONF_RATE, RATE_POLICY_DROP, RATE_POLICY_QUEUE,
+)
+from custom_components.universal_notifier.ratelimit import RateLimiter, TokenBucket
+
+
+def _limit(rate: float, burst: int, policy: str = RATE_POLICY_QUEUE, max_wait: float = 60) -> dict:
+    return {CONF_RATE: rate, CONF_BURST: burst, CONF_POLICY: policy, CONF_MAX_WAIT: max_wait}
+
+
+def test_token_bucket_burst_then_refill():
+    bucket = TokenBucket(rate=2.0, burst=2)
+    now = time.monotonic()
+    for _ in range(2):
+        assert bucket.wait_time(now) == 0.0
+        bucket.consume()
+    assert bucket.wait_time(now) == pytest.approx(0.5, abs=0.01)
+    assert bucket.wait_time(now + 0.5) == 0.0
+
+
+def test_token_bucket_is_capped_at_burst():
+    bucket = TokenBucket(rate=1.0, burst=3)
+    now = time.monotonic()
+    bucket.wait_time(now + 1000)
+    assert bucket.tokens == 3
+
+
+def test_token_bucket_debt_delays_later_reservations():
+    bucket = TokenBucket(rate=1.0, burst=1)
+    now = time.monotonic()
+    for _ in range(3):
+        bucket.wait_time(now)
+        bucket.consume()
+    # Due token prenotati oltre il burst: il prossimo arriva tra 3 secondi
+    assert bucket.wait_time(now) == pytest.approx(3.0, abs=0.01)
+
+
+def test_rate_limiter_queues_then_drops():
+    limiter = RateLimiter({
+        "queued": _limit(1.0, 1, max_wait=1.5),
+        "dropped": _limit(1.0, 1, RATE_POLICY_DROP),
+    })
+    now = time.monotonic()
+    assert limiter.reserve("queued") == pytest.approx(now, abs=0.01)
+    assert limiter.reserve("queued") == pytest.approx(now + 1, abs=0.01)
+    # L'attesa supererebbe max_wait
+    assert limiter.reserve("queued") is None
+
+    assert limiter.reserve("dropped") is not None
+    assert limiter.reserve("dropped") is None
+    # Canale senza limiti
+    assert limiter.reserve("free") == pytest.approx(now, abs=0.01)
+
+
+def test_rate_limiter_priority_consumes_without_waiting():
+    limiter = RateLimiter({"tg": _limit(1.0, 1)})
+    now = time.monotonic()
+    limiter.reserve("tg")
+    assert limiter.reserve("tg", priority=True) == pytest.approx(now, abs=0.01)
+    # Il debito della priorità ricade sulla consegna ordinaria successiva
+    assert limiter.reserve("tg") == pytest.approx(now + 2, abs=0.01)
+
+
+def test_rate_limiter_global_cap():
+    limiter = RateLimiter({}, _limit(1.0, 2, RATE_POLICY_DROP))
+    assert limiter.reserve("a") is not None
+    assert limiter.reserve("b") is not None
+    assert limiter.reserve("c") is None
+    assert set(limiter.state()) == {"_global"}
@@ -0,0 +1,64 @@
+# tests/test_reload.py
+
+import asyncio
+
+import pytest
+
+import custom_components.universal_notifier as un
+from custom_components.universal_notifier.const import DOMAIN
+
+
+@pytest.fixture
+def yaml_config(monkeypatch):
+    """Configurazione restituita dalla rilettura del YAML durante il reload."""
+    current = {}
+
+    async def _async_integration_yaml_config(hass, domain):
+        return current.get("config")
+
+    monkeypatch.setattr(un, "async_integration_yaml_config", _async_integration_yaml_config)
+
+    def _set(conf: dict | None) -> None:
+        current["config"] = un.CONFIG_SCHEMA({DOMAIN: conf}) if conf is not None else None
+
+    return _set
+
+
+async def test_reload_swaps_channels_and_keeps_metrics(setup_notifier, conf, yaml_config):
+    notifier = await setup_notifier(conf)
+    await notifier.call("send", {"message": "x", "targets": ["telegram_0", "kitchen"]})
+
+    conf["channels"]["kitchen"] = {"service": "notify.kitchen_display"}
+    yaml_config(conf)
+    await notifier.call("reload", {}, return_response=False)
+
+    response = await notifier.call("send", {"message": "y", "targets": ["telegram_0", "kitchen"]})
+    assert response["sent"] == ["telegram_0", "kitchen"]
+    stats = await notifier.call("stats", {})
+    # I contatori dei canali esistenti sopravvivono al reload
+    assert stats["channels"]["telegram_0"]["sent"] == 2
+    assert stats["channels"]["kitchen"]["sent"] == 1
+
+
+async def test_invalid_config_keeps_the_current_state(setup_notifier, conf, yaml_config):
+    notifier = await setup_notifier(conf)
+    yaml_config(None)
+    await notifier.call("reload", {}, return_response=False)
+    response = await notifier.call("send", {"message": "x", "targets": ["telegram_0"]})
+    assert response["sent"] == ["telegram_0"]
+
+
+async def test_call_in_progress_finishes_with_the_previous_state(setup_notifier, conf, yaml_config):
+    notifier = await setup_notifier(conf, latency=0.01)
+    sending = asyncio.create_task(
+        notifier.call("send", {"message": "x", "targets": ["phone", "telegram_0"]})
+    )
+    await asyncio.sleep(0)
+
+    del conf["channels"]["telegram_0"]
+    yaml_config(conf)
+    await notifier.call("reload", {}, return_response=False)
+
+    assert (await sending)["sent"] == ["phone", "telegram_0"]
+    response = await notifier.call("send", {"message": "y", "targets": ["telegram_0"]})
+    assert response["skipped"] == ["telegram_0"]
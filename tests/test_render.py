@@ -0,0 +1,42 @@
+# tests/test_render.py
+
+from custom_components.universal_notifier.render import (
+    HTML, MARKDOWN, PLAIN, TTS, MessageRenderer, clean_text_for_tts, get_formatter,
+)
+
+
+def test_get_formatter_from_parse_mode():
+    assert get_formatter("HTML") is HTML
+    assert get_formatter("MarkdownV2") is MARKDOWN
+    assert get_formatter(None) is PLAIN
+    assert get_formatter("html", voice=True) is TTS
+
+
+def test_clean_text_for_tts_drops_markup_and_links():
+    assert clean_text_for_tts("*Porta* [aperta] http://cam.local/x ") == "Porta aperta"
+    assert clean_text_for_tts("") == ""
+
+
+def test_visual_message_has_escaped_bold_prefix():
+    renderer = MessageRenderer("Hal<9000>", "12:30", "Ciao", "Allarme")
+    assert renderer.render("a < b", "html", False) == (
+        "<b>[Hal&lt;9000&gt; - 12:30]</b> \na &lt; b"
+    )
+    assert renderer.render("a < b", "markdown", False) == "*[Hal<9000> - 12:30]* \na < b"
+    assert renderer.render("x", None, False, inject_title=True) == "[Hal<9000> - 12:30]  Allarme\nx"
+
+
+def test_voice_message_has_greeting_and_no_prefix():
+    renderer = MessageRenderer("Hal9000", "12:30", "*Buongiorno*", "Allarme")
+    assert renderer.render("Porta [aperta]", None, True, inject_title=True) == (
+        "Buongiorno. Porta aperta"
+    )
+    assert MessageRenderer("Hal9000", "12:30", "", None).render("x", None, True) == "x"
+
+
+def test_render_is_cached_per_message_and_formatter():
+    renderer = MessageRenderer("Hal9000", "", "", None, bold_prefix=False)
+    first = renderer.render("x", "html", False)
+    assert first == "[Hal9000] \nx"
+    assert renderer.render("x", "html", False) is first
+    assert renderer.render_body("a < b", "html", False) == "a &lt; b"
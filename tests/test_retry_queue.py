@@ -0,0 +1,184 @@
+# tests/test_retry_queue.py
+
+import asyncio
+import json
+from datetime import timedelta
+
+import pytest
+
+from homeassistant.util import dt as dt_util
+
+from custom_components.universal_notifier.dispatcher import Delivery, DispatchLanes
+from custom_components.universal_notifier.journal import DeliveryJournal
+from custom_components.universal_notifier.metrics import NotifierMetrics
+from custom_components.universal_notifier.retry_queue import RetryQueue
+from custom_components.universal_notifier.schedule import TimeSchedule
+
+
+class Provider:
+    """Servizio notify.test: registra le chiamate e la concorrenza massima."""
+
+    def __init__(self, hass, delay: float = 0.0, fail: set = frozenset()) -> None:
+        self.delay = delay
+        self.fail = set(fail)
+        self.messages = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        hass.services.async_register("notify", "test", self._handle)
+
+    async def _handle(self, call) -> None:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if call.data["message"] in self.fail:
+                raise RuntimeError("provider down")
+            self.messages.append(call.data["message"])
+        finally:
+            self.in_flight -= 1
+
+
+def _delivery(target: str, message: str, **kwargs) -> Delivery:
+    return Delivery(target, "notify", "test", {"message": message}, **kwargs)
+
+
+def _queue(hass, tmp_path, **kwargs) -> RetryQueue:
+    options = {
+        "max_attempts": 3, "base_delay": 60, "max_delay": 600, "max_size": 10,
+        "lanes": DispatchLanes(4, 1.0, 2, 1.0),
+    }
+    options.update(kwargs)
+    return RetryQueue(hass, str(tmp_path / "queue.jsonl"), **options)
+
+
+async def _drain(queue: RetryQueue, depth: int = 0) -> None:
+    queue.flush()
+    async with asyncio.timeout(5):
+        while queue.depth > depth:
+            await asyncio.sleep(0.01)
+
+
+async def test_entries_are_replayed_after_restart(hass, tmp_path):
+    queue = _queue(hass, tmp_path)
+    queue.enqueue(_delivery("tg", "one"))
+    queue.enqueue(_delivery("phone", "two", priority=True))
+    # Stop di HA: le righe pendenti finiscono su disco
+    await queue.async_stop()
+
+    provider = Provider(hass)
+    restarted = _queue(hass, tmp_path)
+    await restarted.async_load()
+    assert restarted.depth == 2
+    assert {entry["target"] for entry in restarted.entries()} == {"tg", "phone"}
+
+    restarted.start()
+    await _drain(restarted)
+    await restarted.async_stop()
+    assert sorted(provider.messages) == ["one", "two"]
+
+    # Coda vuota anche dopo un altro riavvio
+    again = _queue(hass, tmp_path)
+    await again.async_load()
+    assert again.depth == 0
+
+
+async def test_records_of_previous_versions_are_loaded(hass, tmp_path):
+    record = ["a", "legacy", "echo", "notify", "test", {"message": "hi"},
+              "media_player.echo", 0.4, 1, 0]
+    (tmp_path / "queue.jsonl").write_text(json.dumps(record) + "\n")
+    queue = _queue(hass, tmp_path)
+    await queue.async_load()
+    delivery = queue._entries["legacy"].delivery
+    assert (delivery.priority, delivery.fallback) == (False, False)
+    # Il volume è impostato solo per i canali vocali
+    assert delivery.is_voice
+
+
+async def test_due_attempts_run_concurrently_within_the_lane(hass, tmp_path):
+    provider = Provider(hass, delay=0.05)
+    queue = _queue(hass, tmp_path, lanes=DispatchLanes(2, 1.0, 2, 1.0))
+    for i in range(6):
+        queue.enqueue(_delivery(f"channel_{i}", f"m{i}"))
+    # Due messaggi per lo stesso canale: consegnati in ordine
+    queue.enqueue(_delivery("channel_0", "m0-bis"))
+    queue.start()
+    await _drain(queue)
+    await queue.async_stop()
+
+    assert provider.max_in_flight == 2
+    assert len(provider.messages) == 7
+    assert provider.messages.index("m0") < provider.messages.index("m0-bis")
+
+
+async def test_failed_attempts_are_recorded_and_dropped(hass, tmp_path):
+    Provider(hass, fail={"bad"})
+    journal = DeliveryJournal(hass, 50, persist=False)
+    metrics = NotifierMetrics(["tg"])
+    queue = _queue(hass, tmp_path, max_attempts=3, base_delay=0.01, max_delay=0.01,
+                   metrics=metrics, journal=journal)
+    queue.enqueue(_delivery("tg", "bad"))
+    queue.start()
+    await _drain(queue)
+    await queue.async_stop()
+
+    records = journal.query()
+    assert [record["reason"] for record in reversed(records)] == [
+        "attempt 2: provider down", "attempt 3, dropped: provider down",
+    ]
+    assert {record["outcome"] for record in records} == {"failed"}
+    assert metrics.channels["tg"].failed == 2
+
+
+async def test_timed_out_attempts_are_counted(hass, tmp_path):
+    Provider(hass, delay=1.0)
+    journal = DeliveryJournal(hass, 50, persist=False)
+    metrics = NotifierMetrics(["tg"])
+    queue = _queue(hass, tmp_path, max_attempts=2, lanes=DispatchLanes(4, 0.05, 2, 0.05),
+                   metrics=metrics, journal=journal)
+    queue.enqueue(_delivery("tg", "slow"))
+    queue.start()
+    await _drain(queue)
+    await queue.async_stop()
+
+    assert journal.query()[0]["outcome"] == "timed_out"
+    assert metrics.channels["tg"].timed_out == 1
+
+
+def _dnd_now() -> TimeSchedule:
+    """Finestra DND che contiene l'istante corrente."""
+    now = dt_util.now()
+    start = (now - timedelta(hours=1)).strftime("%H:%M")
+    end = (now + timedelta(hours=1)).strftime("%H:%M")
+    return TimeSchedule({}, {"start": start, "end": end})
+
+
+async def test_voice_retries_wait_for_the_end_of_dnd(hass, tmp_path):
+    provider = Provider(hass)
+    schedule = _dnd_now()
+    queue = _queue(hass, tmp_path, schedule=schedule)
+    voice_id = queue.enqueue(_delivery("echo", "voice", is_voice=True))
+    queue.enqueue(_delivery("echo", "alarm", is_voice=True, priority=True))
+    queue.enqueue(_delivery("tg", "text"))
+    queue.start()
+    await _drain(queue, depth=1)
+
+    assert sorted(provider.messages) == ["alarm", "text"]
+    entry = queue._entries[voice_id]
+    # Rimandata alla fine del DND senza consumare tentativi
+    assert entry.attempts == 1
+    assert entry.next_attempt == pytest.approx(schedule.next_dnd_end(dt_util.now()).timestamp())
+
+    # Reload con il DND disabilitato: il tentativo parte
+    queue.update(TimeSchedule({}, {"start": "00:00", "end": "00:00"}))
+    await _drain(queue)
+    await queue.async_stop()
+    assert "voice" in provider.messages
+
+
+async def test_cached_attachment_is_not_queued(hass, tmp_path):
+    queue = _queue(hass, tmp_path)
+    delivery = _delivery("tg", "photo")
+    delivery.source_payload = {"url": "http://camera.local/snapshot.jpg"}
+    delivery.payload = {"file": "/media/cache/snapshot.jpg"}
+    entry_id = queue.enqueue(delivery)
+    assert queue._entries[entry_id].delivery.payload == {"url": "http://camera.local/snapshot.jpg"}
@@ -0,0 +1,64 @@
+# tests/test_routing.py
+
+import pytest
+
+from custom_components.universal_notifier.routing import (
+    ChannelRoute, compile_routes, expand_groups, resolve_targets,
+)
+
+ALIASES = ("echo", "phone", "tg")
+
+
+def test_route_defaults_are_shared_empty_mappings():
+    route = ChannelRoute("a", "notify.a", "notify", "a")
+    assert dict(route.service_data) == {}
+    assert dict(route.alt_routes) == {}
+
+
+def test_compile_routes_splits_service_and_alt_services():
+    routes = compile_routes({
+        "tg": {
+            "service": "telegram_bot.send_message",
+            "is_voice": False,
+            "alt_services": {"photo": {"service": "telegram_bot.send_photo"}},
+        },
+    })
+    route = routes["tg"]
+    assert (route.domain, route.service) == ("telegram_bot", "send_message")
+    assert route.resolve("photo").media_kind == "photo"
+    assert route.resolve("unknown") is route
+    assert route.resolve(None) is route
+
+
+def test_expand_groups_flattens_nested_groups_in_order():
+    groups = expand_groups(
+        {"all": ["speakers", "phone", "echo"], "speakers": ["echo", "tg"]}, ALIASES
+    )
+    assert groups["speakers"] == ("echo", "tg")
+    assert groups["all"] == ("echo", "tg", "phone")
+
+
+@pytest.mark.parametrize("groups", [
+    {"a": ["b"], "b": ["a"]},
+    {"a": ["b"], "b": ["c"], "c": ["a", "echo"]},
+    {"a": ["a"]},
+])
+def test_expand_groups_rejects_cycles(groups):
+    with pytest.raises(ValueError, match="ciclo"):
+        expand_groups(groups, ALIASES)
+
+
+def test_expand_groups_rejects_unknown_members_and_name_clashes():
+    with pytest.raises(ValueError, match="né un canale né un gruppo"):
+        expand_groups({"a": ["missing"]}, ALIASES)
+    with pytest.raises(ValueError, match="stesso nome"):
+        expand_groups({"echo": ["phone"]}, ALIASES)
+
+
+def test_resolve_targets_expands_groups_without_duplicates():
+    groups = expand_groups({"speakers": ["echo", "tg"]}, ALIASES)
+    assert list(resolve_targets("speakers", groups)) == ["echo", "tg"]
+    assert resolve_targets(["tg", "speakers", "phone", "ghost"], groups) == [
+        "tg", "echo", "phone", "ghost",
+    ]
+    assert resolve_targets(["tg", "tg"], {}) == ["tg"]
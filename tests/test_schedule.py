@@ -0,0 +1,81 @@
+# tests/test_schedule.py
+
+from datetime import datetime, time, timezone
+
+from custom_components.universal_notifier.schedule import TimeSchedule
+
+SLOTS = {
+    "morning": {"start": "07:00", "volume": 0.3},
+    "afternoon": {"start": "12:00", "volume": 0.6},
+    "night": {"start": "22:00", "volume": 0.1},
+}
+
+
+def _at(hour: int, minute: int = 0, second: int = 0, day: int = 1) -> datetime:
+    return datetime(2024, 1, day, hour, minute, second, tzinfo=timezone.utc)
+
+
+def test_dnd_window_wraps_midnight():
+    schedule = TimeSchedule(SLOTS, {"start": "22:30", "end": "06:30"})
+    for hour, minute in ((22, 30), (23, 59), (0, 0), (3, 0), (6, 29)):
+        assert schedule.is_dnd(time(hour, minute)), (hour, minute)
+    for hour, minute in ((6, 30), (12, 0), (22, 29)):
+        assert not schedule.is_dnd(time(hour, minute)), (hour, minute)
+
+
+def test_dnd_window_within_the_day():
+    schedule = TimeSchedule({}, {"start": "13:00", "end": "15:00"})
+    assert schedule.is_dnd(time(13, 0))
+    assert schedule.is_dnd(time(14, 59))
+    assert not schedule.is_dnd(time(15, 0))
+    assert not schedule.is_dnd(time(12, 59))
+
+
+def test_dnd_disabled_when_start_equals_end():
+    schedule = TimeSchedule(SLOTS, {"start": "00:00", "end": "00:00"})
+    assert not schedule.is_dnd(time(0, 0))
+    assert schedule.next_dnd_end(_at(3)) is None
+    assert not schedule.state(_at(3)).dnd_active
+
+
+def test_time_before_first_slot_belongs_to_last_slot():
+    schedule = TimeSchedule(SLOTS, {})
+    assert schedule.slot_at(time(1, 0)) == ("night", 0.1)
+    assert schedule.slot_at(time(7, 0)) == ("morning", 0.3)
+    assert schedule.slot_at(time(21, 59)) == ("afternoon", 0.6)
+
+
+def test_next_dnd_end_rolls_over_to_the_next_day():
+    schedule = TimeSchedule(SLOTS, {"start": "22:30", "end": "06:30"})
+    assert schedule.next_dnd_end(_at(23)) == _at(6, 30, day=2)
+    assert schedule.next_dnd_end(_at(5)) == _at(6, 30)
+
+
+def test_state_is_cached_until_the_next_boundary():
+    schedule = TimeSchedule(SLOTS, {"start": "22:30", "end": "06:30"})
+    state = schedule.state(_at(12, 0))
+    assert state == ("afternoon", 0.6, False)
+    # Nessun confine tra 12:00 e 21:59:59: stesso oggetto dalla cache
+    assert schedule.state(_at(15, 30)) is state
+    assert schedule.state(_at(21, 59, 59)) is state
+
+    # Inizio dello slot notturno: nuovo stato, poi il confine del DND
+    night = schedule.state(_at(22, 0))
+    assert night is not state
+    assert night == ("night", 0.1, False)
+    assert schedule.state(_at(22, 30)) == ("night", 0.1, True)
+
+
+def test_cached_state_is_not_used_before_its_start():
+    schedule = TimeSchedule(SLOTS, {"start": "22:30", "end": "06:30"})
+    assert schedule.state(_at(12, 0)).slot == "afternoon"
+    # Orologio tornato indietro (o richiesta per un altro istante)
+    assert schedule.state(_at(8, 0)) == ("morning", 0.3, False)
+
+
+def test_cached_state_wraps_to_the_next_day():
+    schedule = TimeSchedule(SLOTS, {"start": "22:30", "end": "06:30"})
+    late = schedule.state(_at(23, 0))
+    assert late == ("night", 0.1, True)
+    assert schedule.state(_at(2, 0, day=2)) is late
+    assert schedule.state(_at(6, 30, day=2)) == ("night", 0.1, False)
@@ -0,0 +1,145 @@
+# tests/test_send.py
+"""Servizi send / send_many end-to-end, sull'HomeAssistant finto di tests/helpers.py."""
+
+from custom_components.universal_notifier.const import DOMAIN
+
+
+async def test_send_reports_outcomes_per_target(setup_notifier, conf):
+    notifier = await setup_notifier(conf)
+    response = await notifier.call("send", {
+        "message": "Lavatrice terminata",
+        "targets": ["telegram_0", "echo_0", "ghost"],
+        "skip_greeting": True,
+    })
+    assert response["sent"] == ["telegram_0", "echo_0"]
+    assert response["skipped"] == ["ghost"]
+
+    services = [name for name, _ in notifier.services.log]
+    # Il volume del player è impostato prima dell'annuncio
+    assert services.index("media_player.volume_set") < services.index("notify.alexa_media_echo_0")
+    telegram = notifier.provider_calls("telegram_bot.send_message")[0]
+    assert telegram["entity_id"] == "100000"
+    assert telegram["message"].endswith("\nLavatrice terminata")
+    echo = notifier.provider_calls("notify.alexa_media_echo_0")[0]
+    assert echo == {"message": "Lavatrice terminata"}
+
+
+async def test_concurrent_send_runs_targets_together(setup_notifier, conf):
+    conf["concurrent"] = True
+    notifier = await setup_notifier(conf, latency=0.01)
+    targets = ["telegram_0", "telegram_1", "telegram_2", "phone"]
+
+    response = await notifier.call("send", {"message": "x", "targets": targets})
+    assert sorted(response["sent"]) == sorted(targets)
+    assert notifier.services.max_in_flight == len(targets)
+
+    notifier.services.max_in_flight = 0
+    response = await notifier.call("send", {"message": "y", "targets": targets, "concurrent": False})
+    assert response["sent"] == targets
+    assert notifier.services.max_in_flight == 1
+
+
+async def test_failed_target_does_not_stop_the_others(setup_notifier, conf):
+    notifier = await setup_notifier(conf, failures=["notify.mobile_app_phone"])
+    response = await notifier.call("send", {"message": "x", "targets": ["phone", "telegram_0"]})
+    assert response["failed"] == ["phone"]
+    assert response["sent"] == ["telegram_0"]
+
+
+async def test_send_without_response_does_not_wait(setup_notifier, conf):
+    notifier = await setup_notifier(conf, latency=0.01)
+    response = await notifier.call(
+        "send", {"message": "x", "targets": ["telegram_0", "phone"]}, return_response=False,
+    )
+    assert response is None
+    # Gli invii partono in background, dopo il ritorno dell'handler
+    assert notifier.services.log == []
+
+    await notifier.hass.async_block_till_done()
+    assert len(notifier.services.log) == 2
+
+
+async def test_send_many_shares_one_dispatch(setup_notifier, conf):
+    notifier = await setup_notifier(conf)
+    response = await notifier.call("send_many", {"notifications": [
+        {"message": f"Report {i}", "targets": ["telegram_0", "phone"]} for i in range(3)
+    ]})
+    assert response["sent"].count("telegram_0") == 3
+    assert response["sent"].count("phone") == 3
+    messages = [payload["message"] for payload in notifier.provider_calls("telegram_bot.send_message")]
+    # Ogni canale riceve i messaggi nell'ordine del batch
+    assert [message[-8:] for message in messages] == ["Report 0", "Report 1", "Report 2"]
+
+
+async def test_groups_are_expanded_in_order(setup_notifier, conf):
+    conf["groups"] = {"speakers": ["echo_0", "echo_1"], "everyone": ["speakers", "phone"]}
+    notifier = await setup_notifier(conf)
+    response = await notifier.call("send", {"message": "x", "targets": ["everyone", "echo_0"]})
+    assert response["sent"] == ["echo_0", "echo_1", "phone"]
+
+
+async def test_background_send_fires_events_with_the_delivery_id(setup_notifier, conf):
+    notifier = await setup_notifier(conf, failures=["notify.mobile_app_phone"])
+    response = await notifier.call("send", {
+        "message": "x", "targets": ["telegram_0", "phone", "ghost"], "background": True,
+    })
+    assert response["pending"] == ["telegram_0", "phone"]
+    assert response["skipped"] == ["ghost"]
+    assert response["sent"] == []
+
+    await notifier.hass.async_block_till_done()
+    events = {data["target"]: (event_type, data) for event_type, data in notifier.hass.bus.events}
+    assert events["telegram_0"][0] == f"{DOMAIN}_delivered"
+    assert events["phone"][0] == f"{DOMAIN}_failed"
+    assert {data["delivery_id"] for _, data in events.values()} == {response["delivery_id"]}
+
+
+async def test_telegram_media_uses_url_and_caption(setup_notifier, conf):
+    conf["channels"]["telegram_1"]["alt_services"]["photo"]["service_data"] = {
+        "disable_notification": True,
+    }
+    notifier = await setup_notifier(conf)
+    await notifier.call("send", {
+        "message": "Movimento",
+        "targets": ["telegram_1", "telegram_2"],
+        "data": {"type": "photo"},
+        "target_data": {
+            "telegram_1": {"photo": "http://camera.local/snapshot.jpg"},
+            "telegram_2": {"photo": "http://camera.local/garage.jpg", "caption": "Garage"},
+        },
+    })
+    first, second = notifier.provider_calls("telegram_bot.send_photo")
+    assert first["url"] == "http://camera.local/snapshot.jpg"
+    assert first["caption"] == "Movimento"
+    assert first["disable_notification"] is True
+    assert "photo" not in first
+    assert second["caption"] == "Garage"
+    # Il service_data di un canale non finisce negli altri
+    assert "disable_notification" not in second
+
+
+async def test_voice_channel_with_several_players(setup_notifier, conf):
+    conf["channels"]["echo_0"]["service_data"] = {
+        "entity_id": ["media_player.kitchen", "media_player.bedroom"],
+    }
+    notifier = await setup_notifier(conf)
+    response = await notifier.call("send", {"message": "x", "targets": ["echo_0", "phone", "echo_1"]})
+    assert response["sent"] == ["echo_0", "phone", "echo_1"]
+    volume_calls = notifier.provider_calls("media_player.volume_set")
+    assert volume_calls[0]["entity_id"] == ["media_player.bedroom", "media_player.kitchen"]
+    assert volume_calls[1]["entity_id"] == "media_player.echo_1"
+
+
+async def test_throttled_channel_does_not_delay_the_next_targets(setup_notifier, conf):
+    conf["channels"]["telegram_0"]["rate_limit"] = {"rate": 20, "burst": 1}
+    notifier = await setup_notifier(conf)
+    response = await notifier.call("send_many", {"notifications": [
+        {"message": "first", "targets": ["telegram_0"]},
+        {"message": "second", "targets": ["telegram_0", "phone"]},
+    ]})
+    assert response["sent"].count("telegram_0") == 2
+    calls = [(name, data["message"][-6:]) for name, data in notifier.services.log]
+    # Il secondo messaggio Telegram attende il token; il telefono no
+    assert calls[-1] == ("telegram_bot.send_message", "second")
+    assert calls.index(("telegram_bot.send_message", "\nfirst")) < len(calls) - 1
+    assert ("notify.mobile_app_phone", "second") in calls[:-1]
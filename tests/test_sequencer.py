@@ -0,0 +1,137 @@
+# tests/test_sequencer.py
+
+import asyncio
+
+import pytest
+
+from custom_components.universal_notifier.sequencer import (
+    AnnouncementPreempted, PlayerSequencer, volume_target,
+)
+
+ECHO = "media_player.echo"
+KITCHEN = "media_player.kitchen"
+
+
+@pytest.fixture
+def volume_calls(hass):
+    """volume_set che aggiorna lo stato del player, come un Echo reale."""
+    calls = []
+
+    async def volume_set(call):
+        calls.append(call.data["volume_level"])
+        entity_ids = call.data["entity_id"]
+        for entity_id in [entity_ids] if isinstance(entity_ids, str) else entity_ids:
+            hass.states.async_set(entity_id, "idle", {"volume_level": call.data["volume_level"]})
+
+    hass.services.async_register("media_player", "volume_set", volume_set)
+    hass.states.async_set(ECHO, "idle", {"volume_level": 0.3})
+    return calls
+
+
+async def _announce(sequencer, log: list, name: str, duration: float,
+                    priority: bool = False, volume: float | None = None, player=ECHO) -> None:
+    async with sequencer.announcement(player, priority):
+        if volume is not None:
+            await sequencer.async_set_volume(player, volume)
+        log.append(f"{name}:start")
+        await sequencer.async_announce(player, priority, asyncio.sleep(duration))
+        log.append(f"{name}:end")
+
+
+async def test_announcements_on_the_same_player_do_not_overlap(hass, volume_calls):
+    sequencer = PlayerSequencer(hass, restore=False, restore_delay=0)
+    log = []
+    await asyncio.gather(
+        _announce(sequencer, log, "a", 0.02),
+        _announce(sequencer, log, "b", 0.02),
+    )
+    assert log == ["a:start", "a:end", "b:start", "b:end"]
+
+
+async def test_priority_preempts_the_routine_announcement(hass, volume_calls):
+    sequencer = PlayerSequencer(hass, restore=False, restore_delay=0)
+    log = []
+    routine = asyncio.create_task(_announce(sequencer, log, "routine", 5))
+    queued = asyncio.create_task(_announce(sequencer, log, "queued", 0.01))
+    await asyncio.sleep(0.01)
+
+    async with asyncio.timeout(1):
+        await _announce(sequencer, log, "alarm", 0.01, priority=True)
+        with pytest.raises(AnnouncementPreempted):
+            await routine
+        await queued
+    # L'allarme passa davanti all'annuncio ordinario in attesa
+    assert log == ["routine:start", "alarm:start", "alarm:end", "queued:start", "queued:end"]
+
+
+async def test_priority_does_not_preempt_priority(hass, volume_calls):
+    sequencer = PlayerSequencer(hass, restore=False, restore_delay=0)
+    log = []
+    await asyncio.gather(
+        _announce(sequencer, log, "first", 0.02, priority=True),
+        _announce(sequencer, log, "second", 0.01, priority=True),
+    )
+    assert log == ["first:start", "first:end", "second:start", "second:end"]
+
+
+async def test_volume_is_set_once_per_burst_and_restored(hass, volume_calls):
+    sequencer = PlayerSequencer(hass, restore=True, restore_delay=0.05)
+    log = []
+    await _announce(sequencer, log, "a", 0.01, volume=0.6)
+    await _announce(sequencer, log, "b", 0.01, volume=0.6)
+    assert volume_calls == [0.6]
+    assert sequencer.state() == {ECHO: {"pending": 0, "restore_to": 0.3}}
+
+    await asyncio.sleep(0.1)
+    await hass.async_block_till_done()
+    assert volume_calls == [0.6, 0.3]
+    assert sequencer.state() == {}
+
+
+async def test_announcement_during_restore_delay_extends_the_burst(hass, volume_calls):
+    sequencer = PlayerSequencer(hass, restore=True, restore_delay=0.05)
+    log = []
+    await _announce(sequencer, log, "a", 0.01, volume=0.6)
+    await asyncio.sleep(0.02)
+    await _announce(sequencer, log, "b", 0.01, volume=0.9)
+    await asyncio.sleep(0.03)
+    # Il primo timer di ripristino è stato annullato dal secondo annuncio
+    assert volume_calls == [0.6, 0.9]
+
+    await asyncio.sleep(0.05)
+    await hass.async_block_till_done()
+    assert volume_calls == [0.6, 0.9, 0.3]
+
+
+async def test_stop_cancels_pending_restores(hass, volume_calls):
+    sequencer = PlayerSequencer(hass, restore=True, restore_delay=0.05)
+    await _announce(sequencer, [], "a", 0.01, volume=0.6)
+    sequencer.async_stop()
+    await asyncio.sleep(0.1)
+    await hass.async_block_till_done()
+    assert volume_calls == [0.6]
+
+
+def test_volume_target_normalizes_entity_ids():
+    assert volume_target(None) is None
+    assert volume_target("Media_Player.Echo") == ECHO
+    assert volume_target([KITCHEN, ECHO, KITCHEN]) == [ECHO, KITCHEN]
+    assert volume_target(f"{KITCHEN}, {ECHO}") == [ECHO, KITCHEN]
+    assert volume_target(["not an entity"]) is None
+
+
+async def test_multi_player_announcement_holds_every_player(hass, volume_calls):
+    hass.states.async_set(KITCHEN, "idle", {"volume_level": 0.6})
+    sequencer = PlayerSequencer(hass, restore=False, restore_delay=0)
+    log = []
+    await asyncio.gather(
+        _announce(sequencer, log, "echo", 0.02),
+        _announce(sequencer, log, "both", 0.02, volume=0.6, player=[ECHO, KITCHEN]),
+        _announce(sequencer, log, "kitchen", 0.02, player=KITCHEN),
+    )
+    assert log == [
+        "echo:start", "kitchen:start", "echo:end", "kitchen:end", "both:start", "both:end",
+    ]
+    # Un solo volume_set, per il player che non era già al livello richiesto
+    assert volume_calls == [0.6]
+    assert hass.states.get(ECHO).attributes["volume_level"] == 0.6
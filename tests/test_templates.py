@@ -0,0 +1,63 @@
+# tests/test_templates.py
+
+from custom_components.universal_notifier.render import MessageRenderer
+from custom_components.universal_notifier.templates import TemplateCache
+
+
+def test_templates_are_compiled_once(hass):
+    cache = TemplateCache(hass, max_size=10)
+    first = cache.get("{{ message }} ({{ target }})")
+    assert cache.get("{{ message }} ({{ target }})") is first
+    assert first.uses_target
+    assert not cache.get("{{ time }} · {{ message }}").uses_target
+    assert len(cache) == 2
+    assert cache.get(None) is None
+
+
+def test_invalid_templates_are_ignored(hass):
+    cache = TemplateCache(hass, max_size=10)
+    assert cache.get("{{ message ") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_template_is_evicted(hass):
+    cache = TemplateCache(hass, max_size=2)
+    first = cache.get("{{ message }} 1")
+    cache.get("{{ message }} 2")
+    # "1" torna il più recente: esce "2"
+    assert cache.get("{{ message }} 1") is first
+    cache.get("{{ message }} 3")
+    assert len(cache) == 2
+    assert cache.get("{{ message }} 1") is first
+
+
+def test_render_failure_returns_none(hass):
+    template = TemplateCache(hass, max_size=10).get("{{ message | int(strict=true) }}")
+    assert template.render({"message": "abc"}) is None
+
+
+def test_renderer_renders_once_unless_the_target_is_used(hass):
+    cache = TemplateCache(hass, max_size=10)
+    renderer = MessageRenderer("Hal9000", "12:30", "Ciao", "Allarme", slot="morning")
+    shared = cache.get("{{ name }} {{ time }} {{ slot }}: {{ title }} - {{ message }}")
+    per_target = cache.get("{{ message }} per {{ target }}")
+
+    rendered = renderer.render_template(shared, "x", "tg")
+    assert rendered == "Hal9000 12:30 morning: Allarme - x"
+    assert renderer.render_template(shared, "x", "phone") is rendered
+    assert renderer.render_template(per_target, "x", "tg") == "x per tg"
+    assert renderer.render_template(per_target, "x", "phone") == "x per phone"
+
+
+async def test_channel_templates_replace_the_standard_format(setup_notifier, conf):
+    conf["channels"]["phone"]["message_template"] = "{{ message }} @ {{ target }}"
+    conf["channels"]["phone"]["title_template"] = "{{ title or name }}!"
+    notifier = await setup_notifier(conf)
+    await notifier.call("send", {"message": "Porta aperta", "targets": ["phone", "telegram_0"]})
+
+    phone = notifier.provider_calls("notify.mobile_app_phone")[0]
+    assert phone["message"] == "Porta aperta @ phone"
+    assert phone["title"].endswith("!")
+    # Il canale senza template resta con il formato [nome - ora]
+    telegram = notifier.provider_calls("telegram_bot.send_message")[0]
+    assert telegram["message"].startswith("<b>[")